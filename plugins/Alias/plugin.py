@@ -101,6 +101,74 @@ def findBiggestAt(alias):
     else:
         return 0
 
+class AliasTemplate(object):
+    """The tokens of an alias, tokenized once, with slots for $nick, $channel,
+    and the arguments ($1, @1, $*) the alias is given when it's called."""
+    slotRe = re.compile(r'\$(nick|channel|\*|\d+)|@(\d+)')
+    def __init__(self, tokens, biggestDollar=0, biggestAt=0):
+        self.biggestDollar = biggestDollar
+        self.biggestAt = biggestAt
+        self.tokens = self._compile(tokens)
+
+    def _compile(self, tokens):
+        ret = []
+        for token in tokens:
+            if isinstance(token, list):
+                ret.append(self._compile(token))
+            elif token == '$*':
+                ret.append(None) # Replaced by all the remaining arguments.
+            else:
+                ret.append(self._compileToken(token))
+        return ret
+
+    def _compileToken(self, token):
+        # Tokens with slots become a (format, slots) pair, where each slot is
+        # a (kind, index) pair into the values given to _fill.
+        format = []
+        slots = []
+        last = 0
+        for m in self.slotRe.finditer(token):
+            (name, at) = m.groups()
+            if at is not None:
+                if not self.biggestAt:
+                    continue
+                slot = ('@', int(at) - 1)
+            elif name.isdigit():
+                slot = ('$', int(name) - 1)
+            else:
+                slot = (name, 0)
+            format.append(token[last:m.start()].replace('%', '%%'))
+            format.append('%s')
+            slots.append(slot)
+            last = m.end()
+        if not slots:
+            return token
+        format.append(token[last:].replace('%', '%%'))
+        return (''.join(format), slots)
+
+    def fill(self, nick, channel, args):
+        """Returns the tokens of the alias with its slots filled in, as a new
+        list."""
+        rest = args[self.biggestDollar:]
+        values = {'nick': [nick], 'channel': [channel], '$': args, '@': rest,
+                  '*': [' '.join(rest)]}
+        return self._fill(self.tokens, values, rest)
+
+    def _fill(self, tokens, values, rest):
+        ret = []
+        for token in tokens:
+            if token is None:
+                ret.extend(rest)
+            elif isinstance(token, list):
+                ret.append(self._fill(token, values, rest))
+            elif isinstance(token, tuple):
+                (format, slots) = token
+                ret.append(format % tuple([values[kind][i]
+                                           for (kind, i) in slots]))
+            else:
+                ret.append(token)
+        return ret
+
 def makeNewAlias(name, alias):
     original = alias
     biggestDollar = findBiggestDollar(original)
@@ -110,53 +178,18 @@ def makeNewAlias(name, alias):
         raise AliasError, 'Can\'t mix $* and optional args (@1, etc.)'
     if original.count('$*') > 1:
         raise AliasError, 'There can be only one $* in an alias.'
-    testTokens = callbacks.tokenize(original)
-    if testTokens and isinstance(testTokens[0], list):
+    tokens = callbacks.tokenize(original)
+    if tokens and isinstance(tokens[0], list):
         raise AliasError, 'Commands may not be the result of nesting.'
+    template = AliasTemplate(tokens, biggestDollar, biggestAt)
     def f(self, irc, msg, args):
-        alias = original.replace('$nick', msg.nick)
+        channel = None
         if '$channel' in original:
             channel = getChannel(msg, args)
-            alias = alias.replace('$channel', channel)
-        tokens = callbacks.tokenize(alias)
         if biggestDollar or biggestAt:
             args = getArgs(args, required=biggestDollar, optional=biggestAt,
                             wildcard=wildcard)
-        def regexpReplace(m):
-            idx = int(m.group(1))
-            return args[idx-1]
-        def replace(tokens, replacer):
-            for (i, token) in enumerate(tokens):
-                if isinstance(token, list):
-                    replace(token, replacer)
-                else:
-                    tokens[i] = replacer(token)
-        replace(tokens, lambda s: dollarRe.sub(regexpReplace, s))
-        if biggestAt:
-            assert not wildcard
-            args = args[biggestDollar:]
-            replace(tokens, lambda s: atRe.sub(regexpReplace, s))
-        if wildcard:
-            assert not biggestAt
-            # Gotta remove the things that have already been subbed in.
-            i = biggestDollar
-            while i:
-                args.pop(0)
-                i -= 1
-            def everythingReplace(tokens):
-                for (i, token) in enumerate(tokens):
-                    if isinstance(token, list):
-                        if everythingReplace(token):
-                            return
-                    if token == '$*':
-                        tokens[i:i+1] = args
-                        return True
-                    elif '$*' in token:
-                        tokens[i] = token.replace('$*', ' '.join(args))
-                        return True
-                return False
-            everythingReplace(tokens)
-        self.Proxy(irc, msg, tokens)
+        self.Proxy(irc, msg, template.fill(msg.nick, channel, args))
     flexargs = ''
     if biggestDollar and (wildcard or biggestAt):
         flexargs = ' at least'
@@ -271,6 +304,7 @@ class Alias(callbacks.Plugin):
         conf.registerGlobalValue(aliasGroup.get(name), 'locked',
                                  registry.Boolean(lock, ''))
         self.aliases[name] = [alias, lock, f]
+        callbacks.invalidateCommands(self)
 
     def removeAlias(self, name, evenIfLocked=False):
         name = callbacks.canonicalName(name)
@@ -278,6 +312,7 @@ class Alias(callbacks.Plugin):
             if evenIfLocked or not self.aliases[name][1]:
                 del self.aliases[name]
                 conf.supybot.plugins.Alias.aliases.unregister(name)
+                callbacks.invalidateCommands(self)
             else:
                 raise AliasError, 'That alias is locked.'
         else:
@@ -112,6 +112,12 @@ class AliasTestCase(ChannelPluginTestCase):
         self.assertResponse('myrepr foo', '"foo"')
         self.assertResponse('myrepr ""', '""')
 
+    def testArgumentsAreNotSubstitutedInto(self):
+        self.assertNotError('alias add both "echo $1 @1"')
+        self.assertResponse('both @1 foo', '@1 foo')
+        self.assertNotError('alias add brackets "echo $1"')
+        self.assertResponse('brackets "[foo]"', '[foo]')
+
     def testNoExtraSpaces(self):
         self.assertNotError('alias add foo "action takes $1\'s money"')
         self.assertResponse('foo bar', '\x01ACTION takes bar\'s money\x01')
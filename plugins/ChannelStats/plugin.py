@@ -124,9 +124,10 @@ class UserStat(ChannelStat):
         self.doPayload(msg.args[0], msg.args[2])
         self.kicks += 1
 
-class StatsDB(plugins.ChannelUserDB):
+class StatsDB(plugins.JournaledChannelUserDB):
+    mutable = True
     def __init__(self, *args, **kwargs):
-        plugins.ChannelUserDB.__init__(self, *args, **kwargs)
+        plugins.JournaledChannelUserDB.__init__(self, *args, **kwargs)
 
     def serialize(self, v):
         return v.values()
@@ -165,8 +166,6 @@ class ChannelStats(callbacks.Plugin):
     def __init__(self, irc):
         self.__parent = super(ChannelStats, self)
         self.__parent.__init__(irc)
-        self.lastmsg = None
-        self.laststate = None
         self.outFiltering = False
         self.db = StatsDB(filename)
         self._flush = self.db.flush
@@ -178,13 +177,6 @@ class ChannelStats(callbacks.Plugin):
         self.__parent.die()
 
     def __call__(self, irc, msg):
-        try:
-            if self.lastmsg:
-                self.laststate.addMsg(irc, self.lastmsg)
-            else:
-                self.laststate = irc.state.copy()
-        finally:
-            self.lastmsg = msg
         self.db.addMsg(msg)
         super(ChannelStats, self).__call__(irc, msg)
 
@@ -217,15 +209,14 @@ class ChannelStats(callbacks.Plugin):
             id = ircdb.users.getUserId(msg.prefix)
         except KeyError:
             id = None
-        for (channel, c) in self.laststate.channels.iteritems():
-            if msg.nick in c.users:
-                if (channel, 'channelStats') not in self.db:
-                    self.db[channel, 'channelStats'] = ChannelStat()
-                self.db[channel, 'channelStats'].quits += 1
-                if id is not None:
-                    if (channel, id) not in self.db:
-                        self.db[channel, id] = UserStat()
-                    self.db[channel, id].quits += 1
+        for channel in msg.channels or ():
+            if (channel, 'channelStats') not in self.db:
+                self.db[channel, 'channelStats'] = ChannelStat()
+            self.db[channel, 'channelStats'].quits += 1
+            if id is not None:
+                if (channel, id) not in self.db:
+                    self.db[channel, id] = UserStat()
+                self.db[channel, id].quits += 1
 
     def doKick(self, irc, msg):
         (channel, nick, _) = msg.args
@@ -236,7 +227,7 @@ class ChannelStats(callbacks.Plugin):
             return
         if (channel, id) not in self.db:
             self.db[channel, id] = UserStat()
-        self.db.channels[channel][id].kicked += 1
+        self.db[channel, id].kicked += 1
 
     def stats(self, irc, msg, args, channel, name):
         """[<channel>] [<name>]
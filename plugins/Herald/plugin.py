@@ -43,7 +43,7 @@ from supybot.utils.structures import TimeoutQueue
 
 filename = conf.supybot.directories.data.dirize('Herald.db')
 
-class HeraldDB(plugins.ChannelUserDB):
+class HeraldDB(plugins.JournaledChannelUserDB):
     def serialize(self, v):
         return [v]
 
@@ -28,6 +28,8 @@
 # POSSIBILITY OF SUCH DAMAGE.
 ###
 
+import os
+import re
 import csv
 import time
 import datetime
@@ -45,12 +47,20 @@ class Later(callbacks.Plugin):
     nick-based notes.  Do note (haha!) that these notes are *not* private
     and don't even pretend to be; if you want such features, consider using the
     Note plugin."""
+    # Changes to the notes are appended to a journal next to the database; the
+    # database itself is only rewritten once the journal has more lines than
+    # this, or than there are nicks with notes, whichever is more.
+    minJournalSize = 1000
     def __init__(self, irc):
         self.__parent = super(Later, self)
         self.__parent.__init__(irc)
         self._notes = ircutils.IrcDict()
-        self.wildcards = []
+        self.wildcards = ircutils.IrcSet()
+        self._wildcardMatch = None
+        self._oldest = None
         self.filename = conf.supybot.directories.data.dirize('Later.db')
+        self.journalFilename = self.filename + '.journal'
+        self.journaled = 0
         self._openNotes()
 
     def die(self):
@@ -63,17 +73,67 @@ class Later(callbacks.Plugin):
             for (time, whence, text) in notes:
                 writer.writerow([nick, time, whence, text])
         fd.close()
+        # Everything in the journal is in the database now.
+        if os.path.exists(self.journalFilename):
+            os.remove(self.journalFilename)
+        self.journaled = 0
+
+    def _journal(self, *rows):
+        fd = file(self.journalFilename, 'ab')
+        try:
+            csv.writer(fd).writerows(rows)
+        finally:
+            fd.close()
+        self.journaled += len(rows)
+        if self.journaled > max(self.minJournalSize, len(self._notes)):
+            self._flushNotes()
 
     def _openNotes(self):
         try:
             fd = file(self.filename)
         except EnvironmentError, e:
             self.log.warning('Couldn\'t open %s: %s', self.filename, e)
+        else:
+            reader = csv.reader(fd)
+            for (nick, time, whence, text) in reader:
+                self._insertNote(nick, float(time), whence, text)
+            fd.close()
+        self._replayJournal()
+
+    def _replayJournal(self):
+        # If we died after the database was rewritten but before the journal
+        # was removed, the journal is replayed on top of what it already has;
+        # that's harmless, since its notes aren't inserted a second time.
+        try:
+            fd = file(self.journalFilename)
+        except EnvironmentError:
             return
-        reader = csv.reader(fd)
-        for (nick, time, whence, text) in reader:
-            self._addNote(nick, whence, text, at=float(time), maximum=0)
+        lineno = 0
+        try:
+            for t in csv.reader(fd):
+                lineno += 1
+                try:
+                    if t[0] == '+':
+                        (nick, time, whence, text) = t[1:]
+                        note = (float(time), whence, text)
+                        if note not in self._notes.get(nick, ()):
+                            self._insertNote(nick, *note)
+                    elif t[0] == '-':
+                        self._removeNotes(t[1])
+                    elif t[0] == '<':
+                        self._expire(float(t[1]), int(t[2]))
+                    else:
+                        raise ValueError, 'invalid operation: %r' % t[0]
+                except Exception, e:
+                    self.log.warning('Invalid line #%s in %s.',
+                                     lineno, self.journalFilename)
+                    self.log.debug('Exception: %s', utils.exnToString(e))
+        except Exception, e: # This catches exceptions from csv.reader.
+            self.log.warning('Invalid line #%s in %s.',
+                             lineno, self.journalFilename)
+            self.log.debug('Exception: %s', utils.exnToString(e))
         fd.close()
+        self.journaled = lineno
 
     def _timestamp(self, when):
         #format = conf.supybot.reply.format.time()
@@ -88,17 +148,43 @@ class Later(callbacks.Plugin):
             at = time.time()
         if maximum is None:
             maximum = self.registryValue('maximum')
+        if maximum and len(self._notes.get(nick, ())) >= maximum:
+            raise ValueError
+        self._insertNote(nick, at, whence, text)
+        self._journal(['+', nick, at, whence, text])
+
+    def _insertNote(self, nick, at, whence, text):
         try:
-            notes = self._notes[nick]
-            if maximum and len(notes) >= maximum:
-                raise ValueError
-            else:
-                notes.append((at, whence, text))
+            self._notes[nick].append((at, whence, text))
         except KeyError:
             self._notes[nick] = [(at, whence, text)]
-        if '?' in nick or '*' in nick and nick not in self.wildcards:
-            self.wildcards.append(nick)
-        self._flushNotes()
+        if ('?' in nick or '*' in nick) and nick not in self.wildcards:
+            self.wildcards.add(nick)
+            self._wildcardMatch = None
+        if self._oldest is None or at < self._oldest:
+            self._oldest = at
+
+    def _removeNotes(self, nick):
+        """Removes and returns the notes waiting on nick."""
+        notes = self._notes.pop(nick, [])
+        if nick in self.wildcards:
+            self.wildcards.remove(nick)
+            self._wildcardMatch = None
+        return notes
+
+    def _matchingWildcards(self, nick):
+        if not self.wildcards:
+            return []
+        if self._wildcardMatch is None:
+            # One regexp matching any of the wildcards tells us whether we
+            # need to check them one by one, which most nicks don't.
+            regexps = map(ircutils.hostmaskPatternRegexp, self.wildcards)
+            self._wildcardMatch = re.compile('(?:%s)$' % '|'.join(regexps),
+                                             re.I).match
+        if self._wildcardMatch(nick) is None:
+            return []
+        return [wildcard for wildcard in self.wildcards
+                if ircutils.hostmaskPatternEqual(wildcard, nick)]
     
     def _validateNick(self, irc, nick):
         """Validate nick according to the IRC RFC 2812 spec.
@@ -122,20 +208,35 @@ class Later(callbacks.Plugin):
     def _deleteExpired(self):
         expiry = self.registryValue('messageExpiry')
         curtime = time.time()
+        # Nothing has expired unless the oldest note has.
+        if self._oldest is None or \
+           datetime.timedelta(seconds=(curtime - self._oldest)).days <= expiry:
+            return
+        if self._expire(curtime, expiry):
+            self._journal(['<', curtime, expiry])
+
+    def _expire(self, curtime, expiry):
+        """Removes the notes more than expiry days older than curtime, and
+        returns whether there were any."""
         nickremovals=[]
+        expired = False
+        self._oldest = None
         for (nick, notes) in self._notes.iteritems():
             removals = []
             for (notetime, whence, text) in notes:
                 td = datetime.timedelta(seconds=(curtime - notetime))
                 if td.days > expiry:
                     removals.append((notetime, whence, text))
+                elif self._oldest is None or notetime < self._oldest:
+                    self._oldest = notetime
             for note in removals:
                 notes.remove(note)
+                expired = True
             if len(notes) == 0:
                 nickremovals.append(nick)
         for nick in nickremovals:
-            del self._notes[nick]
-        self._flushNotes()
+            self._removeNotes(nick)
+        return expired
     
     ## Note: we call _deleteExpired from 'tell'. This means that it's possible
     ## for expired notes to remain in the database for longer than the maximum,
@@ -194,33 +295,30 @@ class Later(callbacks.Plugin):
 
         Removes the notes waiting on <nick>.
         """
-        try:
-            del self._notes[nick]
-            self._flushNotes()
+        if nick in self._notes:
+            self._removeNotes(nick)
+            self._journal(['-', nick])
             irc.replySuccess()
-        except KeyError:
+        else:
             irc.error('There were no notes for %r' % nick)
     remove = wrap(remove, [('checkCapability', 'admin'), 'something'])
 
     def doPrivmsg(self, irc, msg):
         if ircmsgs.isCtcp(msg) and not ircmsgs.isAction(msg):
             return
-        notes = self._notes.pop(msg.nick, [])
-        # Let's try wildcards.
-        removals = []
-        for wildcard in self.wildcards:
-            if ircutils.hostmaskPatternEqual(wildcard, msg.nick):
-                removals.append(wildcard)
-                notes.extend(self._notes.pop(wildcard))
-            for removal in removals:
-                self.wildcards.remove(removal)
-        if notes:
+        nicks = self._matchingWildcards(msg.nick)
+        if msg.nick in self._notes:
+            nicks.insert(0, msg.nick)
+        if nicks:
+            notes = []
+            for nick in nicks:
+                notes.extend(self._removeNotes(nick))
+            self._journal(*[['-', nick] for nick in nicks])
             irc = callbacks.SimpleProxy(irc, msg)
             private = self.registryValue('private')
             for (when, whence, note) in notes:
                 s = self._formatNote(when, whence, note)
                 irc.reply(s, private=private)
-            self._flushNotes()
 
     def _formatNote(self, when, whence, note):
         return 'Sent %s: <%s> %s' % (self._timestamp(when), whence, note)
@@ -73,6 +73,43 @@ class LaterTestCase(ChannelPluginTestCase):
         self.failUnless(str(m).startswith('PRIVMSG foo :Sent just now: <test> stuff'))
         self.assertNotRegexp('later notes', 'foo')
         self.assertRegexp('later notes', 'bar')
+
+    def testWildcardNoteSend(self):
+        cb = self.irc.getCallback('Later')
+        cb._addNote('fo*', 'test', 'stuff')
+        cb._addNote('b?r', 'test', 'more stuff')
+        self.irc.feedMsg(ircmsgs.privmsg(self.channel, 'something',
+                                         prefix='quux!bar@baz'))
+        self.assertNoResponse(' ', 0)
+        self.irc.feedMsg(ircmsgs.privmsg(self.channel, 'something',
+                                         prefix='Foo!bar@baz'))
+        m = self.getMsg(' ')
+        self.failUnless(str(m).startswith('PRIVMSG Foo :Sent just now: '
+                                          '<test> stuff'))
+        self.assertNotRegexp('later notes', r'fo\*')
+        self.assertRegexp('later notes', r'b\?r')
+
+    def testNotesAreJournaled(self):
+        cb = self.irc.getCallback('Later')
+        self.assertNotError('later tell foo stuff')
+        self.assertNotError('later tell bar more stuff')
+        self.assertNotError('later remove bar')
+        cb._addNote('ba*', 'test', 'wild stuff')
+        self.failUnless(os.path.exists(cb.journalFilename))
+        def notes(cb):
+            L = [(nick, [(whence, text) for (_, whence, text) in notes])
+                 for (nick, notes) in cb._notes.iteritems()]
+            L.sort()
+            return L
+        expected = [('ba*', [('test', 'wild stuff')]),
+                    ('foo', [('test', 'stuff')])]
+        self.assertEqual(notes(cb), expected)
+        other = cb.__class__(self.irc)
+        self.assertEqual(notes(other), expected)
+        self.failUnless('ba*' in other.wildcards)
+        other._flushNotes()
+        self.failIf(os.path.exists(cb.journalFilename))
+        self.assertEqual(notes(cb.__class__(self.irc)), expected)
         
 # vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
 
@@ -40,6 +40,8 @@ import supybot.ircdb as ircdb
 import re
 import os
 import time
+import sre_parse
+import sre_constants
 
 #try:
     #import sqlite
@@ -61,6 +63,44 @@ import supybot.world as world
 import supybot.log as log
 
 
+def requiredLiteral(regexp):
+    """Returns a string that must be in any string regexp matches (the longest
+    run of literal characters at the top level of regexp), or '' if there is
+    no such string."""
+    try:
+        parsed = sre_parse.parse(regexp)
+    except sre_constants.error:
+        return ''
+    (longest, current) = ('', '')
+    for (op, av) in parsed:
+        if op is sre_constants.LITERAL and av < 256:
+            current += chr(av)
+        else:
+            current = ''
+        if len(current) > len(longest):
+            longest = current
+    if parsed.pattern.flags & re.IGNORECASE:
+        longest = longest.lower()
+    return longest
+
+class Trigger(object):
+    """A regexp trigger, compiled along with the literal string any message
+    it matches has to contain, so most messages never reach the regexp."""
+    def __init__(self, regexp, action):
+        self.regexp = regexp
+        self.action = action
+        self.compiled = re.compile(regexp)
+        self.literal = requiredLiteral(regexp)
+        self.ignoreCase = bool(self.compiled.flags & re.IGNORECASE)
+
+    def finditer(self, text, lowered):
+        if self.ignoreCase:
+            if self.literal not in lowered:
+                return ()
+        elif self.literal not in text:
+            return ()
+        return self.compiled.finditer(text)
+
 class MessageParser(callbacks.Plugin, plugins.ChannelDBHandler):
     """This plugin can set regexp triggers to activate the bot.
     Use 'add' command to add regexp trigger, 'remove' to remove."""
@@ -68,6 +108,25 @@ class MessageParser(callbacks.Plugin, plugins.ChannelDBHandler):
     def __init__(self, irc):
         callbacks.Plugin.__init__(self, irc)
         plugins.ChannelDBHandler.__init__(self)
+        # Compiled triggers for each channel, dropped whenever the triggers
+        # in its database change.  Changes are made in other threads, so each
+        # one also bumps the channel's generation; triggers read from the
+        # database before a change aren't cached after it.
+        self.triggers = ircutils.IrcDict()
+        self.generations = ircutils.IrcDict()
+        self.triggersLock = threading.Lock()
+        # Usage counts not yet written to the database, so we don't write to
+        # the database for every trigger that fires.
+        self.ranks = ircutils.IrcDict()
+        self.ranksLock = threading.Lock()
+        world.flushers.append(self._flushRanks)
+
+    def die(self):
+        self._flushRanks()
+        if self._flushRanks in world.flushers:
+            world.flushers.remove(self._flushRanks)
+        plugins.ChannelDBHandler.die(self)
+        callbacks.Plugin.die(self)
     
     def makeDb(self, filename):
         """Create the database and connect to it."""
@@ -106,14 +165,71 @@ class MessageParser(callbacks.Plugin, plugins.ChannelDBHandler):
     
     def _updateRank(self, channel, regexp):
         if self.registryValue('keepRankInfo', channel):
+            self.ranksLock.acquire()
+            try:
+                counts = self.ranks.setdefault(channel, {})
+                counts[regexp] = counts.get(regexp, 0) + 1
+            finally:
+                self.ranksLock.release()
+
+    def _flushRanks(self, channel=None):
+        """Writes the usage counts gathered since the last flush (for
+        channel, or for every channel if it's None) to the database."""
+        self.ranksLock.acquire()
+        try:
+            if channel is None:
+                ranks = self.ranks.items()
+                self.ranks.clear()
+            elif channel in self.ranks:
+                ranks = [(channel, self.ranks.pop(channel))]
+            else:
+                ranks = []
+        finally:
+            self.ranksLock.release()
+        for (channel, counts) in ranks:
             db = self.getDb(channel)
             cursor = db.cursor()
-            cursor.execute("""SELECT usage_count
-                      FROM triggers
-                      WHERE regexp=?""", (regexp,))
-            old_count = cursor.fetchall()[0][0]
-            cursor.execute("UPDATE triggers SET usage_count=? WHERE regexp=?", (old_count + 1, regexp,))
+            cursor.executemany("""UPDATE triggers
+                                  SET usage_count=usage_count+?
+                                  WHERE regexp=?""",
+                               [(n, regexp) for (regexp, n) in counts.items()])
             db.commit()
+
+    def _getTriggers(self, channel):
+        self.triggersLock.acquire()
+        try:
+            if channel in self.triggers:
+                return self.triggers[channel]
+            generation = self.generations.get(channel, 0)
+        finally:
+            self.triggersLock.release()
+        db = self.getDb(channel)
+        cursor = db.cursor()
+        cursor.execute("SELECT regexp, action FROM triggers")
+        triggers = []
+        for (regexp, action) in cursor.fetchall():
+            try:
+                triggers.append(Trigger(regexp, action))
+            except re.error, e:
+                self.log.warning('Invalid regexp trigger %q in %s: %s',
+                                 regexp, channel, e)
+        self.triggersLock.acquire()
+        try:
+            if self.generations.get(channel, 0) == generation:
+                self.triggers[channel] = triggers
+        finally:
+            self.triggersLock.release()
+        return triggers
+
+    def _invalidateTriggers(self, channel):
+        """Drops the cached triggers for channel.  Call this after committing
+        a change to its triggers."""
+        self.triggersLock.acquire()
+        try:
+            self.generations[channel] = self.generations.get(channel, 0) + 1
+            self.triggers.pop(channel, None)
+        finally:
+            self.triggersLock.release()
     
     def _runCommandFunction(self, irc, msg, command):
         """Run a command from message, as if command was sent over IRC."""
@@ -146,17 +262,13 @@ class MessageParser(callbacks.Plugin, plugins.ChannelDBHandler):
             if callbacks.addressed(irc.nick, msg): #message is direct command
                 return
             actions = []
-            db = self.getDb(channel)
-            cursor = db.cursor()
-            cursor.execute("SELECT regexp, action FROM triggers")
-            results = cursor.fetchall()
-            if len(results) == 0:
-                return
-            for (regexp, action) in results:
-                for match in re.finditer(regexp, msg.args[1]):
+            text = msg.args[1]
+            lowered = text.lower()
+            for trigger in self._getTriggers(channel):
+                for match in trigger.finditer(text, lowered):
                     if match is not None:
-                        thisaction = action
-                        self._updateRank(channel, regexp)
+                        thisaction = trigger.action
+                        self._updateRank(channel, trigger.regexp)
                         for (i, j) in enumerate(match.groups()):
                             thisaction = re.sub(r'\$' + str(i+1), match.group(i+1), thisaction)
                         actions.append(thisaction)
@@ -174,6 +286,7 @@ class MessageParser(callbacks.Plugin, plugins.ChannelDBHandler):
         if not self._checkManageCapabilities(irc, msg, channel):
             capabilities = self.registryValue('requireManageCapability')
             irc.errorNoCapability(capabilities, Raise=True)
+        self._flushRanks(channel)
         db = self.getDb(channel)
         cursor = db.cursor()
         cursor.execute("SELECT id, usage_count, locked FROM triggers WHERE regexp=?", (regexp,))
@@ -197,6 +310,7 @@ class MessageParser(callbacks.Plugin, plugins.ChannelDBHandler):
                               (NULL, ?, ?, ?, ?, ?, ?)""",
                             (regexp, name, int(time.time()), usage_count, action, locked,))
             db.commit()
+            self._invalidateTriggers(channel)
             irc.replySuccess()
         else:
             irc.error('That trigger is locked.')
@@ -235,6 +349,7 @@ class MessageParser(callbacks.Plugin, plugins.ChannelDBHandler):
         
         cursor.execute("""DELETE FROM triggers WHERE id=?""", (id,))
         db.commit()
+        self._invalidateTriggers(channel)
         irc.replySuccess()
     remove = wrap(remove, ['channel',
                             getopts({'id': '',}),
@@ -320,6 +435,7 @@ class MessageParser(callbacks.Plugin, plugins.ChannelDBHandler):
         itself.
         If option --id specified, will retrieve by regexp id, not content.
         """
+        self._flushRanks(channel)
         db = self.getDb(channel)
         cursor = db.cursor()
         target = 'regexp'
@@ -381,6 +497,7 @@ class MessageParser(callbacks.Plugin, plugins.ChannelDBHandler):
         message isn't sent in the channel itself.
         """
         numregexps = self.registryValue('rankListLength', channel)
+        self._flushRanks(channel)
         db = self.getDb(channel)
         cursor = db.cursor()
         cursor.execute("""SELECT regexp, usage_count
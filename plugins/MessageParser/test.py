@@ -30,11 +30,25 @@
 
 from supybot.test import *
 
+import supybot.plugin as plugin
+
 try:
     import sqlite3
 except ImportError:
     from pysqlite2 import dbapi2 as sqlite3 # for python2.4
 
+MessageParser = plugin.loadPluginModule('MessageParser')
+
+class RequiredLiteralTestCase(SupyTestCase):
+    def test(self):
+        requiredLiteral = MessageParser.plugin.requiredLiteral
+        self.assertEqual(requiredLiteral('stuff'), 'stuff')
+        self.assertEqual(requiredLiteral('ab+cdef.g'), 'cdef')
+        self.assertEqual(requiredLiteral('(?i)StUfF'), 'stuff')
+        self.assertEqual(requiredLiteral('foo|barbaz'), '')
+        self.assertEqual(requiredLiteral('a?'), '')
+        self.assertEqual(requiredLiteral('[a'), '')
+
 
 class MessageParserTestCase(ChannelPluginTestCase):
     plugins = ('MessageParser','Utilities','User') 
@@ -89,7 +103,35 @@ class MessageParserTestCase(ChannelPluginTestCase):
         self.feedMsg('this message has some stuff in it')
         m = self.getMsg(' ')
         self.failUnless(str(m).startswith('PRIVMSG #test :i saw some stuff'))
+
+    def testTriggersFollowChanges(self):
+        self.assertNotError('messageparser add "stuff" "echo i saw some stuff"')
+        self.feedMsg('this message has some stuff in it')
+        self.assertResponse(' ', 'i saw some stuff')
+        self.assertNotError('messageparser add "(?i)THINGS" "echo things"')
+        self.feedMsg('some things')
+        self.assertResponse(' ', 'things')
+        self.assertNotError('messageparser remove "stuff"')
+        self.feedMsg('this message has some stuff in it')
+        self.assertNoResponse(' ', 1)
     
+    def testChangeWhileReadingTriggersIsNotLost(self):
+        cb = self.irc.getCallback('MessageParser')
+        getDb = cb.getDb
+        def changingGetDb(channel):
+            # As if add committed (in another thread) while we were reading.
+            db = getDb(channel)
+            cb._invalidateTriggers(channel)
+            return db
+        cb.getDb = changingGetDb
+        try:
+            cb._getTriggers(self.channel)
+        finally:
+            del cb.getDb
+        self.failIf(self.channel in cb.triggers)
+        cb._getTriggers(self.channel)
+        self.failUnless(self.channel in cb.triggers)
+
     def testLock(self):
         self.assertNotError('messageparser add "stuff" "echo i saw some stuff"')
         self.assertNotError('messageparser lock "stuff"')
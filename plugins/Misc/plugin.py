@@ -285,6 +285,7 @@ class Misc(callbacks.Plugin):
         given in is searched.
         """
         predicates = {}
+        regexps = []
         nolimit = False
         skipfirst = True
         if ircutils.isChannel(msg.args[0]):
@@ -316,29 +317,7 @@ class Misc(callbacks.Plugin):
                     return arg.lower() not in m.args[1].lower()
                 predicates.setdefault('without', []).append(f)
             elif option == 'regexp':
-                def f(m, arg=arg):
-                    def f1(s, arg):
-                        """Since we can't enqueue match objects into the multiprocessing queue,
-                        we'll just wrap the function to return bools."""
-                        if arg.search(s) is not None:
-                            return True
-                        else:
-                            return False
-                    if ircmsgs.isAction(m):
-                        m1 = ircmsgs.unAction(m)
-                        #return arg.search(ircmsgs.unAction(m))
-                    else:
-                        m1 = m.args[1]
-                        #return arg.search(m.args[1])
-                    try:
-                        # use a subprocess here, since specially crafted regexps can
-                        # take exponential time and hang up the bot.
-                        # timeout of 0.1 should be more than enough for any normal regexp.
-                        v = commands.process(f1, m1, arg, timeout=0.1, pn=self.name(), cn='last')
-                        return v
-                    except commands.ProcessTimeoutError:
-                        return False
-                predicates.setdefault('regexp', []).append(f)
+                regexps.append(arg)
             elif option == 'nolimit':
                 nolimit = True
         iterable = ifilter(self._validLastMsg, reversed(irc.state.history))
@@ -370,20 +349,35 @@ class Misc(callbacks.Plugin):
             showNick = False
         else:
             showNick = True
-        for m in iterable:
+        def p(m):
             for predicate in predicates:
                 if not predicate(m):
-                    break
-            else:
-                if nolimit:
-                    resp.append(ircmsgs.prettyPrint(m,
-                                                    timestampFormat=tsf,
-                                                    showNick=showNick))
+                    return False
+            return True
+        iterable = ifilter(p, iterable)
+        if regexps:
+            # Specially crafted regexps can take exponential time, so they're
+            # matched in another process, all the messages left at once.  A
+            # timeout of 0.1 should be more than enough for any normal regexp.
+            def text(m):
+                if ircmsgs.isAction(m):
+                    return ircmsgs.unAction(m)
                 else:
-                    irc.reply(ircmsgs.prettyPrint(m,
-                                                  timestampFormat=tsf,
-                                                  showNick=showNick))
-                    return
+                    return m.args[1]
+            for reobj in regexps:
+                iterable = commands.regexp_filter(iterable, reobj, 0.1,
+                                                  self.name(), 'last',
+                                                  key=text)
+        for m in iterable:
+            if nolimit:
+                resp.append(ircmsgs.prettyPrint(m,
+                                                timestampFormat=tsf,
+                                                showNick=showNick))
+            else:
+                irc.reply(ircmsgs.prettyPrint(m,
+                                              timestampFormat=tsf,
+                                              showNick=showNick))
+                return
         if not resp:
             irc.error('I couldn\'t find a message matching that criteria in '
                       'my history of %s messages.' % len(irc.state.history))
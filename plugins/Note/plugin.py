@@ -56,7 +56,7 @@ class NoteRecord(dbi.Record):
         ]
 
 class DbiNoteDB(dbi.DB):
-    Mapping = 'flat'
+    Mapping = 'indexed'
     Record = NoteRecord
 
     def __init__(self, *args, **kwargs):
@@ -286,6 +286,7 @@ class Note(callbacks.Plugin):
         the notes.  If --sent is specified, only search sent notes.
         """
         criteria = []
+        regexps = []
         def to(note):
             return note.to == user.id
         def frm(note):
@@ -293,8 +294,7 @@ class Note(callbacks.Plugin):
         own = to
         for (option, arg) in optlist:
             if option == 'regexp':
-                criteria.append(lambda x: commands.regexp_wrapper(x, reobj=arg, 
-                        timeout=0.1, plugin_name = self.name(), fcn_name='search'))
+                regexps.append(arg)
             elif option == 'sent':
                 own = frm
         if glob:
@@ -305,7 +305,12 @@ class Note(callbacks.Plugin):
                 if not p(note.text):
                     return False
             return True
-        notes = list(self.db.select(lambda n: match(n) and own(n)))
+        notes = self.db.select(lambda n: match(n) and own(n))
+        for reobj in regexps:
+            notes = commands.regexp_filter(notes, reobj, 0.1, self.name(),
+                                           'search',
+                                           key=operator.attrgetter('text'))
+        notes = list(notes)
         if not notes:
             irc.reply('No matching notes were found.')
         else:
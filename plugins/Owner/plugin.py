@@ -87,6 +87,7 @@ def renameCommand(cb, name, newName):
         method = getattr(cb.__class__, name)
         setattr(cb.__class__, newName, method)
         delattr(cb.__class__, name)
+        callbacks.invalidateCommands(cb)
 
 
 registerDefaultPlugin('list', 'Misc')
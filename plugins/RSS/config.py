@@ -62,6 +62,11 @@ conf.registerGlobalValue(RSS, 'waitPeriod',
     registry.PositiveInteger(1800, """Indicates how many seconds the bot will
     wait between retrieving RSS feeds; requests made within this period will
     return cached results."""))
+conf.registerGlobalValue(RSS, 'checkPeriod',
+    registry.PositiveInteger(60, """Determines how often (in seconds) the bot
+    checks whether any announced feeds are due to be retrieved again (see
+    supybot.plugins.RSS.waitPeriod).  Changes take effect when the plugin is
+    reloaded."""))
 conf.registerGlobalValue(RSS, 'feeds',
     FeedNames([], """Determines what feeds should be accessible as
     commands."""))
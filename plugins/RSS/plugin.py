@@ -38,7 +38,9 @@ import supybot.conf as conf
 import supybot.utils as utils
 import supybot.world as world
 from supybot.commands import *
+import supybot.ircmsgs as ircmsgs
 import supybot.ircutils as ircutils
+import supybot.schedule as schedule
 import supybot.registry as registry
 import supybot.callbacks as callbacks
 
@@ -70,6 +72,8 @@ class RSS(callbacks.Plugin):
         self.locks = {}
         self.lastRequest = {}
         self.cachedFeeds = {}
+        self.failures = {}
+        self.fetching = set()
         self.gettingLockLock = threading.Lock()
         for name in self.registryValue('feeds'):
             self._registerFeed(name)
@@ -80,6 +84,16 @@ class RSS(callbacks.Plugin):
                 continue
             self.makeFeedCommand(name, url)
             self.getFeed(url) # So announced feeds don't announce on startup.
+        schedule.addPeriodicEvent(self._checkFeeds,
+                                  self.registryValue('checkPeriod'),
+                                  name=self.name(), now=False)
+
+    def die(self):
+        try:
+            schedule.removeEvent(self.name())
+        except KeyError:
+            pass
+        self.__parent.die()
 
     def isCommandMethod(self, name):
         if not self.__parent.isCommandMethod(name):
@@ -104,38 +118,31 @@ class RSS(callbacks.Plugin):
         group = self.registryValue('feeds', value=False)
         conf.registerGlobalValue(group, name, registry.String(url, ''))
 
-    def __call__(self, irc, msg):
-        self.__parent.__call__(irc, msg)
-        irc = callbacks.SimpleProxy(irc, msg)
+    def _checkFeeds(self):
+        # This runs from the scheduler, so feeds get announced even when the
+        # network is quiet, and so handling messages costs us nothing.
         newFeeds = {}
-        for channel in irc.state.channels:
-            feeds = self.registryValue('announce', channel)
-            for name in feeds:
-                commandName = callbacks.canonicalName(name)
-                if self.isCommandMethod(commandName):
-                    url = self.feedNames[commandName][0]
-                else:
-                    url = name
-                if self.willGetNewFeed(url):
-                    newFeeds.setdefault((url, name), []).append(channel)
-        for ((url, name), channels) in newFeeds.iteritems():
-            # We check if we can acquire the lock right here because if we
-            # don't, we'll possibly end up spawning a lot of threads to get
-            # the feed, because this thread may run for a number of bytecodes
-            # before it switches to a thread that'll get the lock in
-            # _newHeadlines.
-            if self.acquireLock(url, blocking=False):
-                try:
-                    t = threading.Thread(target=self._newHeadlines,
-                                         name=format('Fetching %u', url),
-                                         args=(irc, channels, name, url))
-                    self.log.info('Checking for announcements at %u', url)
-                    world.threadsSpawned += 1
-                    t.setDaemon(True)
-                    t.start()
-                finally:
-                    self.releaseLock(url)
-                    time.sleep(0.1) # So other threads can run.
+        for irc in world.ircs:
+            for channel in irc.state.channels:
+                feeds = self.registryValue('announce', channel)
+                for name in feeds:
+                    commandName = callbacks.canonicalName(name)
+                    if self.isCommandMethod(commandName):
+                        url = self.feedNames[commandName][0]
+                    else:
+                        url = name
+                    if url not in self.fetching and self.willGetNewFeed(url):
+                        targets = newFeeds.setdefault((url, name), [])
+                        targets.append((irc, channel))
+        for ((url, name), targets) in newFeeds.iteritems():
+            self.log.info('Checking for announcements at %u', url)
+            self.fetching.add(url)
+            def onShed(url=url):
+                self.log.info('Too busy to check %u; will retry later.', url)
+                self.fetching.discard(url)
+            callbacks.commandPool.submit(self.name(), self._newHeadlines,
+                                         args=(targets, name, url),
+                                         onShed=onShed)
 
     def buildHeadlines(self, headlines, channel, config='announce.showLinks'):
         newheadlines = []
@@ -152,7 +159,7 @@ class RSS(callbacks.Plugin):
                 newheadlines = [format('%s', h[0]) for h in headlines]
         return newheadlines
 
-    def _newHeadlines(self, irc, channels, name, url):
+    def _newHeadlines(self, targets, name, url):
         try:
             # We acquire the lock here so there's only one announcement thread
             # in this code at any given time.  Otherwise, several announcement
@@ -196,7 +203,7 @@ class RSS(callbacks.Plugin):
                             v = False
                             break
                     return v
-                for channel in channels:
+                for (irc, channel) in targets:
                     if len(oldheadlines) == 0:
                         channelnewheadlines = newheadlines[:self.registryValue('initialAnnounceHeadlines', channel)]
                     else:
@@ -208,7 +215,7 @@ class RSS(callbacks.Plugin):
                     if len(blacklist) != 0:
                         channelnewheadlines = filter(filter_blacklist, channelnewheadlines)
                     if len(channelnewheadlines) == 0:
-                        return
+                        continue
                     bold = self.registryValue('bold', channel)
                     sep = self.registryValue('headlineSeparator', channel)
                     prefix = self.registryValue('announcementPrefix', channel)
@@ -217,9 +224,14 @@ class RSS(callbacks.Plugin):
                         pre = ircutils.bold(pre)
                         sep = ircutils.bold(sep)
                     headlines = self.buildHeadlines(channelnewheadlines, channel)
-                    irc.replies(headlines, prefixer=pre, joiner=sep,
+                    # There's no message we're replying to, so we make one.
+                    msg = ircmsgs.IrcMsg(prefix=irc.prefix, command='PRIVMSG',
+                                         args=(channel, name))
+                    proxy = callbacks.SimpleProxy(irc, msg)
+                    proxy.replies(headlines, prefixer=pre, joiner=sep,
                                 to=channel, prefixNick=False, private=True)
         finally:
+            self.fetching.discard(url)
             self.releaseLock(url)
 
     def willGetNewFeed(self, url):
@@ -254,37 +266,57 @@ class RSS(callbacks.Plugin):
             # and DoS the website in question.
             self.acquireLock(url)
             if self.willGetNewFeed(url):
+                # Servers that support conditional GETs will answer 304, with
+                # no feed at all, if it hasn't changed since we last got it.
+                cached = self.cachedFeeds.get(url, {})
                 try:
                     self.log.debug('Downloading new feed from %u', url)
-                    results = feedparser.parse(url)
+                    results = feedparser.parse(url, etag=cached.get('etag'),
+                                               modified=cached.get('modified'))
                     if 'bozo_exception' in results:
                         raise results['bozo_exception']
                 except sgmllib.SGMLParseError:
                     self.log.exception('Uncaught exception from feedparser:')
+                    self.backOff(url)
                     raise callbacks.Error, 'Invalid (unparsable) RSS feed.'
                 except socket.timeout:
+                    self.backOff(url)
                     return error('Timeout downloading feed.')
                 except Exception, e:
                     # These seem mostly harmless.  We'll need reports of a
                     # kind that isn't.
                     self.log.debug('Allowing bozo_exception %r through.', e)
-                if results.get('feed', {}):
+                if results.get('status') == 304 and cached:
+                    self.log.debug('%u has not changed.', url)
+                    self.lastRequest[url] = time.time()
+                    self.failures.pop(url, None)
+                elif results.get('feed', {}):
                     self.cachedFeeds[url] = results
                     self.lastRequest[url] = time.time()
+                    self.failures.pop(url, None)
                 else:
                     self.log.debug('Not caching results; feed is empty.')
+                    self.backOff(url)
             try:
                 return self.cachedFeeds[url]
             except KeyError:
-                wait = self.registryValue('waitPeriod')
-                # If there's a problem retrieving the feed, we should back off
-                # for a little bit before retrying so that there is time for
-                # the error to be resolved.
-                self.lastRequest[url] = time.time() - .5 * wait
                 return error('Unable to download feed.')
         finally:
             self.releaseLock(url)
 
+    def backOff(self, url):
+        # If there's a problem retrieving the feed, we should back off for a
+        # little bit before retrying so that there is time for the error to be
+        # resolved.  We wait half a waitPeriod at first, then twice as long
+        # after each further failure, up to eight waitPeriods.
+        wait = self.registryValue('waitPeriod')
+        failures = self.failures.get(url, 0) + 1
+        self.failures[url] = failures
+        delay = min(.5 * 2**(failures-1), 8) * wait
+        self.log.debug('Failed to get %u %s time(s) in a row; retrying in %s '
+                       'seconds.', url, failures, int(delay))
+        self.lastRequest[url] = time.time() - wait + delay
+
     def _getConverter(self, feed):
         toText = utils.web.htmlToText
         if 'encoding' in feed:
@@ -333,6 +365,7 @@ class RSS(callbacks.Plugin):
         f = new.instancemethod(f, self, RSS)
         self.feedNames[name] = (url, f)
         self._registerFeed(name, url)
+        callbacks.invalidateCommands(self)
 
     def add(self, irc, msg, args, name, url):
         """<name> <url>
@@ -356,6 +389,7 @@ class RSS(callbacks.Plugin):
         del self.feedNames[name]
         conf.supybot.plugins.RSS.feeds().remove(name)
         conf.supybot.plugins.RSS.feeds.unregister(name)
+        callbacks.invalidateCommands(self)
         irc.replySuccess()
     remove = wrap(remove, ['feedName'])
 
@@ -30,9 +30,61 @@
 
 from supybot.test import *
 
+import os
+
 url = 'http://www.advogato.org/rss/articles.xml'
+feed = """<?xml version="1.0"?>
+<rss version="2.0"><channel><title>Test</title>
+<item><title>First headline</title></item>
+<item><title>Second headline</title></item>
+</channel></rss>
+"""
 class RSSTestCase(ChannelPluginTestCase):
     plugins = ('RSS','Plugin')
+    def _takeMsg(self):
+        end = time.time() + self.timeout
+        m = self.irc.takeMsg()
+        while m is None and time.time() < end:
+            time.sleep(0.1)
+            drivers.run()
+            m = self.irc.takeMsg()
+        return m
+
+    def testAnnounceIsScheduled(self):
+        filename = os.path.join(conf.supybot.directories.data(), 'RSS.xml')
+        fd = file(filename, 'w')
+        fd.write(feed)
+        fd.close()
+        announce = conf.supybot.plugins.RSS.announce.get(self.channel)
+        announce.setValue(set([filename]))
+        try:
+            cb = self.irc.getCallback('RSS')
+            cb._checkFeeds()
+            m = self._takeMsg()
+            self.failUnless(m, 'No announcement was made.')
+            self.assertEqual(m.args[0], self.channel)
+            self.failUnless('First headline' in m.args[1])
+            self.failIf(cb.willGetNewFeed(filename))
+            self.failIf(filename in cb.fetching)
+        finally:
+            announce.setValue(set())
+            os.remove(filename)
+
+    def testBackOff(self):
+        cb = self.irc.getCallback('RSS')
+        filename = os.path.join(conf.supybot.directories.data(), 'NoRSS.xml')
+        wait = conf.supybot.plugins.RSS.waitPeriod()
+        cb.getFeed(filename)
+        self.assertEqual(cb.failures[filename], 1)
+        self.failIf(cb.willGetNewFeed(filename))
+        # The first retry is half a waitPeriod away, the second a whole one.
+        firstRetry = cb.lastRequest[filename] + wait
+        cb.lastRequest[filename] -= wait
+        cb.getFeed(filename)
+        self.assertEqual(cb.failures[filename], 2)
+        secondRetry = cb.lastRequest[filename] + wait
+        self.failUnless(secondRetry - firstRetry > .4 * wait)
+
     def testRssAddBadName(self):
         self.assertError('rss add "foo bar" %s' % url)
 
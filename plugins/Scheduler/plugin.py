@@ -107,7 +107,7 @@ class Scheduler(callbacks.Plugin):
 
     def _makeCommandFunction(self, irc, msg, command, remove=True):
         """Makes a function suitable for scheduling from command."""
-        tokens = callbacks.tokenize(command)
+        tokens = callbacks.freezeTokens(callbacks.tokenize(command))
         print command
         print tokens
         def f():
@@ -85,13 +85,22 @@ class Status(callbacks.Plugin):
     def threads(self, irc, msg, args):
         """takes no arguments
 
-        Returns the current threads that are active.
+        Returns the current threads that are active, and how busy the pool of
+        threads running threaded commands is.
         """
         threads = [t.getName() for t in threading.enumerate()]
         threads.sort()
         s = format('I have spawned %n; %n %b still currently active: %L.',
                    (world.threadsSpawned, 'thread'),
                    (len(threads), 'thread'), len(threads), threads)
+        stats = callbacks.commandPool.stats()
+        s += format('  My command pool has %n (%i busy) and %n waiting '
+                    '(at most %i so far); it has run %i of %n and '
+                    'turned away %i.',
+                    (stats['workers'], 'worker'), stats['busy'],
+                    (stats['queued'], 'command'), stats['maxQueued'],
+                    stats['completed'], (stats['submitted'], 'command'),
+                    stats['shed'])
         irc.reply(s)
     threads = wrap(threads)
     
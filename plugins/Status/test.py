@@ -70,6 +70,7 @@ class StatusTestCase(PluginTestCase):
 
     def testThreads(self):
         self.assertNotError('threads')
+        self.assertRegexp('threads', 'command pool')
 
     def testProcesses(self):
         self.assertNotError('processes')
@@ -227,16 +227,19 @@ class Todo(callbacks.Plugin):
         if not optlist and not globs:
             raise callbacks.ArgumentError
         criteria = []
+        regexps = []
         for (option, arg) in optlist:
             if option == 'regexp':
-                criteria.append(lambda x: commands.regexp_wrapper(x, reobj=arg, 
-                        timeout=0.1, plugin_name = self.name(), fcn_name='search'))
-                criteria.append(arg.search)
+                regexps.append(arg)
         for glob in globs:
             glob = utils.python.glob2re(glob)
             criteria.append(re.compile(glob).search)
         try:
             tasks = self.db.select(user.id, criteria)
+            for reobj in regexps:
+                tasks = commands.regexp_filter(tasks, reobj, 0.1, self.name(),
+                                               'search',
+                                               key=operator.attrgetter('task'))
             L = [format('#%i: %s', t.id, self._shrink(t.task)) for t in tasks]
             irc.reply(format('%L', L))
         except dbi.NoRecordError:
@@ -38,6 +38,7 @@ import time
 import random
 import fnmatch
 import os.path
+import operator
 import UserDict
 import threading
 
@@ -327,6 +328,158 @@ class ChannelUserDB(ChannelUserDictionary):
         raise NotImplementedError
 
 
+class JournaledChannelUserDB(ChannelUserDB):
+    """A ChannelUserDB whose flush doesn't rewrite the whole file.  Instead,
+    the entries changed since the last flush are appended to a journal next to
+    the file, and the file itself is only rewritten (in another thread) once
+    the journal has grown about as large as the database.  Subclasses whose
+    values are modified in place rather than set again should set mutable to
+    True, so that every entry gotten is considered changed."""
+    mutable = False
+    minJournalSize = 1000
+    def __init__(self, filename):
+        self.dirty = set()
+        self.lock = threading.Lock()
+        self.journaled = 0
+        self.snapshotThread = None
+        self.journalFilename = filename + '.journal'
+        self.oldJournalFilename = self.journalFilename + '.old'
+        ChannelUserDB.__init__(self, filename)
+        # The old journal is only there if we died while writing a snapshot;
+        # replaying is idempotent, so it doesn't matter whether we got far.
+        for filename in (self.oldJournalFilename, self.journalFilename):
+            self.journaled += self._replay(filename)
+        self.dirty.clear()
+
+    def _replay(self, filename):
+        try:
+            fd = file(filename)
+        except EnvironmentError:
+            return 0
+        lineno = 0
+        try:
+            for t in csv.reader(fd):
+                lineno += 1
+                try:
+                    (op, channel, id) = t[:3]
+                    try:
+                        id = int(id)
+                    except ValueError:
+                        pass
+                    if op == '+':
+                        self[channel, id] = self.deserialize(channel, id, t[3:])
+                    elif op == '-':
+                        try:
+                            del self[channel, id]
+                        except KeyError:
+                            pass
+                    else:
+                        raise ValueError, 'invalid operation: %r' % op
+                except Exception, e:
+                    log.warning('Invalid line #%s in %s.', lineno, filename)
+                    log.debug('Exception: %s', utils.exnToString(e))
+        except Exception, e: # This catches exceptions from csv.reader.
+            log.warning('Invalid line #%s in %s.', lineno, filename)
+            log.debug('Exception: %s', utils.exnToString(e))
+        fd.close()
+        return lineno
+
+    def __getitem__(self, key):
+        v = ChannelUserDB.__getitem__(self, key)
+        if self.mutable:
+            self.dirty.add(key)
+        return v
+
+    def __setitem__(self, key, v):
+        ChannelUserDB.__setitem__(self, key, v)
+        self.dirty.add(key)
+
+    def __delitem__(self, key):
+        ChannelUserDB.__delitem__(self, key)
+        self.dirty.add(key)
+
+    def flush(self):
+        self.lock.acquire()
+        try:
+            dirty = self.dirty
+            self.dirty = set()
+            rows = []
+            for (channel, id) in dirty:
+                try:
+                    v = self.channels[channel][id]
+                except KeyError:
+                    rows.append(['-', channel, id])
+                else:
+                    rows.append(['+', channel, id] + self.serialize(v))
+            if rows:
+                fd = file(self.journalFilename, 'ab')
+                try:
+                    csv.writer(fd).writerows(rows)
+                finally:
+                    fd.close()
+                self.journaled += len(rows)
+            size = sum(map(len, self.channels.itervalues()))
+            if self.journaled > max(self.minJournalSize, size) and \
+               (self.snapshotThread is None or
+                not self.snapshotThread.isAlive()):
+                self.snapshotThread = world.SupyThread(target=self._snapshot,
+                                                       args=(self._rotate(),),
+                                                       name='Snapshot of %s' %
+                                                            self.filename)
+                self.snapshotThread.setDaemon(True)
+                self.snapshotThread.start()
+        finally:
+            self.lock.release()
+
+    def _rotate(self):
+        """Moves the journal out of the way of further flushes and returns a
+        copy of the entries a snapshot should be written from."""
+        if os.path.exists(self.journalFilename):
+            if os.path.exists(self.oldJournalFilename):
+                # The last snapshot failed, so its journal still matters.
+                fd = file(self.oldJournalFilename, 'ab')
+                try:
+                    fd.write(file(self.journalFilename, 'rb').read())
+                finally:
+                    fd.close()
+                os.remove(self.journalFilename)
+            else:
+                os.rename(self.journalFilename, self.oldJournalFilename)
+        self.journaled = 0
+        return [(channel, ids.items())
+                for (channel, ids) in self.channels.items()]
+
+    def _snapshot(self, items):
+        try:
+            rows = []
+            for (channel, ids) in items:
+                for (id, v) in ids:
+                    rows.append([channel, id] + self.serialize(v))
+            rows.sort()
+            # Even if every entry has been removed, we write the (empty) file:
+            # the old one and its journal would otherwise stay around and be
+            # replayed, and the journal would keep growing.
+            fd = utils.file.AtomicFile(self.filename, makeBackupIfSmaller=False,
+                                       allowEmptyOverwrite=True)
+            csv.writer(fd).writerows(rows)
+            fd.close()
+            if os.path.exists(self.oldJournalFilename):
+                os.remove(self.oldJournalFilename)
+        except Exception:
+            log.exception('Uncaught exception writing %s:', self.filename)
+
+    def close(self):
+        self.flush()
+        if self.snapshotThread is not None:
+            self.snapshotThread.join()
+        self.lock.acquire()
+        try:
+            self._snapshot(self._rotate())
+        finally:
+            self.lock.release()
+        self.clear()
+
+
 def getUserName(id):
     if isinstance(id, int):
         try:
@@ -422,6 +575,7 @@ class ChannelIdDatabasePlugin(callbacks.Plugin):
         Searches for $types matching the criteria given.
         """
         predicates = []
+        regexps = []
         def p(record):
             for predicate in predicates:
                 if not predicate(record):
@@ -432,15 +586,18 @@ class ChannelIdDatabasePlugin(callbacks.Plugin):
             if opt == 'by':
                 predicates.append(lambda r, arg=arg: r.by == arg.id)
             elif opt == 'regexp':
-                predicates.append(lambda x: commands.regexp_wrapper(x.text, reobj=arg, 
-                        timeout=0.1, plugin_name = self.name(), fcn_name='search'))
-                #predicates.append(lambda r, arg=arg: arg.search(r.text))
+                regexps.append(arg)
         if glob:
             def globP(r, glob=glob.lower()):
                 return fnmatch.fnmatch(r.text.lower(), glob)
             predicates.append(globP)
+        records = self.db.select(channel, p)
+        for reobj in regexps:
+            records = commands.regexp_filter(records, reobj, 0.1, self.name(),
+                                             'search',
+                                             key=operator.attrgetter('text'))
         L = []
-        for record in self.db.select(channel, p):
+        for record in records:
             L.append(self.searchSerializeRecord(record))
         if L:
             L.sort()
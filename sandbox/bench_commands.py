@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+###
+# Measures how many commands per second wrap-ed commands from the Utilities,
+# Math and Format plugins can be dispatched: their Specs convert the
+# arguments, and then the commands themselves run and reply (to a proxy that
+# just counts the replies).  "spec" measures the Specs alone.  Run it with an
+# installed supybot before and after a change to compare:
+#
+#     python sandbox/bench_commands.py [number of calls]
+###
+
+import os
+import sys
+import time
+
+import supybot.conf as conf
+import supybot.irclib as irclib
+import supybot.plugin as plugin
+import supybot.ircmsgs as ircmsgs
+import supybot.callbacks as callbacks
+from supybot.commands import *
+
+class CountingProxy(callbacks.SimpleProxy):
+    replies = 0
+    def reply(self, s, **kwargs):
+        self.replies += 1
+
+    def error(self, s='', Raise=False, **kwargs):
+        if Raise:
+            raise callbacks.Error, s
+        self.replies += 1
+
+calls = [
+    ('Utilities', 'echo', ['hello', 'there', 'world']),
+    ('Utilities', 'success', []),
+    ('Utilities', 'countargs', ['a', 'b', 'c', 'd']),
+    ('Utilities', 'sample', ['2', 'a', 'b', 'c']),
+    ('Math', 'base', ['16', 'ff']),
+    ('Math', 'base', ['2', '16', '1010']),
+    ('Format', 'bold', ['foo', 'bar']),
+    ('Format', 'upper', ['foo', 'bar']),
+    ('Format', 'cut', ['3', 'foobar']),
+    ('Format', 'field', ['2', 'foo bar baz']),
+    ('Format', 'concat', ['foo', 'bar']),
+    ('Format', 'translate', ['abc', 'def', 'aabbcc']),
+]
+
+specs = [
+    (['int', 'text'], ['12', 'foo', 'bar']),
+    (['channel', 'something', 'text'], ['#bench', 'foo', 'bar baz']),
+    (['something', optional('int', 5), additional('text')], ['foo', '3']),
+    ([many('anything')], ['a', 'b', 'c']),
+]
+
+def measure(name, f, n):
+    start = time.time()
+    f(n)
+    elapsed = time.time() - start
+    print '%-10s %9.0f calls/s' % (name, n / elapsed)
+
+def main():
+    n = 100000
+    if len(sys.argv) > 1:
+        n = int(sys.argv[1])
+    conf.supybot.directories.plugins.setValue(
+        [os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      os.pardir, 'plugins')])
+    conf.registerNetwork('bench')
+    realIrc = irclib.Irc('bench')
+    realIrc.state.supported['chantypes'] = '#'
+    msg = ircmsgs.privmsg('#bench', 'foo', prefix='foo!bar@baz')
+    irc = CountingProxy(realIrc, msg)
+    cbs = {}
+    for (name, _, _) in calls:
+        if name not in cbs:
+            module = plugin.loadPluginModule(name)
+            cbs[name] = plugin.loadPluginClass(realIrc, module)
+    L = [(getattr(cbs[name], command), args) for (name, command, args) in calls]
+    def dispatch(n):
+        for i in xrange(n):
+            (method, args) = L[i % len(L)]
+            method(irc, msg, args[:])
+    measure('dispatch', dispatch, n)
+    compiled = [(Spec(spec), args) for (spec, args) in specs]
+    def spec(n):
+        for i in xrange(n):
+            (spec, args) = compiled[i % len(compiled)]
+            spec(irc, msg, args[:])
+    measure('spec', spec, n)
+
+if __name__ == '__main__':
+    main()
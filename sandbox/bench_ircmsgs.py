@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+###
+# Measures how many raw IRC messages per second IrcMsg can parse, and how
+# many Irc.feedMsg can process (parsing, IrcState updates and dispatch, with
+# no plugins loaded).  Run it with an installed supybot before and after a
+# change to compare:
+#
+#     python sandbox/bench_ircmsgs.py [number of messages]
+###
+
+import sys
+import time
+
+import supybot.conf as conf
+import supybot.irclib as irclib
+import supybot.ircmsgs as ircmsgs
+
+def corpus(n):
+    L = [':irc.example.net 001 bench :Welcome to the network bench',
+         ':bench!bench@bench.example.net JOIN #bench']
+    templates = [
+        ':nick%(i)s!~user%(i)s@host-%(i)s.example.com PRIVMSG #bench :hello '
+            'there, this is message number %(i)s',
+        ':nick%(i)s!~user%(i)s@host-%(i)s.example.com JOIN #bench',
+        ':nick%(i)s!~user%(i)s@host-%(i)s.example.com PRIVMSG #bench '
+            ':\x01ACTION waves\x01',
+        ':ChanServ!ChanServ@services. MODE #bench +o nick%(i)s',
+        ':nick%(i)s!~user%(i)s@host-%(i)s.example.com NOTICE bench :hi',
+        ':nick%(i)s!~user%(i)s@host-%(i)s.example.com PART #bench :bye',
+        'PING :irc.example.net',
+        ':irc.example.net 353 bench = #bench :@nick%(i)s +other%(i)s',
+    ]
+    for i in xrange(n):
+        L.append(templates[i % len(templates)] % {'i': i} + '\r\n')
+    return L
+
+def measure(name, f, lines):
+    start = time.time()
+    f(lines)
+    elapsed = time.time() - start
+    print '%-10s %9.0f msgs/s' % (name, len(lines) / elapsed)
+
+def parse(lines):
+    for line in lines:
+        ircmsgs.IrcMsg(line)
+
+def feed(lines):
+    conf.registerNetwork('bench')
+    irc = irclib.Irc('bench')
+    for line in lines:
+        irc.feedMsg(ircmsgs.IrcMsg(line))
+
+def main():
+    n = 200000
+    if len(sys.argv) > 1:
+        n = int(sys.argv[1])
+    lines = corpus(n)
+    measure('parse', parse, lines)
+    measure('feedMsg', feed, lines)
+
+if __name__ == '__main__':
+    main()
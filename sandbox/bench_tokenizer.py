@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+
+###
+# Measures how many commands per second callbacks.tokenize can split up, over
+# a corpus of plain, quoted, nested and piped commands.  "uncached" gives every
+# command once (as new commands from users come in); "cached" repeats a few
+# (as Alias and Scheduler commands do).  Run it with an installed supybot
+# before and after a change to compare:
+#
+#     python sandbox/bench_tokenizer.py [number of commands]
+###
+
+import sys
+import time
+
+import supybot.conf as conf
+import supybot.callbacks as callbacks
+
+def corpus(n):
+    templates = [
+        'echo hello there number %(i)s',
+        'echo "a quoted \\"string\\" number %(i)s" and more',
+        'echo [rot13 [echo nested %(i)s]] [echo [echo [echo deeper %(i)s]]]',
+        'seen nick%(i)s | echo [reverse [echo result]]',
+        'alias add foo%(i)s "echo [echo $1] $2 [rot13 $*]"',
+        'math calc 2 * [math calc %(i)s + 3]',
+    ]
+    return [templates[i % len(templates)] % {'i': i} for i in xrange(n)]
+
+def measure(name, commands):
+    start = time.time()
+    for command in commands:
+        callbacks.tokenize(command)
+    elapsed = time.time() - start
+    print '%-10s %9.0f commands/s' % (name, len(commands) / elapsed)
+
+def main():
+    n = 100000
+    if len(sys.argv) > 1:
+        n = int(sys.argv[1])
+    conf.supybot.commands.nested.pipeSyntax.setValue(True)
+    measure('uncached', corpus(n))
+    measure('cached', corpus(100) * (n // 100))
+
+if __name__ == '__main__':
+    main()
@@ -35,13 +35,10 @@ This module contains the basic callbacks for handling PRIVMSGs.
 import supybot
 
 import re
-import copy
-import time
-import shlex
 import getopt
 import inspect
 import operator
-from cStringIO import StringIO
+import threading
 
 import supybot.log as log
 import supybot.conf as conf
@@ -250,84 +247,85 @@ class ArgumentError(Error):
     pass
 
 class Tokenizer(object):
-    # This will be used as a global environment to evaluate strings in.
-    # Evaluation is, of course, necessary in order to allow escaped
-    # characters to be properly handled.
-    #
-    # These are the characters valid in a token.  Everything printable except
-    # double-quote, left-bracket, and right-bracket.
-    validChars = utils.str.chars.translate(utils.str.chars, '\x00\r\n \t')
+    """Splits a command into its arguments in a single pass: words are
+    separated by whitespace, quoted strings are unescaped, the given brackets
+    nest commands and, if pipe is True, "|" pipes them.  Words and quoted
+    strings are matched by a regexp compiled once per configuration."""
+    whitespace = ' \t\r\n'
+    _patterns = {}
     def __init__(self, brackets='', pipe=False, quotes='"'):
         if brackets:
-            self.validChars=self.validChars.translate(utils.str.chars, brackets)
             self.left = brackets[0]
             self.right = brackets[1]
         else:
             self.left = ''
             self.right = ''
         self.pipe = pipe
-        if self.pipe:
-            self.validChars = self.validChars.translate(utils.str.chars, '|')
         self.quotes = quotes
-        self.validChars = self.validChars.translate(utils.str.chars, quotes)
-
-
-    def _handleToken(self, token):
-        if token[0] == token[-1] and token[0] in self.quotes:
-            token = token[1:-1]
-            token = token.decode('string_escape')
-        return token
-
-    def _insideBrackets(self, lexer):
-        ret = []
-        while True:
-            token = lexer.get_token()
-            if not token:
-                raise SyntaxError, 'Missing "%s".  You may want to ' \
-                                   'quote your arguments with double ' \
-                                   'quotes in order to prevent extra ' \
-                                   'brackets from being evaluated ' \
-                                   'as nested commands.' % self.right
-            elif token == self.right:
-                return ret
-            elif token == self.left:
-                ret.append(self._insideBrackets(lexer))
-            else:
-                ret.append(self._handleToken(token))
-            firstToken = False
-        return ret
+        key = (brackets, pipe, quotes)
+        try:
+            self.pattern = self._patterns[key]
+        except KeyError:
+            self.pattern = self._patterns[key] = self._compile(*key)
+
+    def _compile(cls, brackets, pipe, quotes):
+        # A word starts with any character but whitespace, NUL, brackets,
+        # pipes, and quotes, and can go on to include quotes.  Whatever
+        # matches none of the alternatives is a single character of
+        # punctuation, including the start of an unterminated quoted string.
+        special = '\x00' + brackets
+        if pipe:
+            special += '|'
+        notWord = ''.join(map(re.escape, cls.whitespace + special))
+        word = '[^%s%s][^%s]*' % (notWord, ''.join(map(re.escape, quotes)),
+                                   notWord)
+        quoted = '|'.join(['%s(?:[^\\\\%s]|\\\\.)*%s' % ((re.escape(q),)*3)
+                           for q in quotes]) or '(?!)'
+        whitespace = ''.join(map(re.escape, cls.whitespace))
+        return re.compile('[%s]*(?:(%s)|(%s)|([^%s]))' %
+                          (whitespace, word, quoted, whitespace), re.S)
+    _compile = classmethod(_compile)
 
     def tokenize(self, s):
-        lexer = shlex.shlex(StringIO(s))
-        lexer.commenters = ''
-        lexer.quotes = self.quotes
-        lexer.wordchars = self.validChars
         args = []
+        nested = [] # The args of the brackets we're inside of.
         ends = []
-        while True:
-            token = lexer.get_token()
-            if not token:
-                break
-            elif token == '|' and self.pipe:
-                # The "and self.pipe" might seem redundant here, but it's there
-                # for strings like 'foo | bar', where a pipe stands alone as a
-                # token, but shouldn't be treated specially.
+        for (word, quoted, punctuation) in self.pattern.findall(s):
+            if word:
+                args.append(word)
+            elif quoted:
+                args.append(quoted[1:-1].decode('string_escape'))
+            elif punctuation == self.left:
+                nested.append(args)
+                args = []
+            elif punctuation == self.right:
+                if not nested:
+                    raise SyntaxError, 'Spurious "%s".  You may want to ' \
+                                       'quote your arguments with double ' \
+                                       'quotes in order to prevent extra ' \
+                                       'brackets from being evaluated ' \
+                                       'as nested commands.' % self.right
+                inner = args
+                args = nested.pop()
+                args.append(inner)
+            elif punctuation == '|' and self.pipe and not nested:
+                # Inside brackets, a pipe is just another argument.
                 if not args:
                     raise SyntaxError, '"|" with nothing preceding.  I ' \
                                        'obviously can\'t do a pipe with ' \
                                        'nothing before the |.'
                 ends.append(args)
                 args = []
-            elif token == self.left:
-                args.append(self._insideBrackets(lexer))
-            elif token == self.right:
-                raise SyntaxError, 'Spurious "%s".  You may want to ' \
-                                   'quote your arguments with double ' \
-                                   'quotes in order to prevent extra ' \
-                                   'brackets from being evaluated ' \
-                                   'as nested commands.' % self.right
+            elif punctuation in self.quotes:
+                raise ValueError, 'No closing quotation'
             else:
-                args.append(self._handleToken(token))
+                args.append(punctuation)
+        if nested:
+            raise SyntaxError, 'Missing "%s".  You may want to ' \
+                               'quote your arguments with double ' \
+                               'quotes in order to prevent extra ' \
+                               'brackets from being evaluated ' \
+                               'as nested commands.' % self.right
         if ends:
             if not args:
                 raise SyntaxError, '"|" with nothing following.  I ' \
@@ -338,8 +336,30 @@ class Tokenizer(object):
                 args[-1].append(ends.pop())
         return args
 
+def _copyTokens(tokens):
+    L = []
+    for token in tokens:
+        if isinstance(token, list):
+            token = _copyTokens(token)
+        L.append(token)
+    return L
+
+def freezeTokens(tokens):
+    """Returns the tokens given by tokenize as a tree of tuples, which can
+    be given to NestedCommandsIrcProxy as many times as necessary."""
+    L = []
+    for token in tokens:
+        if isinstance(token, list):
+            token = freezeTokens(token)
+        L.append(token)
+    return tuple(L)
+
+_tokenizers = {}
+_tokenized = utils.structures.LRUCache(1000)
 def tokenize(s, channel=None):
-    """A utility function to create a Tokenizer and tokenize a string."""
+    """A utility function to tokenize a string with the Tokenizer configured
+    for channel.  Results are cached, so callers get a copy they may
+    modify."""
     pipe = False
     brackets = ''
     nested = conf.supybot.commands.nested
@@ -348,12 +368,21 @@ def tokenize(s, channel=None):
         if conf.get(nested.pipeSyntax, channel): # No nesting, no pipe.
             pipe = True
     quotes = conf.get(conf.supybot.commands.quotes, channel)
-    start = time.time()
+    key = (brackets, pipe, quotes)
     try:
-        ret = Tokenizer(brackets=brackets,pipe=pipe,quotes=quotes).tokenize(s)
-        return ret
+        return _copyTokens(_tokenized[key, s])
+    except KeyError:
+        pass
+    try:
+        tokenizer = _tokenizers[key]
+    except KeyError:
+        tokenizer = _tokenizers[key] = Tokenizer(*key)
+    try:
+        ret = tokenizer.tokenize(s)
     except ValueError, e:
         raise SyntaxError, str(e)
+    _tokenized[key, s] = _copyTokens(ret)
+    return ret
 
 def formatCommand(command):
     return ' '.join(command)
@@ -576,7 +605,8 @@ class NestedCommandsIrcProxy(ReplyIrcProxy):
     "A proxy object to allow proper nesting of commands (even threaded ones)."
     _mores = ircutils.IrcDict()
     def __init__(self, irc, msg, args, nested=0):
-        assert isinstance(args, list), 'Args should be a list, not a string.'
+        assert isinstance(args, (list, tuple)), \
+               'Args should be a list or tuple, not a string.'
         self.irc = irc
         self.msg = msg
         self.nested = nested
@@ -592,10 +622,11 @@ class NestedCommandsIrcProxy(ReplyIrcProxy):
                         self.msg.prefix, maxNesting)
             return self.error('You\'ve attempted more nesting than is '
                               'currently allowed on this bot.')
-        # The deepcopy here is necessary for Scheduler; it re-runs already
-        # tokenized commands.  There's a possibility a simple copy[:] would
-        # work, but we're being careful.
-        self.args = copy.deepcopy(args)
+        # We replace our nested commands in self.args with their results, so
+        # we copy it, but only this level: the nested commands are copied by
+        # the proxies that run them.  That way the tokens we're given are
+        # never changed, and can be run again (as Scheduler does).
+        self.args = list(args)
         self.counter = 0
         self._resetReplyAttributes()
         if not args:
@@ -635,7 +666,7 @@ class NestedCommandsIrcProxy(ReplyIrcProxy):
                 # probably put it.
                 self.counter += 1
             else:
-                assert isinstance(self.args[self.counter], list)
+                assert isinstance(self.args[self.counter], (list, tuple))
                 # It's a list.  So we spawn another NestedCommandsIrcProxy
                 # to evaluate its args.  When that class has finished
                 # evaluating its args, it will call our reply method, which
@@ -677,36 +708,23 @@ class NestedCommandsIrcProxy(ReplyIrcProxy):
                     log.debug('Done calling invalidCommands: %s.',cb.name())
                     return
         if threaded:
-            name = 'Thread #%s (for invalidCommands)' % world.threadsSpawned
-            t = world.SupyThread(target=callInvalidCommands, name=name)
-            t.setDaemon(True)
-            t.start()
+            commandPool.submit('invalidCommands', callInvalidCommands,
+                               onShed=self._tooBusy)
         else:
             callInvalidCommands()
 
+    def _tooBusy(self):
+        self.error('I\'m too busy to run that command right now.  '
+                   'Please try again later.')
+
     def findCallbacksForArgs(self, args):
         """Returns a two-tuple of (command, plugins) that has the command
         (a list of strings) and the plugins for which it was a command."""
         assert isinstance(args, list)
         args = map(canonicalName, args)
-        cbs = []
-        maxL = []
-        for cb in self.irc.callbacks:
-            if not hasattr(cb, 'getCommand'):
-                continue
-            L = cb.getCommand(args)
-            #log.debug('%s.getCommand(%r) returned %r', cb.name(), args, L)
-            if L and L >= maxL:
-                maxL = L
-                cbs.append((cb, L))
-                assert isinstance(L, list), \
-                       'getCommand now returns a list, not a method.'
-                assert utils.iter.startswith(L, args), \
-                       'getCommand must return a prefix of the args given.  ' \
-                       '(args given: %r, returned: %r)' % (args, L)
+        (maxL, cbs) = getCommandTable(self.irc).find(args)
         log.debug('findCallbacksForArgs: %r', cbs)
-        cbs = [cb for (cb, L) in cbs if L == maxL]
-        if len(maxL) == 1:
+        if len(maxL) == 1 and len(cbs) > 1:
             # Special case: one arg determines the callback.  In this case, we
             # have to check, in order:
             # 1. Whether the arg is the same as the name of a callback.  This
@@ -779,9 +797,9 @@ class NestedCommandsIrcProxy(ReplyIrcProxy):
             args = self.args[len(command):]
             if world.isMainThread() and \
                (cb.threaded or conf.supybot.debug.threadAllCommands()):
-                t = CommandThread(target=cb._callCommand,
-                                  args=(command, self, self.msg, args))
-                t.start()
+                commandPool.submit(cb.name(), cb._callCommand,
+                                   (command, self, self.msg, args),
+                                   onShed=self._tooBusy)
             else:
                 cb._callCommand(command, self, self.msg, args)
 
@@ -953,13 +971,134 @@ class NestedCommandsIrcProxy(ReplyIrcProxy):
 
 IrcObjectProxy = NestedCommandsIrcProxy
 
+class CommandPool(object):
+    """A bounded pool of threads for running threaded commands, so we don't
+    start (and throw away) a new thread for each one.
+
+    Commands wait in a queue of at most supybot.commands.threads.queue
+    commands for one of supybot.commands.threads.workers threads; no more
+    than supybot.commands.threads.perPlugin commands from one plugin run at
+    once.
+    """
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.pending = []
+        self.running = {}
+        self.workers = 0
+        self.idle = 0
+        self.submitted = 0
+        self.completed = 0
+        self.shed = 0
+        self.maxQueued = 0
+
+    def submit(self, name, f, args=(), kwargs={}, onShed=None):
+        """Queues f(*args, **kwargs) to be run in one of our threads, on
+        behalf of the plugin name.  If the queue is full, onShed is called
+        for whichever command is dropped."""
+        job = (name, f, args, kwargs, onShed)
+        shed = None
+        self.cond.acquire()
+        try:
+            self.submitted += 1
+            if len(self.pending) >= conf.supybot.commands.threads.queue():
+                self.shed += 1
+                if conf.supybot.commands.threads.whenFull() == 'dropOldest':
+                    shed = self.pending.pop(0)
+                else:
+                    shed = job
+            if shed is not job:
+                self.pending.append(job)
+                self.maxQueued = max(self.maxQueued, len(self.pending))
+                if len(self.pending) > self.idle and \
+                   self.workers < conf.supybot.commands.threads.workers():
+                    self._spawnWorker()
+                else:
+                    self.cond.notify()
+        finally:
+            self.cond.release()
+        if shed is not None:
+            log.warning('Command pool is full, dropping a command for %s.',
+                        shed[0])
+            if shed[4] is not None:
+                shed[4]()
+
+    def _spawnWorker(self):
+        # Must be called with self.cond held.
+        self.workers += 1
+        name = 'Thread #%s (command pool worker)' % world.threadsSpawned
+        t = world.SupyThread(target=self._work, name=name)
+        t.setDaemon(True)
+        t.start()
+
+    def _takeJob(self):
+        # Must be called with self.cond held.
+        limit = conf.supybot.commands.threads.perPlugin()
+        for (i, job) in enumerate(self.pending):
+            name = job[0]
+            if not limit or self.running.get(name, 0) < limit:
+                del self.pending[i]
+                self.running[name] = self.running.get(name, 0) + 1
+                return job
+        return None
+
+    def _work(self):
+        self.cond.acquire()
+        try:
+            while True:
+                job = self._takeJob()
+                if job is None:
+                    self.idle += 1
+                    self.cond.wait()
+                    self.idle -= 1
+                    continue
+                (name, f, args, kwargs, _) = job
+                self.cond.release()
+                try:
+                    try:
+                        f(*args, **kwargs)
+                    except Exception:
+                        log.exception('Uncaught exception in threaded command '
+                                      'for %s:', name)
+                finally:
+                    self.cond.acquire()
+                    self.running[name] -= 1
+                    self.completed += 1
+        finally:
+            self.cond.release()
+
+    def stats(self):
+        """Returns a dictionary of statistics about the pool."""
+        self.cond.acquire()
+        try:
+            return {'workers': self.workers,
+                    'busy': self.workers - self.idle,
+                    'queued': len(self.pending),
+                    'maxQueued': self.maxQueued,
+                    'submitted': self.submitted,
+                    'completed': self.completed,
+                    'shed': self.shed}
+        finally:
+            self.cond.release()
+
+commandPool = CommandPool()
+
 class CommandThread(world.SupyThread):
     """Just does some extra logging and error-recovery for commands that need
     to run in threads.
+
+    Deprecated: threaded commands run on commandPool now, and so should other
+    work plugins do in the background (see CommandPool.submit).  This is only
+    kept so plugins still using it keep working.
     """
+    _warned = set()
     def __init__(self, target=None, args=(), kwargs={}):
         self.command = args[0]
         self.cb = target.im_self
+        if self.cb.name() not in self._warned:
+            self._warned.add(self.cb.name())
+            log.warning('%s uses callbacks.CommandThread, which is '
+                        'deprecated; it should use callbacks.commandPool.',
+                        self.cb.name())
         threadName = 'Thread #%s (for %s.%s)' % (world.threadsSpawned,
                                                  self.cb.name(),
                                                  self.command)
@@ -1048,6 +1187,7 @@ class DisabledCommands(object):
                     self.d[command].add(plugin)
             else:
                 self.d[command] = CanonicalNameSet([plugin])
+        invalidateCommands()
 
     def remove(self, command, plugin=None):
         if plugin is None:
@@ -1055,6 +1195,120 @@ class DisabledCommands(object):
         else:
             if self.d[command] is not None:
                 self.d[command].remove(plugin)
+        invalidateCommands()
+
+class CommandTable(object):
+    """A trie mapping command paths (lists of canonical names, like
+    ['channel', 'op'] or ['op']) to the plugins from a list of callbacks that
+    have them as commands.  Looking up a command costs the same however many
+    plugins are loaded; only the commands of plugins invalidated since the
+    last lookup are recomputed."""
+    def __init__(self, callbacks):
+        self.callbacks = callbacks
+        self.lock = threading.Lock()
+        self.root = ({}, []) # (children, plugins)
+        self.paths = {}
+        self.order = {}
+        self.stale = None # None means every plugin is stale.
+
+    def invalidate(self, cb=None):
+        self.lock.acquire()
+        try:
+            if cb is None:
+                self.stale = None
+            elif self.stale is not None:
+                self.stale.add(cb)
+        finally:
+            self.lock.release()
+
+    def _commandPaths(self, cb):
+        name = cb.canonicalName()
+        for command in cb.listCommands():
+            path = tuple(map(canonicalName, command.split()))
+            yield path
+            yield (name,) + path
+
+    def _add(self, path, cb):
+        node = self.root
+        for name in path:
+            node = node[0].setdefault(name, ({}, []))
+        if cb not in node[1]:
+            node[1].append(cb)
+
+    def _remove(self, path, cb):
+        nodes = [self.root]
+        for name in path:
+            nodes.append(nodes[-1][0][name])
+        if cb in nodes[-1][1]:
+            nodes[-1][1].remove(cb)
+        while len(nodes) > 1 and not nodes[-1][0] and not nodes[-1][1]:
+            nodes.pop()
+            del nodes[-1][0][path[len(nodes)-1]]
+
+    def _update(self):
+        self.order = {}
+        for (i, cb) in enumerate(self.callbacks):
+            self.order[cb] = i
+        if self.stale is None:
+            self.root = ({}, [])
+            self.paths = {}
+            stale = list(self.callbacks)
+        else:
+            stale = self.stale
+        for cb in stale:
+            for path in self.paths.pop(cb, ()):
+                self._remove(path, cb)
+            if cb in self.order and hasattr(cb, 'getCommand'):
+                try:
+                    paths = set(self._commandPaths(cb))
+                except Exception:
+                    log.exception('Uncaught exception listing commands of %s.',
+                                  cb.name())
+                    continue
+                for path in paths:
+                    self._add(path, cb)
+                self.paths[cb] = paths
+        self.stale = set()
+
+    def find(self, args):
+        """Returns a two-tuple of (command, plugins), command being the longest
+        prefix of args that's a command in some plugins, and plugins those
+        plugins, in the order of our callbacks."""
+        self.lock.acquire()
+        try:
+            if self.stale is None or self.stale:
+                self._update()
+            node = self.root
+            command = []
+            cbs = []
+            for (i, name) in enumerate(args):
+                node = node[0].get(name)
+                if node is None:
+                    break
+                if node[1]:
+                    command = args[:i+1]
+                    cbs = node[1]
+            cbs = sorted(cbs, key=self.order.get)
+            return (command, cbs)
+        finally:
+            self.lock.release()
+
+def getCommandTable(irc):
+    """Returns the CommandTable of the given Irc (or proxy thereof)."""
+    if not isinstance(irc, irclib.Irc):
+        irc = irc.getRealIrc()
+    if irc.commandTable is None:
+        irc.commandTable = CommandTable(irc.callbacks)
+    return irc.commandTable
+
+def invalidateCommands(cb=None):
+    """Plugins whose commands change at runtime (rather than by being added to
+    or removed from an Irc) must call this with themselves after each change,
+    so it's seen by the command tables."""
+    for irc in world.ircs:
+        table = getattr(irc, 'commandTable', None)
+        if table is not None:
+            table.invalidate(cb)
 
 class BasePlugin(object):
     def __init__(self, *args, **kwargs):
@@ -1262,28 +1516,47 @@ class PluginMixin(BasePlugin, irclib.IrcCallback):
         else:
             self.__parent.__call__(irc, msg)
 
+    def handlesCommand(self, command):
+        # Our __call__ only checks ignores before dispatching, so it doesn't
+        # make us handle anything the dispatch wouldn't.
+        if self.__class__.__call__.im_func is not PluginMixin.__call__.im_func:
+            return True
+        return self.dispatchCommand(command) is not None
+
+    _registryNodes = None
+    _registryGeneration = None
+    def _registryNode(self, name, channel=None):
+        # Plugins look up the same few values for every message, so we keep
+        # the nodes we find until the registry's layout changes.
+        if self._registryGeneration != registry.generation:
+            self._registryNodes = {}
+            self._registryGeneration = registry.generation
+        try:
+            return self._registryNodes[name, channel]
+        except KeyError:
+            group = conf.supybot.plugins.get(self.name())
+            for part in registry.split(name):
+                group = group.get(part)
+            if channel is not None:
+                if ircutils.isChannel(channel):
+                    group = group.get(channel)
+                else:
+                    self.log.debug('registryValue got channel=%r', channel)
+            if self._registryGeneration == registry.generation:
+                if len(self._registryNodes) >= 1000:
+                    self._registryNodes.clear()
+                self._registryNodes[name, channel] = group
+            return group
+
     def registryValue(self, name, channel=None, value=True):
-        plugin = self.name()
-        group = conf.supybot.plugins.get(plugin)
-        names = registry.split(name)
-        for name in names:
-            group = group.get(name)
-        if channel is not None:
-            if ircutils.isChannel(channel):
-                group = group.get(channel)
-            else:
-                self.log.debug('registryValue got channel=%r', channel)
+        group = self._registryNode(name, channel)
         if value:
             return group()
         else:
             return group
 
     def setRegistryValue(self, name, value, channel=None):
-        plugin = self.name()
-        group = conf.supybot.plugins.get(plugin)
-        names = registry.split(name)
-        for name in names:
-            group = group.get(name)
+        group = self._registryNode(name)
         if channel is None:
             group.setValue(value)
         else:
@@ -32,6 +32,7 @@
 Includes wrappers for commands.
 """
 
+import os
 import time
 import types
 import getopt
@@ -58,13 +59,16 @@ import supybot.callbacks as callbacks
 # Thread has to be a non-arg wrapper because by the time we're parsing and
 # validating arguments, we're inside the function we'd want to thread.
 def thread(f):
-    """Makes sure a command spawns a thread when called."""
+    """Makes sure a command is run in a thread (from the command pool) when
+    called."""
     def newf(self, irc, msg, args, *L, **kwargs):
         if world.isMainThread():
             targetArgs = (self.callingCommand, irc, msg, args) + tuple(L)
-            t = callbacks.CommandThread(target=self._callCommand,
-                                        args=targetArgs, kwargs=kwargs)
-            t.start()
+            def tooBusy():
+                irc.error('I\'m too busy to run that command right now.  '
+                          'Please try again later.')
+            callbacks.commandPool.submit(self.name(), self._callCommand,
+                                         targetArgs, kwargs, onShed=tooBusy)
         else:
             f(self, irc, msg, args, *L, **kwargs)
     return utils.python.changeFunctionName(newf, f.func_name, f.__doc__)
@@ -106,23 +110,138 @@ def process(f, *args, **kwargs):
         v = "Error: " + str(v)
     return v
 
+def _regexpWorker(conn, parentConn):
+    """Runs in a RegexpWorker's process: matches each (reobj, strings) job it
+    is sent, sending back whether each string matched as soon as it's done."""
+    parentConn.close()
+    # We're forked from a running bot, and we live as long as it does, so we
+    # mustn't keep its sockets (or anything else it has open) open with us:
+    # a connection the bot closes wouldn't really be closed.
+    try:
+        maxfd = os.sysconf('SC_OPEN_MAX')
+    except (AttributeError, ValueError):
+        maxfd = 256
+    fd = conn.fileno()
+    os.closerange(3, fd)
+    os.closerange(fd + 1, maxfd)
+    while True:
+        try:
+            (reobj, strings) = conn.recv()
+        except EOFError:
+            break
+        for s in strings:
+            try:
+                conn.send(reobj.search(s) is not None)
+            except Exception:
+                conn.send(False)
+
+class RegexpWorker(object):
+    """A long-lived process matching regexps on behalf of a RegexpPool."""
+    def __init__(self):
+        (self.conn, child) = multiprocessing.Pipe()
+        self.process = callbacks.CommandProcess(target=_regexpWorker,
+                                                args=(child, self.conn),
+                                                kwargs={'pn': 'commands',
+                                                        'cn': 'regexp'})
+        self.process.daemon = True
+        self.process.start()
+        child.close()
+
+    def kill(self):
+        self.process.terminate()
+        self.process.join()
+        self.conn.close()
+
+class RegexpPool(object):
+    """A pool of pre-forked processes for matching regexps given by users,
+    since specially-crafted regexps can use exponential time and hang the bot.
+
+    A worker taking too long is killed and replaced, so the protection costs
+    a round trip to another process per match rather than a fork.
+    """
+    def __init__(self, size=2):
+        self.size = size
+        self.started = 0
+        self.lock = threading.Lock()
+        self.idle = Queue.Queue()
+
+    def _acquire(self):
+        try:
+            return self.idle.get_nowait()
+        except Queue.Empty:
+            pass
+        self.lock.acquire()
+        try:
+            if self.started < self.size:
+                worker = RegexpWorker()
+                self.started += 1
+                return worker
+        finally:
+            self.lock.release()
+        return self.idle.get()
+
+    def search(self, reobj, strings, timeout, name='regexp'):
+        """Returns a list of whether reobj.search matches each of strings.
+        A string whose match takes more than timeout seconds is considered not
+        to match, and the worker matching it is replaced."""
+        strings = list(strings)
+        results = []
+        worker = self._acquire()
+        try:
+            while len(results) < len(strings):
+                rest = strings[len(results):]
+                try:
+                    worker.conn.send((reobj, rest))
+                    for _ in rest:
+                        if not worker.conn.poll(timeout):
+                            log.info('%s aborted due to timeout.', name)
+                            break
+                        results.append(worker.conn.recv())
+                    else:
+                        continue
+                except (EOFError, IOError), e:
+                    log.warning('Regexp worker for %s died: %s', name,
+                                utils.exnToString(e))
+                results.append(False)
+                worker.kill()
+                worker = None
+                worker = RegexpWorker()
+        finally:
+            if worker is not None:
+                self.idle.put(worker)
+            else:
+                # We couldn't replace the worker we killed (fork failed, for
+                # instance); a later search may start another.
+                self.lock.acquire()
+                try:
+                    self.started -= 1
+                finally:
+                    self.lock.release()
+        return results
+
+regexpPool = RegexpPool()
+
 def regexp_wrapper(s, reobj, timeout, plugin_name, fcn_name):
-    '''A convenient wrapper to stuff regexp search queries through a subprocess.
-    
+    '''A convenient wrapper to stuff regexp search queries through
+    regexpPool.
+
     This is used because specially-crafted regexps can use exponential time
     and hang the bot.'''
-    def re_bool(s, reobj):
-        """Since we can't enqueue match objects into the multiprocessing queue,
-        we'll just wrap the function to return bools."""
-        if reobj.search(s) is not None:
-            return True
-        else:
-            return False
-    try:
-        v = process(re_bool, s, reobj, timeout=timeout, pn=plugin_name, cn=fcn_name)
-        return v
-    except ProcessTimeoutError:
-        return False
+    name = '%s.%s' % (plugin_name, fcn_name)
+    return regexpPool.search(reobj, [s], timeout, name=name)[0]
+
+def regexp_filter(items, reobj, timeout, plugin_name, fcn_name, key=None):
+    """Returns a list of the items reobj matches (or whose key(item) it
+    matches, if key is given), like regexp_wrapper, but sending them all
+    through regexpPool as a single job rather than one job per item."""
+    items = list(items)
+    if key is None:
+        strings = items
+    else:
+        strings = [key(item) for item in items]
+    name = '%s.%s' % (plugin_name, fcn_name)
+    results = regexpPool.search(reobj, strings, timeout, name=name)
+    return [item for (item, matched) in zip(items, results) if matched]
 
 class UrlSnarfThread(world.SupyThread):
     def __init__(self, *args, **kwargs):
@@ -503,9 +622,7 @@ def getLowered(irc, msg, args, state):
     state.args.append(ircutils.toLower(args.pop(0)))
 
 def getSomething(irc, msg, args, state, errorMsg=None, p=None):
-    if p is None:
-        p = lambda _: True
-    if not args[0] or not p(args[0]):
+    if not args[0] or (p is not None and not p(args[0])):
         if errorMsg is None:
             errorMsg = 'You must not give the empty string as an argument.'
         state.error(errorMsg, Raise=True)
@@ -743,9 +860,12 @@ class context(object):
             self.converter = spec
 
     def __call__(self, irc, msg, args, state):
-        log.debug('args before %r: %r', self, args)
-        self.converter(irc, msg, args, state, *self.args)
-        log.debug('args after %r: %r', self, args)
+        if log.isDebugging():
+            log.debug('args before %r: %r', self, args)
+            self.converter(irc, msg, args, state, *self.args)
+            log.debug('args after %r: %r', self, args)
+        else:
+            self.converter(irc, msg, args, state, *self.args)
 
     def __repr__(self):
         return '<%s for %s>' % (self.__class__.__name__, self.spec)
@@ -906,17 +1026,21 @@ class getopts(context):
 
 class State(object):
     log = log
-    def __init__(self, types):
+    def __init__(self, types, irc=None):
         self.args = []
         self.kwargs = {}
         self.types = types
         self.channel = None
         self.errored = False
+        self.irc = irc
 
     def __getattr__(self, attr):
         if attr.startswith('error'):
             self.errored = True
-            return getattr(dynamic.irc, attr)
+            irc = self.__dict__.get('irc')
+            if irc is None:
+                irc = dynamic.irc
+            return getattr(irc, attr)
         else:
             raise AttributeError, attr
 
@@ -937,25 +1061,37 @@ class State(object):
 # This is a compiled Spec object.
 ###
 class Spec(object):
-    def _state(self, types, attrs={}):
-        st = State(types)
-        st.__dict__.update(attrs)
-        st.allowExtra = self.allowExtra
-        return st
-
     def __init__(self, types, allowExtra=False):
         self.types = types
         self.allowExtra = allowExtra
         utils.seq.mapinto(contextify, self.types)
+        self.steps = tuple(map(self._compile, self.types))
+
+    def _compile(self, spec):
+        # Each step is a (context, converter, args) triple.  Plain contexts
+        # don't do anything but call their converter with their args, so when
+        # we're not debugging, we call the converter ourselves.
+        if spec.__class__ is context:
+            return (spec, spec.converter, spec.args)
+        else:
+            return (spec, spec, ())
 
     def __call__(self, irc, msg, args, stateAttrs={}):
-        state = self._state(self.types[:], stateAttrs)
-        while state.types:
-            context = state.types.pop(0)
-            try:
-                context(irc, msg, args, state)
-            except IndexError:
-                raise callbacks.ArgumentError
+        state = State(self.types, irc)
+        state.allowExtra = self.allowExtra
+        if stateAttrs:
+            state.__dict__.update(stateAttrs)
+        debugging = log.isDebugging()
+        try:
+            for (spec, converter, L) in self.steps:
+                if debugging:
+                    spec(irc, msg, args, state)
+                elif L:
+                    converter(irc, msg, args, state, *L)
+                else:
+                    converter(irc, msg, args, state)
+        except IndexError:
+            raise callbacks.ArgumentError
         if args and not state.allowExtra:
             log.debug('args and not self.allowExtra: %r', args)
             raise callbacks.ArgumentError
@@ -966,7 +1102,8 @@ def wrap(f, specList=[], name=None, **kw):
     spec = Spec(specList, **kw)
     def newf(self, irc, msg, args, **kwargs):
         state = spec(irc, msg, args, stateAttrs={'cb': self, 'log': self.log})
-        self.log.debug('State before call: %s', state)
+        if log.isDebugging(self.log):
+            self.log.debug('State before call: %s', state)
         if state.errored:
             self.log.debug('Refusing to call %s due to state.errored.', f)
         else:
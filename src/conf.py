@@ -273,6 +273,21 @@ def registerNetwork(name, password='', ssl=False):
         to %s.""" % name))
     registerChannelValue(network.channels, 'key', registry.String('',
         """Determines what key (if any) will be used to join the channel."""))
+    registerGlobalValue(network, 'throttle', registry.Float(0.0,
+        """Determines how many seconds of flood penalty the bot may build up
+        on %s before it waits for the penalty to drain, as ircds do: each
+        message sent adds supybot.networks.%s.throttle.messageCost seconds
+        plus a second for every supybot.networks.%s.throttle.bytesPerSecond
+        bytes in it, and the penalty drains at a second per second.  This
+        lets the bot send bursts of messages without being disconnected for
+        excess flood.  If this is 0, queued messages are instead sent once per
+        supybot.protocols.irc.throttleTime seconds.""" % (name, name, name)))
+    registerGlobalValue(network.throttle, 'messageCost', registry.Float(2.0,
+        """Determines how many seconds of flood penalty each message sent to
+        %s costs, before counting its length.""" % name))
+    registerGlobalValue(network.throttle, 'bytesPerSecond',
+        registry.PositiveInteger(120, """Determines how many bytes of a message
+        sent to %s cost a second of flood penalty.""" % name))
     return network
 
 # Let's fill our networks.
@@ -615,6 +630,30 @@ registerGlobalValue(supybot.commands.defaultPlugins, 'importantPlugins',
         change this if you don't know what you're doing; if you do know what
         you're doing, then also know that this set is case-sensitive."""))
 
+registerGroup(supybot.commands, 'threads')
+registerGlobalValue(supybot.commands.threads, 'workers',
+    registry.PositiveInteger(10, """Determines how many threads the bot will
+    use to run threaded commands.  Threaded commands beyond this many wait in
+    a queue until one of these threads is free."""))
+registerGlobalValue(supybot.commands.threads, 'queue',
+    registry.PositiveInteger(100, """Determines how many threaded commands
+    may be waiting for a free thread.  What happens to commands beyond this
+    many is determined by supybot.commands.threads.whenFull."""))
+registerGlobalValue(supybot.commands.threads, 'perPlugin',
+    registry.NonNegativeInteger(4, """Determines how many threaded commands
+    from any one plugin may be running at once, so a plugin with slow commands
+    can't take all the threads.  If this is 0, there is no limit."""))
+
+class ValidShedPolicy(registry.OnlySomeStrings):
+    validStrings = ('refuse', 'dropOldest')
+
+registerGlobalValue(supybot.commands.threads, 'whenFull',
+    ValidShedPolicy('refuse', """Determines what the bot does with a threaded
+    command when supybot.commands.threads.queue commands are already waiting.
+    If this is refuse, the new command is refused; if it's dropOldest, the
+    command that has been waiting longest is dropped instead.  Either way, the
+    user whose command isn't run gets an error."""))
+
 # supybot.commands.disabled moved to callbacks for canonicalName.
 
 ###
@@ -665,13 +704,19 @@ registerGlobalValue(supybot.drivers, 'poll',
     driver should block waiting for input."""))
 
 class ValidDriverModule(registry.OnlySomeStrings):
-    validStrings = ('default', 'Socket', 'Twisted')
+    validStrings = ('default', 'Socket', 'Select', 'Twisted')
 
 registerGlobalValue(supybot.drivers, 'module',
     ValidDriverModule('default', """Determines what driver module the bot will
     use.  Socket, a simple driver based on timeout sockets, is used by default
-    because it's simple and stable.  Twisted is very stable and simple, and if
-    you've got Twisted installed, is probably your best bet."""))
+    because it's simple and stable.  Select waits on all of the bot's
+    connections at once (using epoll where available), so it's a better choice
+    for bots connected to many networks.  Twisted is very stable and simple,
+    and if you've got Twisted installed, is probably your best bet."""))
+
+registerGlobalValue(supybot.drivers, 'recvSize',
+    registry.PositiveInteger(65536, """Determines how many bytes the socket
+    drivers will try to read from a connection at once."""))
 
 registerGlobalValue(supybot.drivers, 'maxReconnectWait',
     registry.PositiveFloat(300.0, """Determines the maximum time the bot will
@@ -31,11 +31,16 @@
 Module for some slight database-independence for simple databases.
 """
 
+import os
+import re
 import csv
 import math
+import random
+import threading
 
 import supybot.cdb as cdb
 import supybot.utils as utils
+import supybot.world as world
 from supybot.utils.iter import ilen
 
 class Error(Exception):
@@ -74,6 +79,19 @@ class MappingInterface(object):
         "Return an iterator over (id, s) pairs.  Not required to be ordered."
         raise NotImplementedError
 
+    def size(self):
+        "Returns the number of records in the database."
+        return ilen(self)
+
+    def random(self):
+        """Returns a random (id, s) pair.  Raises IndexError if there are no
+        records."""
+        return utils.iter.choice(self)
+
+    # Whether flush has anything to write, i.e., whether a DB using this
+    # mapping should be flushed periodically with world.flushers.
+    needsFlushing = True
+
     def flush(self):
         """Flushes current state to disk."""
         raise NotImplementedError
@@ -88,6 +106,7 @@ class MappingInterface(object):
 
 
 class DirMapping(MappingInterface):
+    needsFlushing = False
     def __init__(self, filename, **kwargs):
         self.dirname = filename
         if not os.path.exists(self.dirname):
@@ -143,6 +162,7 @@ class DirMapping(MappingInterface):
             raise NoRecordError, id
 
 class FlatfileMapping(MappingInterface):
+    needsFlushing = False
     def __init__(self, filename, maxSize=10**6):
         self.filename = filename
         try:
@@ -269,7 +289,212 @@ class FlatfileMapping(MappingInterface):
 
     def close(self):
         self.vacuum() # Should we do this?  It should be fine.
-        
+
+
+class IndexedFlatfileMapping(FlatfileMapping):
+    """A FlatfileMapping that keeps the offset of each record in the file, so
+    getting, setting, and removing a record doesn't read the whole file.  The
+    file format is the same, so existing databases can switch to this freely.
+    Nothing else may write to the file while it's open, though.
+
+    Changes are appended to the file, with the old record's id overwritten by
+    dashes, just as FlatfileMapping does, and are on disk before the method
+    making them returns.  Like FlatfileMapping, we only hold the file open for
+    the length of each operation, so a bot with many databases doesn't run
+    out of file descriptors.  vacuum compacts the file in another thread."""
+    def __init__(self, filename, maxSize=10**6):
+        FlatfileMapping.__init__(self, filename, maxSize=maxSize)
+        self.lock = threading.RLock()
+        self.vacuumThread = None
+        self._readIndex()
+
+    def _readIndex(self):
+        fd = file(self.filename, 'rb')
+        try:
+            data = fd.read()
+        finally:
+            fd.close()
+        self.index = {}
+        self.removed = 0
+        start = data.find('\n') + 1 # Skip the first line, nextId.
+        while 0 < start < len(data):
+            end = data.find('\n', start)
+            if end == -1:
+                end = len(data)
+            strId = data[start:data.find(':', start, end)]
+            try:
+                id = int(strId)
+                if id in self.index:
+                    self.removed += 1
+                self.index[id] = start
+            except ValueError:
+                self.removed += 1 # Removed (or corrupt) record.
+            start = end + 1
+        if self.index:
+            # If we died between writing a record and the new nextId, don't
+            # give its id out again.
+            self.currentId = max(self.currentId, max(self.index) + 1)
+
+    def _sync(self, fd):
+        fd.flush()
+        os.fsync(fd.fileno())
+
+    def _append(self, fd, id, s):
+        fd.seek(0, 2) # End.
+        self.index[id] = fd.tell()
+        fd.write(self._joinLine(id, s))
+
+    def _remove(self, fd, id):
+        offset = self.index.pop(id, None)
+        if offset is not None:
+            fd.seek(offset)
+            fd.write(self._canonicalId(None))
+            self.removed += 1
+
+    def add(self, s):
+        self.lock.acquire()
+        try:
+            fd = file(self.filename, 'r+b')
+            try:
+                id = self.currentId
+                self._append(fd, id, s)
+                self._incrementCurrentId(fd)
+                self._sync(fd)
+                return id
+            finally:
+                fd.close()
+        finally:
+            self.lock.release()
+
+    def get(self, id):
+        self.lock.acquire()
+        try:
+            try:
+                offset = self.index[int(id)]
+            except (KeyError, ValueError):
+                raise NoRecordError, id
+            fd = file(self.filename, 'rb')
+            try:
+                fd.seek(offset)
+                return self._splitLine(fd.readline())[1]
+            finally:
+                fd.close()
+        finally:
+            self.lock.release()
+
+    def set(self, id, s):
+        id = int(id)
+        self.lock.acquire()
+        try:
+            fd = file(self.filename, 'r+b')
+            try:
+                self._remove(fd, id)
+                self._append(fd, id, s)
+                self._sync(fd)
+            finally:
+                fd.close()
+        finally:
+            self.lock.release()
+
+    def remove(self, id):
+        id = int(id)
+        self.lock.acquire()
+        try:
+            fd = file(self.filename, 'r+b')
+            try:
+                self._remove(fd, id)
+                self._sync(fd)
+            finally:
+                fd.close()
+        finally:
+            self.lock.release()
+
+    def size(self):
+        return len(self.index)
+
+    def random(self):
+        self.lock.acquire()
+        try:
+            id = random.choice(self.index.keys())
+            return (id, self.get(id))
+        finally:
+            self.lock.release()
+
+    def _vacuum(self):
+        # We copy the live records without holding the lock, so the bot can
+        # keep using the database meanwhile.  Then, with the lock held, we
+        # bring the copy up to date with the changes made since we started
+        # and move it over the original file.
+        self.lock.acquire()
+        try:
+            if not self.removed:
+                return
+            copied = os.path.getsize(self.filename)
+        finally:
+            self.lock.release()
+        infd = file(self.filename, 'rb')
+        outfd = utils.file.AtomicFile(self.filename, 'wb',
+                                      makeBackupIfSmaller=False)
+        try:
+            try:
+                outfd.write(infd.readline()) # First line, nextId.
+                index = {}
+                while infd.tell() < copied:
+                    line = infd.readline()
+                    if not line.startswith('-'):
+                        index[int(self._splitLine(line)[0])] = outfd.tell()
+                        outfd.write(line)
+                self.lock.acquire()
+                try:
+                    removed = 0
+                    for (id, offset) in index.items():
+                        if self.index.get(id, copied) >= copied:
+                            # Removed or set since we copied it.
+                            outfd.seek(offset)
+                            outfd.write(self._canonicalId(None))
+                            del index[id]
+                            removed += 1
+                    outfd.seek(0, 2) # End.
+                    for (id, offset) in self.index.iteritems():
+                        if offset >= copied:
+                            infd.seek(offset)
+                            index[id] = outfd.tell()
+                            outfd.write(infd.readline())
+                    outfd.seek(0)
+                    outfd.write(self._canonicalId(self.currentId))
+                    self._sync(outfd)
+                    outfd.close()
+                    self.index = index
+                    self.removed = removed
+                finally:
+                    self.lock.release()
+            except:
+                outfd.rollback()
+                raise
+        finally:
+            infd.close()
+
+    def vacuum(self):
+        self.lock.acquire()
+        try:
+            if not self.removed:
+                return
+            if self.vacuumThread is None or not self.vacuumThread.isAlive():
+                self.vacuumThread = world.SupyThread(target=self._vacuum,
+                                       name='Vacuuming %s' % self.filename)
+                self.vacuumThread.setDaemon(True)
+                self.vacuumThread.start()
+        finally:
+            self.lock.release()
+
+    def flush(self):
+        pass # No-op, every change is written before it returns.
+
+    def close(self):
+        if self.vacuumThread is not None:
+            self.vacuumThread.join()
+        self._vacuum()
+
 
 class CdbMapping(MappingInterface):
     def __init__(self, filename, **kwargs):
@@ -317,7 +542,7 @@ class CdbMapping(MappingInterface):
 
 
 class DB(object):
-    Mapping = 'flat' # This is a good, sane default.
+    Mapping = 'indexed' # This is a good, sane default.
     Record = None
     def __init__(self, filename, Mapping=None, Record=None):
         if Record is not None:
@@ -327,6 +552,10 @@ class DB(object):
         if isinstance(self.Mapping, basestring):
             self.Mapping = Mappings[self.Mapping]
         self.map = self.Mapping(filename)
+        # Only some mappings keep changes in memory; registering the others
+        # would just keep every DB alive until it's closed.
+        if self.map.needsFlushing:
+            world.flushers.append(self.flush)
 
     def _newRecord(self, id, s):
         record = self.Record(id=id)
@@ -362,12 +591,12 @@ class DB(object):
 
     def random(self):
         try:
-            return self._newRecord(*utils.iter.choice(self.map))
+            return self._newRecord(*self.map.random())
         except IndexError:
             return None
 
     def size(self):
-        return ilen(self.map)
+        return self.map.size()
 
     def flush(self):
         self.map.flush()
@@ -376,58 +605,149 @@ class DB(object):
         self.map.vacuum()
 
     def close(self):
+        if self.flush in world.flushers:
+            world.flushers.remove(self.flush)
         self.map.close()
 
 Mappings = {
     'cdb': CdbMapping,
     'flat': FlatfileMapping,
+    'indexed': IndexedFlatfileMapping,
     }
 
 
+# Records are serialized as this version marker followed by tab-separated
+# fields, each a one-character type code and the value, escaped so it has no
+# tabs or newlines.  Records from before this format are comma-separated reprs
+# of their fields, which we still read; they're rewritten as they're changed.
+_recordVersion = '%1\t'
+
+def _encodeValue(x):
+    t = type(x)
+    if t is str:
+        return 's' + x.encode('string_escape')
+    elif t is bool:
+        return 'b%d' % x
+    elif t is int or t is long:
+        return 'i%d' % x
+    elif t is float:
+        return 'f' + repr(x)
+    elif x is None:
+        return 'n'
+    elif t is unicode:
+        return 'u' + x.encode('unicode_escape')
+    else:
+        return 'r' + repr(x).encode('string_escape')
+
+def _decodeValue(s, converter):
+    code = s[:1]
+    s = s[1:]
+    if code == 's':
+        return s.decode('string_escape')
+    elif code == 'i':
+        return int(s)
+    elif code == 'f':
+        return float(s)
+    elif code == 'n':
+        return None
+    elif code == 'b':
+        return s == '1'
+    elif code == 'u':
+        return s.decode('unicode_escape')
+    elif code == 'r':
+        return converter(s.decode('string_escape'))
+    else:
+        raise ValueError, 'Invalid record field: %r' % (code + s)
+
+_numberRe = re.compile(r'^-?\d+(\.\d*)?(e[-+]?\d+)?$', re.I)
+def _decodeRepr(s, converter):
+    # Most fields of old records are reprs of strings or numbers, which we can
+    # decode much faster than safeEval can parse them.
+    if len(s) > 1 and s[0] == s[-1] and s[0] in '\'"':
+        return s[1:-1].decode('string_escape')
+    elif _numberRe.match(s):
+        if s.isdigit() or (s[0] == '-' and s[1:].isdigit()):
+            return int(s)
+        else:
+            return float(s)
+    else:
+        return converter(s)
+
 class Record(object):
     def __init__(self, id=None, **kwargs):
         if id is not None:
             assert isinstance(id, int), 'id must be an integer.'
         self.id = id
-        self.fields = []
-        self.defaults = {}
-        self.converters = {}
-        for name in self.__fields__:
-            if isinstance(name, tuple):
-                (name, spec) = name
-            else:
-                spec = utils.safeEval
-            assert name != 'id'
-            self.fields.append(name)
-            if isinstance(spec, tuple):
-                (converter, default) = spec
-            else:
-                converter = spec
-                default = None
-            self.defaults[name] = default
-            self.converters[name] = converter
-        seen = set()
+        (self.fields, self.defaults, self.converters) = self._getSpec()
         for (name, value) in kwargs.iteritems():
             assert name in self.fields, 'name must be a record value.'
-            seen.add(name)
             setattr(self, name, value)
         for name in self.fields:
-            if name not in seen:
+            if name not in kwargs:
                 default = self.defaults[name]
                 if callable(default):
                     default = default()
                 setattr(self, name, default)
 
+    def _getSpec(cls):
+        # Every record of a class has the same fields, so we only work them
+        # out once (but not for subclasses, which may have different ones).
+        if '_Record__spec' not in cls.__dict__:
+            fields = []
+            defaults = {}
+            converters = {}
+            for name in cls.__fields__:
+                if isinstance(name, tuple):
+                    (name, spec) = name
+                else:
+                    spec = utils.safeEval
+                assert name != 'id'
+                fields.append(name)
+                if isinstance(spec, tuple):
+                    (converter, default) = spec
+                else:
+                    converter = spec
+                    default = None
+                defaults[name] = default
+                converters[name] = converter
+            cls.__spec = (fields, defaults, converters)
+        return cls.__spec
+    _getSpec = classmethod(_getSpec)
+
     def serialize(self):
-        return csv.join([repr(getattr(self, name)) for name in self.fields])
+        values = [_encodeValue(getattr(self, name)) for name in self.fields]
+        return _recordVersion + '\t'.join(values)
 
     def deserialize(self, s):
-        unseenRecords = set(self.fields)
-        for (name, strValue) in zip(self.fields, csv.split(s)):
-            setattr(self, name, self.converters[name](strValue))
-            unseenRecords.remove(name)
-        for name in unseenRecords:
+        # Fields are only decoded when they're first used (see __getattr__),
+        # since searches usually look at only one or two of them.
+        if s.startswith(_recordVersion):
+            values = s[len(_recordVersion):].split('\t')
+            self._versioned = True
+        else:
+            values = csv.split(s)
+            self._versioned = False
+        self._undecoded = dict(zip(self.fields, values))
+        for name in self._undecoded:
+            self.__dict__.pop(name, None)
+        for name in self.fields[len(values):]:
             setattr(self, name, self.defaults[name])
 
+    def __getattr__(self, name):
+        try:
+            s = self.__dict__['_undecoded'][name]
+        except KeyError:
+            raise AttributeError, name
+        converter = self.converters[name]
+        if self._versioned:
+            value = _decodeValue(s, converter)
+        elif converter is utils.safeEval or converter is eval:
+            value = _decodeRepr(s, converter)
+        else:
+            value = converter(s)
+        setattr(self, name, value)
+        self._undecoded.pop(name, None)
+        return value
+
     
 # vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,318 @@
+###
+# Copyright (c) 2002-2004, Jeremiah Fincher
+# Copyright (c) 2010, James Vega
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+"""
+Contains a socket driver that waits on every connection at once.  Rather than
+having each connection block in recv for supybot.drivers.poll seconds in turn,
+a single Reactor selects (or epolls, where available) on all their sockets and
+only wakes up when one of them is ready or the next scheduled event is due.
+"""
+
+from __future__ import division
+
+import os
+import time
+import errno
+import select
+import socket
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+import supybot.conf as conf
+import supybot.drivers as drivers
+import supybot.schedule as schedule
+from supybot.drivers.Socket import SocketDriver, ssl
+
+class SelectPoller(object):
+    """Waits on sockets with select.select."""
+    def poll(self, readers, writers, timeout):
+        try:
+            (r, w, _) = select.select(readers, writers, [], timeout)
+        except select.error, e:
+            if e.args[0] != errno.EINTR:
+                raise
+            return ([], [])
+        return (r, w)
+
+class EpollPoller(object):
+    """Waits on sockets with select.epoll.  Sockets stay registered between
+    polls; only those whose interest has changed are updated."""
+    def __init__(self):
+        self.epoll = select.epoll()
+        self.registered = {} # fd -> (mask, sock)
+
+    def _unregister(self, fd):
+        del self.registered[fd]
+        try:
+            self.epoll.unregister(fd)
+        except (IOError, ValueError):
+            # The kernel drops closed descriptors by itself.
+            pass
+
+    def _register(self, fd, mask, sock):
+        if fd in self.registered and self.registered[fd][1] is sock:
+            self.epoll.modify(fd, mask)
+        else:
+            # The descriptor may have been closed and reused by a new socket,
+            # so the kernel may or may not still know about it.
+            try:
+                self.epoll.register(fd, mask)
+            except IOError, e:
+                if e.args[0] != errno.EEXIST:
+                    raise
+                self.epoll.modify(fd, mask)
+        self.registered[fd] = (mask, sock)
+
+    def poll(self, readers, writers, timeout):
+        wanted = {}
+        for sock in readers:
+            wanted[sock.fileno()] = [select.EPOLLIN, sock]
+        for sock in writers:
+            fd = sock.fileno()
+            if fd in wanted:
+                wanted[fd][0] |= select.EPOLLOUT
+            else:
+                wanted[fd] = [select.EPOLLOUT, sock]
+        for fd in self.registered.keys():
+            if fd not in wanted:
+                self._unregister(fd)
+        for (fd, (mask, sock)) in wanted.iteritems():
+            if self.registered.get(fd) != (mask, sock):
+                self._register(fd, mask, sock)
+        try:
+            events = self.epoll.poll(timeout)
+        except IOError, e:
+            if e.args[0] != errno.EINTR:
+                raise
+            events = []
+        (r, w) = ([], [])
+        for (fd, event) in events:
+            sock = wanted[fd][1]
+            if event & (select.EPOLLIN | select.EPOLLERR | select.EPOLLHUP):
+                r.append(sock)
+            if event & select.EPOLLOUT:
+                w.append(sock)
+        return (r, w)
+
+class Waker(object):
+    """A pipe the Reactor waits on along with its sockets, so other threads
+    can interrupt its wait by writing to it."""
+    def __init__(self):
+        (self.r, self.w) = os.pipe()
+        for fd in (self.r, self.w):
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self.pending = False
+
+    def fileno(self):
+        return self.r
+
+    def wake(self):
+        if not self.pending:
+            self.pending = True
+            try:
+                os.write(self.w, 'x')
+            except OSError:
+                pass # The pipe is full, so we'll be woken anyway.
+
+    def clear(self):
+        self.pending = False
+        try:
+            while os.read(self.r, 1024):
+                continue
+        except OSError:
+            pass # Nothing left to read.
+
+class Reactor(drivers.IrcDriver):
+    """An IrcDriver doing the I/O for every SelectDriver, and firing
+    scheduled events as soon as they're due.
+
+    Messages queued by other threads (threaded commands, for instance) wake it
+    up through drivers.wakeup.  Where that's not possible (no fcntl), it waits
+    no longer than supybot.drivers.poll so they're still sent in a timely
+    manner.
+    """
+    def __init__(self):
+        drivers.IrcDriver.__init__(self)
+        self.drivers = set()
+        self.poller = self._newPoller()
+        if fcntl is not None:
+            self.waker = Waker()
+        else:
+            self.waker = None
+
+    def _newPoller(self):
+        if hasattr(select, 'epoll'):
+            return EpollPoller()
+        else:
+            return SelectPoller()
+
+    def name(self):
+        return self.__class__.__name__
+
+    def wakeup(self):
+        if self.waker is not None:
+            self.waker.wake()
+
+    def add(self, driver):
+        self.drivers.add(driver)
+
+    def remove(self, driver):
+        self.drivers.discard(driver)
+
+    def getTimeout(self, now):
+        """Returns how long we can wait before something other than one of
+        our sockets needs our attention."""
+        timeouts = [conf.supybot.drivers.poll()]
+        t = schedule.nextEventTime()
+        if t is not None:
+            timeouts.append(t - now)
+        for driver in self.drivers:
+            irc = driver.irc
+            if irc is None:
+                continue
+            for t in (driver.nextReconnectTime, driver.writeCheckTime):
+                if t is not None:
+                    timeouts.append(t - now)
+            if not driver.connected:
+                continue
+            t = irc.nextTakeTime()
+            if t is not None:
+                timeouts.append(t - now)
+        return max(0, min(timeouts))
+
+    def run(self):
+        # If we died, drivers.run would never run us again and every
+        # connection would go silent, so we log whatever goes wrong instead.
+        try:
+            self._run()
+        except Exception:
+            drivers.log.exception('Uncaught exception in %s:', self.name())
+            # The poller may be what broke, so we start over with a new one.
+            self.poller = self._newPoller()
+
+    def _run(self):
+        timeout = self.getTimeout(time.time())
+        socks = {}
+        (readers, writers, pending) = ([], [], [])
+        for driver in self.drivers:
+            if driver.connected and driver.irc is not None:
+                socks[driver.conn] = driver
+                readers.append(driver.conn)
+                if driver.outbuffer:
+                    writers.append(driver.conn)
+                # SSL sockets can hold decrypted data select doesn't know of.
+                if getattr(driver.conn, 'pending', None) and \
+                   driver.conn.pending():
+                    pending.append(driver.conn)
+        if pending:
+            timeout = 0
+        if self.waker is not None:
+            readers.append(self.waker)
+        if not readers:
+            # select on nothing isn't portable, so we just sleep.
+            time.sleep(timeout)
+            return
+        (r, w) = self.poller.poll(readers, writers, timeout)
+        readable = set(r)
+        writable = set(w)
+        readable.update(pending)
+        if self.waker in readable:
+            self.waker.clear()
+        schedule.run()
+        for (sock, driver) in socks.iteritems():
+            try:
+                if sock in readable and not driver._read():
+                    continue
+                # Output waiting means the socket wouldn't take all of it
+                # last time; we leave it be until the poller says it will.
+                if driver.connected and driver.irc is not None and \
+                   (sock in writable or not driver.outbuffer):
+                    driver._sendIfMsgs()
+            except Exception:
+                drivers.log.exception('Uncaught exception in %s:',
+                                      driver.name())
+                self.remove(driver)
+                drivers.remove(driver.name())
+
+class SelectDriver(SocketDriver):
+    """A SocketDriver whose reading and writing is done by the Reactor; its
+    own run method only takes care of reconnecting."""
+    def __init__(self, irc):
+        reactor.add(self)
+        SocketDriver.__init__(self, irc)
+
+    def run(self):
+        now = time.time()
+        if self.nextReconnectTime is not None and now > self.nextReconnectTime:
+            self.reconnect()
+        elif self.writeCheckTime is not None and now > self.writeCheckTime:
+            self._checkAndWriteOrReconnect()
+
+    def _setNonBlocking(self):
+        # The Reactor does the I/O for every connection, so a socket that
+        # blocked would hold up all the others.
+        if self.connected:
+            self.conn.setblocking(0)
+
+    def reconnect(self, reset=True):
+        SocketDriver.reconnect(self, reset=reset)
+        self._setNonBlocking()
+
+    def _checkAndWriteOrReconnect(self):
+        SocketDriver._checkAndWriteOrReconnect(self)
+        self._setNonBlocking()
+
+    def _handleSocketError(self, e):
+        # Our sockets don't block, so these only mean the socket isn't ready
+        # yet; the Reactor will come back to it when it is.
+        if isinstance(e, socket.error) and e.args and \
+           e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+            return
+        if ssl is not None and isinstance(e, ssl.SSLError) and e.args and \
+           e.args[0] in (ssl.SSL_ERROR_WANT_READ, ssl.SSL_ERROR_WANT_WRITE):
+            return
+        SocketDriver._handleSocketError(self, e)
+
+    def _reallyDie(self):
+        reactor.remove(self)
+        SocketDriver._reallyDie(self)
+
+
+Driver = SelectDriver
+
+try:
+    ignore(reactor)
+except NameError:
+    reactor = Reactor()
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
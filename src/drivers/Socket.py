@@ -37,6 +37,7 @@ from __future__ import division
 import time
 import select
 import socket
+from collections import deque
 
 import supybot.log as log
 import supybot.conf as conf
@@ -44,7 +45,6 @@ import supybot.utils as utils
 import supybot.world as world
 import supybot.drivers as drivers
 import supybot.schedule as schedule
-from supybot.utils.iter import imap
 
 try:
     import ssl
@@ -53,6 +53,61 @@ except ImportError:
                       'cannot connect to SSL servers.')
     ssl = None
 
+class OutputBuffer(object):
+    """The data waiting to be sent on a socket, kept as a queue of strings
+    rather than one string, so that adding to it and sending part of it don't
+    copy everything that's waiting.  Small strings are joined into chunks of
+    up to chunkSize bytes before they're sent, so each send can still write
+    many messages at once."""
+    chunkSize = 65536
+    def __init__(self):
+        self.chunks = deque()
+        self.offset = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def __nonzero__(self):
+        return bool(self.size)
+
+    def __str__(self):
+        return ''.join(self.chunks)[self.offset:]
+
+    def append(self, s):
+        if s:
+            self.chunks.append(s)
+            self.size += len(s)
+
+    def _coalesce(self):
+        chunks = self.chunks
+        if len(chunks) > 1 and len(chunks[0]) < self.chunkSize:
+            L = [chunks.popleft()[self.offset:]]
+            n = len(L[0])
+            while chunks and n + len(chunks[0]) <= self.chunkSize:
+                s = chunks.popleft()
+                L.append(s)
+                n += len(s)
+            chunks.appendleft(''.join(L))
+            self.offset = 0
+
+    def send(self, sock):
+        """Sends as much of the buffer on sock as it will take at once and
+        returns how much that was."""
+        self._coalesce()
+        head = self.chunks[0]
+        if self.offset:
+            sent = sock.send(buffer(head, self.offset))
+        else:
+            sent = sock.send(head)
+        self.size -= sent
+        self.offset += sent
+        if self.offset == len(head):
+            self.chunks.popleft()
+            self.offset = 0
+        return sent
+
+
 class SocketDriver(drivers.IrcDriver, drivers.ServersMixin):
     def __init__(self, irc):
         self.irc = irc
@@ -62,7 +117,7 @@ class SocketDriver(drivers.IrcDriver, drivers.ServersMixin):
         self.servers = ()
         self.eagains = 0
         self.inbuffer = ''
-        self.outbuffer = ''
+        self.outbuffer = OutputBuffer()
         self.zombie = False
         self.connected = False
         self.writeCheckTime = None
@@ -103,15 +158,13 @@ class SocketDriver(drivers.IrcDriver, drivers.ServersMixin):
 
     def _sendIfMsgs(self):
         if not self.zombie:
-            msgs = [self.irc.takeMsg()]
-            while msgs[-1] is not None:
-                msgs.append(self.irc.takeMsg())
-            del msgs[-1]
-            self.outbuffer += ''.join(imap(str, msgs))
+            msg = self.irc.takeMsg()
+            while msg is not None:
+                self.outbuffer.append(str(msg))
+                msg = self.irc.takeMsg()
         if self.outbuffer:
             try:
-                sent = self.conn.send(self.outbuffer)
-                self.outbuffer = self.outbuffer[sent:]
+                self.outbuffer.send(self.conn)
                 self.eagains = 0
             except socket.error, e:
                 self._handleSocketError(e)
@@ -130,10 +183,28 @@ class SocketDriver(drivers.IrcDriver, drivers.ServersMixin):
             time.sleep(conf.supybot.drivers.poll())
             return
         self._sendIfMsgs()
+        if self._read() and not self.irc.zombie:
+            self._sendIfMsgs()
+
+    def _read(self):
+        """Reads whatever is waiting on the socket and feeds the complete lines
+        to our Irc.  Returns False if the connection was lost."""
         try:
-            self.inbuffer += self.conn.recv(1024)
+            data = self.conn.recv(conf.supybot.drivers.recvSize())
+            if not data:
+                # The server closed the connection; the socket will stay
+                # readable (and empty) forever, so we have to let it go.
+                self._handleSocketError(socket.error('Connection closed.'))
+                return False
             self.eagains = 0 # If we successfully recv'ed, we can reset this.
-            lines = self.inbuffer.split('\n')
+            if '\n' not in data:
+                # Only part of a line; there's nothing to split yet.
+                self.inbuffer += data
+                return True
+            # Only the partial line left from the last read is joined to what
+            # we just read, rather than everything being rejoined and split.
+            lines = data.split('\n')
+            lines[0] = self.inbuffer + lines[0]
             self.inbuffer = lines.pop()
             for line in lines:
                 msg = drivers.parseMsg(line)
@@ -146,12 +217,11 @@ class SocketDriver(drivers.IrcDriver, drivers.ServersMixin):
                 pass
             else:
                 self._handleSocketError(e)
-                return
+                return self.connected
         except socket.error, e:
             self._handleSocketError(e)
-            return
-        if not self.irc.zombie:
-            self._sendIfMsgs()
+            return self.connected
+        return True
 
     def connect(self, **kwargs):
         self.reconnect(reset=False, **kwargs)
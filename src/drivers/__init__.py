@@ -63,6 +63,12 @@ class IrcDriver(object):
     def reconnect(self, wait=False):
         raise NotImplementedError
 
+    def wakeup(self):
+        """Called (possibly from another thread) when there's new output to
+        send.  Drivers which block waiting on their sockets should stop
+        waiting."""
+        pass
+
     def name(self):
         return repr(self)
 
@@ -100,6 +106,12 @@ def remove(name):
     """Removes the driver with the given name from the loop."""
     _deadDrivers.append(name)
 
+def wakeup():
+    """Wakes up any drivers waiting on their sockets."""
+    # .values() rather than .itervalues() since we may be in another thread.
+    for driver in _drivers.values():
+        driver.wakeup()
+
 def run():
     """Runs the whole driver loop."""
     for (name, driver) in _drivers.iteritems():
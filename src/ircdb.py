@@ -32,6 +32,7 @@ from __future__ import division
 
 import os
 import time
+import bisect
 import operator
 
 import supybot.log as log
@@ -559,6 +560,140 @@ class IrcChannelCreator(Creator):
 class DuplicateHostmask(ValueError):
     pass
 
+def _literalHead(s):
+    """Returns the part of the pattern s before its first wildcard."""
+    for (i, c) in enumerate(s):
+        if c in '*?':
+            return s[:i]
+    return s
+
+def _literalTail(s):
+    """Returns the part of the pattern s after its last wildcard."""
+    return s[max(s.rfind('*'), s.rfind('?'))+1:]
+
+class HostmaskIndex(object):
+    """An index of users' hostmasks, so that finding the users who might
+    match a hostmask doesn't mean matching against every hostmask we know of.
+
+    Hostmasks without wildcards are looked up directly.  Since a pattern can
+    only match hostmasks ending with the literal text after its last
+    wildcard, the others are bucketed by that text (or, if a pattern ends with
+    a wildcard, by the literal text before its first one).  Sorted lists of
+    the hostmasks (and of them reversed) answer the opposite question: which
+    hostmasks a given pattern might match.
+    """
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.masks = {}
+        self.exact = {}
+        self.tails = {}
+        self.heads = {}
+        self.others = set()
+        self.tailLengths = {}
+        self.headLengths = {}
+        self.forward = []
+        self.backward = []
+
+    def _bucket(self, lowered):
+        if '*' not in lowered and '?' not in lowered:
+            return (self.exact, lowered, None)
+        tail = _literalTail(lowered)
+        if tail:
+            return (self.tails, tail, self.tailLengths)
+        head = _literalHead(lowered)
+        if head:
+            return (self.heads, head, self.headLengths)
+        return (None, None, None)
+
+    def add(self, id, mask):
+        mask = str(mask)
+        masks = self.masks.setdefault(id, set())
+        if mask in masks:
+            return
+        masks.add(mask)
+        lowered = ircutils.toLower(mask)
+        entry = (id, mask)
+        (d, key, lengths) = self._bucket(lowered)
+        if d is None:
+            self.others.add(entry)
+        else:
+            d.setdefault(key, set()).add(entry)
+            if lengths is not None:
+                lengths[len(key)] = lengths.get(len(key), 0) + 1
+        bisect.insort(self.forward, (lowered, id, mask))
+        bisect.insort(self.backward, (lowered[::-1], id, mask))
+
+    def _removeFromList(self, L, item):
+        i = bisect.bisect_left(L, item)
+        if i < len(L) and L[i] == item:
+            del L[i]
+
+    def remove(self, id, mask):
+        mask = str(mask)
+        try:
+            self.masks[id].remove(mask)
+        except KeyError:
+            return
+        if not self.masks[id]:
+            del self.masks[id]
+        lowered = ircutils.toLower(mask)
+        entry = (id, mask)
+        (d, key, lengths) = self._bucket(lowered)
+        if d is None:
+            self.others.discard(entry)
+        else:
+            d[key].discard(entry)
+            if not d[key]:
+                del d[key]
+            if lengths is not None:
+                lengths[len(key)] -= 1
+                if not lengths[len(key)]:
+                    del lengths[len(key)]
+        self._removeFromList(self.forward, (lowered, id, mask))
+        self._removeFromList(self.backward, (lowered[::-1], id, mask))
+
+    def removeUser(self, id):
+        for mask in list(self.masks.get(id, ())):
+            self.remove(id, mask)
+
+    def setUser(self, id, masks):
+        """Replaces whatever we had indexed for the user id by masks."""
+        self.removeUser(id)
+        for mask in masks:
+            self.add(id, mask)
+
+    def matching(self, hostmask):
+        """Returns the set of ids of users with a hostmask which might match
+        hostmask."""
+        lowered = ircutils.toLower(hostmask)
+        n = len(lowered)
+        entries = set(self.exact.get(lowered, ()))
+        for length in self.tailLengths:
+            if length <= n:
+                entries.update(self.tails.get(lowered[n-length:], ()))
+        for length in self.headLengths:
+            entries.update(self.heads.get(lowered[:length], ()))
+        entries.update(self.others)
+        return set([id for (id, _) in entries])
+
+    def matchedBy(self, pattern):
+        """Returns a list of the (id, hostmask) pairs whose hostmask might be
+        matched by pattern."""
+        lowered = ircutils.toLower(pattern)
+        tail = _literalTail(lowered)
+        if tail:
+            (L, key) = (self.backward, tail[::-1])
+        else:
+            (L, key) = (self.forward, _literalHead(lowered))
+        ret = []
+        i = bisect.bisect_left(L, (key,))
+        while i < len(L) and L[i][0].startswith(key):
+            ret.append(L[i][1:])
+            i += 1
+        return ret
+
 class UsersDictionary(utils.IterableMap):
     """A simple serialized-to-file User Database."""
     def __init__(self):
@@ -566,8 +701,9 @@ class UsersDictionary(utils.IterableMap):
         self.filename = None
         self.users = {}
         self.nextId = 0
-        self._nameCache = utils.structures.CacheDict(1000)
-        self._hostmaskCache = utils.structures.CacheDict(1000)
+        self._nameCache = utils.structures.LRUCache(1000)
+        self._hostmaskCache = utils.structures.LRUCache(1000)
+        self._hostmaskIndex = HostmaskIndex()
 
     # This is separate because the Creator has to access our instance.
     def open(self, filename):
@@ -593,6 +729,7 @@ class UsersDictionary(utils.IterableMap):
         self.users.clear()
         self._nameCache.clear()
         self._hostmaskCache.clear()
+        self._hostmaskIndex.clear()
         if self.filename is not None:
             try:
                 self.open(self.filename)
@@ -634,17 +771,13 @@ class UsersDictionary(utils.IterableMap):
                 return self._hostmaskCache[s]
             except KeyError:
                 ids = {}
-                for (id, user) in self.users.iteritems():
-                    x = user.checkHostmask(s)
+                for id in self._hostmaskIndex.matching(s):
+                    x = self.users[id].checkHostmask(s)
                     if x:
                         ids[id] = x
                 if len(ids) == 1:
                     id = ids.keys()[0]
                     self._hostmaskCache[s] = id
-                    try:
-                        self._hostmaskCache[id].add(s)
-                    except KeyError:
-                        self._hostmaskCache[id] = set([s])
                     return id
                 elif len(ids) == 0:
                     raise KeyError, s
@@ -654,6 +787,7 @@ class UsersDictionary(utils.IterableMap):
                     for (id, hostmask) in ids.iteritems():
                         log.error('Removing %q from user %s.', hostmask, id)
                         self.users[id].removeHostmask(hostmask)
+                        self._indexUser(self.users[id])
                     raise DuplicateHostmask, 'Ids %r matched.' % ids
         else: # Not a hostmask, must be a name.
             s = s.lower()
@@ -663,7 +797,6 @@ class UsersDictionary(utils.IterableMap):
                 for (id, user) in self.users.items():
                     if s == user.name.lower():
                         self._nameCache[s] = id
-                        self._nameCache[id] = s
                         return id
                 else:
                     raise KeyError, s
@@ -692,23 +825,23 @@ class UsersDictionary(utils.IterableMap):
         return len(self.users)
 
     def invalidateCache(self, id=None, hostmask=None, name=None):
+        # The caches only map names and hostmasks to ids; they evict entries
+        # on their own, so we can't keep reverse mappings consistent with
+        # them.  Invalidating an id is rare, so we just look for it.
         if hostmask is not None:
-            if hostmask in self._hostmaskCache:
-                id = self._hostmaskCache.pop(hostmask)
-                self._hostmaskCache[id].remove(hostmask)
-                if not self._hostmaskCache[id]:
-                    del self._hostmaskCache[id]
+            self._hostmaskCache.pop(hostmask, None)
         if name is not None:
-            del self._nameCache[self._nameCache[id]]
-            del self._nameCache[id]
+            self._nameCache.pop(name.lower(), None)
         if id is not None:
-            if id in self._nameCache:
-                del self._nameCache[self._nameCache[id]]
-                del self._nameCache[id]
-            if id in self._hostmaskCache:
-                for hostmask in self._hostmaskCache[id]:
-                    del self._hostmaskCache[hostmask]
-                del self._hostmaskCache[id]
+            for cache in (self._nameCache, self._hostmaskCache):
+                for (s, cachedId) in cache.items():
+                    if cachedId == id:
+                        cache.pop(s, None)
+
+    def _indexUser(self, user):
+        masks = list(user.hostmasks)
+        masks.extend([hostmask for (_, hostmask) in user.auth])
+        self._hostmaskIndex.setUser(user.id, masks)
 
     def setUser(self, user, flush=True):
         """Sets a user (given its id) to the IrcUser given it."""
@@ -719,34 +852,33 @@ class UsersDictionary(utils.IterableMap):
         except KeyError:
             pass
         for hostmask in user.hostmasks:
-            for (i, u) in self.iteritems():
+            for i in self._hostmaskIndex.matching(hostmask):
                 if i == user.id:
                     continue
-                elif u.checkHostmask(hostmask):
+                elif self.users[i].checkHostmask(hostmask):
                     # We used to remove the hostmask here, but it's not
                     # appropriate for us both to remove the hostmask and to
                     # raise an exception.  So instead, we'll raise an
                     # exception, but be nice and give the offending hostmask
                     # back at the same time.
                     raise DuplicateHostmask, hostmask
-                for otherHostmask in u.hostmasks:
-                    if ircutils.hostmaskPatternEqual(hostmask, otherHostmask):
-                        raise DuplicateHostmask, hostmask
+            for (i, otherHostmask) in self._hostmaskIndex.matchedBy(hostmask):
+                if i == user.id:
+                    continue
+                elif otherHostmask in self.users[i].hostmasks and \
+                     ircutils.hostmaskPatternEqual(hostmask, otherHostmask):
+                    raise DuplicateHostmask, hostmask
         self.invalidateCache(user.id)
         self.users[user.id] = user
+        self._indexUser(user)
         if flush:
             self.flush()
 
     def delUser(self, id):
         """Removes a user from the database."""
         del self.users[id]
-        if id in self._nameCache:
-            del self._nameCache[self._nameCache[id]]
-            del self._nameCache[id]
-        if id in self._hostmaskCache:
-            for hostmask in self._hostmaskCache[id]:
-                del self._hostmaskCache[hostmask]
-            del self._hostmaskCache[id]
+        self._hostmaskIndex.removeUser(id)
+        self.invalidateCache(id)
         self.flush()
 
     def newUser(self):
@@ -28,8 +28,8 @@
 ###
 
 import re
-import copy
 import time
+import heapq
 import random
 
 import supybot.log as log
@@ -37,11 +37,12 @@ import supybot.conf as conf
 import supybot.utils as utils
 import supybot.world as world
 import supybot.ircdb as ircdb
+import supybot.drivers as drivers
 import supybot.ircmsgs as ircmsgs
 import supybot.ircutils as ircutils
 
 from utils.str import rsplit
-from utils.iter import imap, chain, cycle
+from utils.iter import imap, cycle
 from utils.structures import queue, smallqueue, RingBuffer
 
 ###
@@ -60,6 +61,11 @@ class IrcCommandDispatcher(object):
         return getattr(self, 'do' + command.capitalize(), None)
 
 
+def _overrides(obj, cls, name):
+    """Returns whether the class of obj overrides the method name of cls."""
+    return getattr(obj.__class__, name).im_func is not \
+           getattr(cls, name).im_func
+
 class IrcCallback(IrcCommandDispatcher):
     """Base class for standard callbacks.
 
@@ -131,6 +137,15 @@ class IrcCallback(IrcCommandDispatcher):
         if method is not None:
             method(irc, msg)
 
+    def handlesCommand(self, command):
+        """Returns whether __call__ does anything with messages of the given
+        command.  Irc only gives each message to the callbacks that handle
+        its command; callbacks overriding __call__ are given every message
+        unless they override this as well."""
+        if _overrides(self, IrcCallback, '__call__'):
+            return True
+        return self.dispatchCommand(command) is not None
+
     def reset(self):
         """Resets the callback.  Called when reconnecting to the server."""
         pass
@@ -140,26 +155,34 @@ class IrcCallback(IrcCommandDispatcher):
         pass
 
 ###
-# Basic queue for IRC messages.  It doesn't presently (but should at some
-# later point) reorder messages based on priority or penalty calculations.
+# Queue for IRC messages.  Messages are ordered by priority (based on their
+# command) and, within a priority, fairly between their targets, with each
+# message charged its server penalty.
 ###
 _high = frozenset(['MODE', 'KICK', 'PONG', 'NICK', 'PASS', 'CAPAB'])
 _low = frozenset(['PRIVMSG', 'PING', 'WHO', 'NOTICE', 'JOIN'])
-class IrcMsgQueue(object):
-    """Class for a queue of IrcMsgs.  Eventually, it should be smart.
+def _penalty(msg):
+    """Returns the penalty (in seconds) ircds typically charge a client for
+    sending msg."""
+    return 2 + len(str(msg)) / 120.0
 
-    Probably smarter than it is now, though it's gotten quite a bit smarter
-    than it originally was.  A method to "score" methods, and a heapq to
-    maintain a priority queue of the messages would be the ideal way to do
-    intelligent queuing.
-
-    As it stands, however, we simply keep track of 'high priority' messages,
-    'low priority' messages, and normal messages, and just make sure to return
-    the 'high priority' ones before the normal ones before the 'low priority'
-    ones.
+class IrcMsgQueue(object):
+    """Class for a queue of IrcMsgs.
+
+    Messages are kept in a heap keyed on their priority ('high priority'
+    messages, then normal messages, then 'low priority' messages), then on a
+    start tag that shares the queue fairly between targets: each message to a
+    target starts when the previous one to that target has been "paid for"
+    with its penalty, so a target with many queued messages only delays the
+    others by one of its messages at a time, rather than by all of them.
+    Messages to the same target are still dequeued in the order they were
+    enqueued.  penalty gives each message's penalty; Irc passes its own, so
+    the queue charges what its network's throttle settings do.
     """
-    __slots__ = ('msgs', 'highpriority', 'normal', 'lowpriority', 'lastJoin')
-    def __init__(self, iterable=()):
+    __slots__ = ('heap', 'counts', 'clock', 'clocks', 'seq', 'lastJoin',
+                 'penalty')
+    def __init__(self, iterable=(), penalty=_penalty):
+        self.penalty = penalty
         self.reset()
         for msg in iterable:
             self.enqueue(msg)
@@ -167,9 +190,40 @@ class IrcMsgQueue(object):
     def reset(self):
         """Clears the queue."""
         self.lastJoin = 0
-        self.highpriority = smallqueue()
-        self.normal = smallqueue()
-        self.lowpriority = smallqueue()
+        self.heap = []
+        self.counts = {}
+        self.clock = 0
+        self.clocks = {}
+        self.seq = 0
+
+    def _push(self, msg):
+        if msg.command in _high:
+            priority = 0
+        elif msg.command in _low:
+            priority = 2
+        else:
+            priority = 1
+        if msg.args:
+            target = msg.args[0]
+        else:
+            target = None
+        start = max(self.clock, self.clocks.get(target, 0))
+        self.clocks[target] = start + self.penalty(msg)
+        self.seq += 1
+        heapq.heappush(self.heap, (priority, start, self.seq, msg))
+        self.counts[msg] = self.counts.get(msg, 0) + 1
+
+    def _pop(self):
+        (_, start, _, msg) = heapq.heappop(self.heap)
+        self.clock = start
+        if self.counts[msg] == 1:
+            del self.counts[msg]
+        else:
+            self.counts[msg] -= 1
+        if not self.heap:
+            self.clock = 0
+            self.clocks.clear()
+        return msg
 
     def enqueue(self, msg):
         """Enqueues a given message."""
@@ -179,49 +233,48 @@ class IrcMsgQueue(object):
             log.info('Not adding message %q to queue, already added.', s)
             return False
         else:
-            if msg.command in _high:
-                self.highpriority.enqueue(msg)
-            elif msg.command in _low:
-                self.lowpriority.enqueue(msg)
-            else:
-                self.normal.enqueue(msg)
+            self._push(msg)
             return True
 
     def dequeue(self):
         """Dequeues a given message."""
         msg = None
-        if self.highpriority:
-            msg = self.highpriority.dequeue()
-        elif self.normal:
-            msg = self.normal.dequeue()
-        elif self.lowpriority:
-            msg = self.lowpriority.dequeue()
+        if self.heap:
+            msg = self._pop()
             if msg.command == 'JOIN':
                 limit = conf.supybot.protocols.irc.queuing.rateLimit.join()
                 now = time.time()
                 if self.lastJoin + limit <= now:
                     self.lastJoin = now
                 else:
-                    self.lowpriority.enqueue(msg)
+                    self._push(msg)
                     msg = None
         return msg
 
+    def peek(self):
+        """Returns the message dequeue would try to return next."""
+        return self.heap[0][-1]
+
+    def readyTime(self):
+        """Returns the time from which dequeue will return a message rather
+        than holding back a JOIN, which may be in the past."""
+        if self.heap and self.peek().command == 'JOIN':
+            limit = conf.supybot.protocols.irc.queuing.rateLimit.join()
+            return self.lastJoin + limit
+        return 0
+
     def __contains__(self, msg):
-        return msg in self.normal or \
-               msg in self.lowpriority or \
-               msg in self.highpriority
+        return msg in self.counts
 
     def __nonzero__(self):
-        return bool(self.highpriority or self.normal or self.lowpriority)
+        return bool(self.heap)
 
     def __len__(self):
-        return len(self.highpriority)+len(self.lowpriority)+len(self.normal)
+        return len(self.heap)
 
     def __repr__(self):
         name = self.__class__.__name__
-        return '%s(%r)' % (name, list(chain(self.highpriority,
-                                            self.normal,
-                                            self.lowpriority)))
+        return '%s(%r)' % (name, [t[-1] for t in sorted(self.heap)])
     __str__ = __repr__
 
 
@@ -229,31 +282,142 @@ class IrcMsgQueue(object):
 # Maintains the state of IRC connection -- the most recent messages, the
 # status of various modes (especially ops/halfops/voices) in channels, etc.
 ###
+def _intern(s):
+    try:
+        return intern(str(s))
+    except (TypeError, UnicodeError):
+        return s
+
+class MemberSet(object):
+    """A set-like view of the nicks in a ChannelState with a given mode (or,
+    for users, of all the nicks in it).  Comparisons are IRC-case
+    insensitive, as with ircutils.IrcSet."""
+    __slots__ = ('channel', 'bit')
+    def __init__(self, channel, bit):
+        self.channel = channel
+        self.bit = bit
+
+    def __contains__(self, nick):
+        return self.channel._has(nick, self.bit)
+    has_key = __contains__
+
+    def __iter__(self):
+        nicks = self.channel._nicks
+        for (key, bits) in self.channel._members.items():
+            if bits & self.bit:
+                yield ircutils.IrcString(nicks.get(key, key))
+
+    def __len__(self):
+        if self.bit == ChannelState.USER:
+            return self.channel._count
+        return len([bits for bits in self.channel._members.itervalues()
+                    if bits & self.bit])
+
+    def __nonzero__(self):
+        return bool(len(self))
+
+    def __eq__(self, other):
+        return ircutils.IrcSet(self) == ircutils.IrcSet(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, list(self))
+
+    def add(self, nick):
+        self.channel._set(nick, self.bit)
+
+    def discard(self, nick):
+        self.channel._unset(nick, self.bit)
+
+    def remove(self, nick):
+        if nick not in self:
+            raise KeyError, nick
+        self.discard(nick)
+
+
 class ChannelState(utils.python.Object):
-    __slots__ = ('users', 'ops', 'halfops', 'bans',
-                 'voices', 'topic', 'modes', 'created')
+    """The state of a channel.  Rather than keeping a set of nicks for each of
+    users, ops, halfops and voices, each nick in the channel is mapped once
+    (by its interned, IRC-lowered form) to a bitmask of those; the users, ops,
+    halfops and voices attributes are set-like views of that mapping.  copy()
+    shares the mapping between the copies until either one changes it."""
+    __slots__ = ('_members', '_nicks', '_count', '_shared',
+                 'bans', 'topic', 'modes', 'created')
+    USER = 1
+    OP = 2
+    HALFOP = 4
+    VOICE = 8
     def __init__(self):
         self.topic = ''
         self.created = 0
-        self.ops = ircutils.IrcSet()
         self.bans = ircutils.IrcSet()
-        self.users = ircutils.IrcSet()
-        self.voices = ircutils.IrcSet()
-        self.halfops = ircutils.IrcSet()
         self.modes = ircutils.IrcDict()
+        # Lowered nick -> bitmask of USER/OP/HALFOP/VOICE.
+        self._members = {}
+        # Lowered nick -> nick, for those nicks that aren't lowercase.
+        self._nicks = {}
+        self._count = 0
+        self._shared = False
+
+    users = property(lambda self: MemberSet(self, self.USER))
+    ops = property(lambda self: MemberSet(self, self.OP))
+    halfops = property(lambda self: MemberSet(self, self.HALFOP))
+    voices = property(lambda self: MemberSet(self, self.VOICE))
+
+    def _own(self):
+        if self._shared:
+            self._members = self._members.copy()
+            self._nicks = self._nicks.copy()
+            self._shared = False
+
+    def _has(self, nick, bit):
+        return bool(self._members.get(ircutils.toLower(nick), 0) & bit)
+
+    def _set(self, nick, bits):
+        self._own()
+        key = ircutils.toLower(nick)
+        old = self._members.get(key, 0)
+        if not old:
+            key = _intern(key)
+        if bits & self.USER:
+            if not old & self.USER:
+                self._count += 1
+            if nick != key:
+                self._nicks[key] = _intern(nick)
+            else:
+                self._nicks.pop(key, None)
+        self._members[key] = old | bits
+
+    def _unset(self, nick, bits):
+        key = ircutils.toLower(nick)
+        old = self._members.get(key, 0)
+        if not old & bits:
+            return
+        self._own()
+        new = old & ~bits
+        if old & self.USER and not new & self.USER:
+            self._count -= 1
+        if new:
+            self._members[key] = new
+        else:
+            del self._members[key]
+            self._nicks.pop(key, None)
 
     def isOp(self, nick):
-        return nick in self.ops
+        return self._has(nick, self.OP)
     def isVoice(self, nick):
-        return nick in self.voices
+        return self._has(nick, self.VOICE)
     def isHalfop(self, nick):
-        return nick in self.halfops
+        return self._has(nick, self.HALFOP)
 
     def addUser(self, user):
         "Adds a given user to the ChannelState.  Power prefixes are handled."
         nick = user.lstrip('@%+&~!')
         if not nick:
             return
+        bits = self.USER
         # & is used to denote protected users in UnrealIRCd
         # ~ is used to denote channel owner in UnrealIRCd
         # ! is used to denote protected users in UltimateIRCd
@@ -261,29 +425,40 @@ class ChannelState(utils.python.Object):
             (marker, user) = (user[0], user[1:])
             assert user, 'Looks like my caller is passing chars, not nicks.'
             if marker in '@&~!':
-                self.ops.add(nick)
+                bits |= self.OP
             elif marker == '%':
-                self.halfops.add(nick)
+                bits |= self.HALFOP
             elif marker == '+':
-                self.voices.add(nick)
-        self.users.add(nick)
+                bits |= self.VOICE
+        self._set(nick, bits)
 
     def replaceUser(self, oldNick, newNick):
         """Changes the user oldNick to newNick; used for NICK changes."""
         # Note that this doesn't have to have the sigil (@%+) that users
         # have to have for addUser; it just changes the name of the user
         # without changing any of his categories.
-        for s in (self.users, self.ops, self.halfops, self.voices):
-            if oldNick in s:
-                s.remove(oldNick)
-                s.add(newNick)
+        bits = self._members.get(ircutils.toLower(oldNick), 0)
+        if bits:
+            self._unset(oldNick, bits)
+            self._set(newNick, bits)
 
     def removeUser(self, user):
         """Removes a given user from the channel."""
-        self.users.discard(user)
-        self.ops.discard(user)
-        self.halfops.discard(user)
-        self.voices.discard(user)
+        self._unset(user, self.USER | self.OP | self.HALFOP | self.VOICE)
+
+    def copy(self):
+        """Returns a copy of this ChannelState; the (potentially large)
+        membership is shared between the two until either changes it."""
+        ret = self.__class__()
+        ret.topic = self.topic
+        ret.created = self.created
+        ret.bans = ircutils.IrcSet(self.bans)
+        ret.modes = self.modes.copy()
+        ret._members = self._members
+        ret._nicks = self._nicks
+        ret._count = self._count
+        self._shared = ret._shared = True
+        return ret
 
     def setMode(self, mode, value=None):
         assert mode not in 'ovhbeq'
@@ -322,16 +497,19 @@ class ChannelState(utils.python.Object):
                     assert action == '-'
                     self.unsetMode(modeChar)
 
+    _state = ('_members', '_nicks', '_count', 'bans', 'topic', 'modes',
+              'created')
     def __getstate__(self):
-        return [getattr(self, name) for name in self.__slots__]
+        return [getattr(self, name) for name in self._state]
 
     def __setstate__(self, t):
-        for (name, value) in zip(self.__slots__, t):
+        for (name, value) in zip(self._state, t):
             setattr(self, name, value)
+        self._shared = False
 
     def __eq__(self, other):
         ret = True
-        for name in self.__slots__:
+        for name in ('_members', 'bans', 'topic', 'modes', 'created'):
             ret = ret and getattr(self, name) == getattr(other, name)
         return ret
 
@@ -379,9 +557,13 @@ class IrcState(IrcCommandDispatcher):
 
     def copy(self):
         ret = self.__class__()
-        ret.history = copy.deepcopy(self.history)
-        ret.nicksToHostmasks = copy.deepcopy(self.nicksToHostmasks)
-        ret.channels = copy.deepcopy(self.channels)
+        # IrcMsgs aren't changed once they're received, so they can be shared.
+        ret.history = RingBuffer(self.history.maxSize, self.history)
+        ret.nicksToHostmasks = self.nicksToHostmasks.copy()
+        for (channel, chan) in self.channels.iteritems():
+            if chan is not None:
+                chan = chan.copy()
+            ret.channels[channel] = chan
         return ret
 
     def addMsg(self, irc, msg):
@@ -401,6 +583,11 @@ class IrcState(IrcCommandDispatcher):
         """Returns the hostmask for a given nick."""
         return self.nicksToHostmasks[nick]
 
+    def channelsOf(self, nick):
+        """Returns a list of the channels we know nick to be in."""
+        return [channel for (channel, chan) in self.channels.iteritems()
+                if nick in chan.users]
+
     def do004(self, irc, msg):
         """Handles parsing the 004 reply
 
@@ -608,6 +795,7 @@ class Irc(IrcCommandDispatcher):
     _nickSetters = set(['001', '002', '003', '004', '250', '251', '252',
                         '254', '255', '265', '266', '372', '375', '376',
                         '333', '353', '332', '366', '005'])
+    _channelsTaggers = set(['QUIT', 'NICK'])
     # We specifically want these callbacks to be common between all Ircs,
     # that's why we don't do the normal None default with a check.
     def __init__(self, network, callbacks=_callbacks):
@@ -615,8 +803,10 @@ class Irc(IrcCommandDispatcher):
         world.ircs.append(self)
         self.network = network
         self.callbacks = callbacks
+        self.commandTable = None # callbacks builds this when it needs it.
+        self.invalidateDispatch()
         self.state = IrcState()
-        self.queue = IrcMsgQueue()
+        self.queue = IrcMsgQueue(penalty=self._penalty)
         self.fastqueue = smallqueue()
         self.driver = None # The driver should set this later.
         self._setNonResettingVariables()
@@ -677,6 +867,51 @@ class Irc(IrcCommandDispatcher):
         assert len(cbs) == len(self.callbacks), \
                'cbs: %s, self.callbacks: %s' % (cbs, self.callbacks)
         self.callbacks[:] = cbs
+        self.invalidateCommands(callback)
+        self.invalidateDispatch()
+
+    def invalidateCommands(self, callback=None):
+        """Tells the command table of every Irc sharing our callbacks that the
+        commands of the given callback (or of all callbacks) may have
+        changed."""
+        for irc in [self] + world.ircs:
+            table = getattr(irc, 'commandTable', None)
+            if table is not None and irc.callbacks is self.callbacks:
+                table.invalidate(callback)
+
+    def invalidateDispatch(self):
+        """Makes every Irc sharing our callbacks forget which of them filter
+        messages and which handle which commands."""
+        for irc in [self] + world.ircs:
+            if irc is self or irc.callbacks is self.callbacks:
+                irc._inFilters = None
+                irc._outFilters = None
+                irc._handlers = {}
+
+    def _getInFilters(self):
+        if self._inFilters is None:
+            self._inFilters = [cb for cb in self.callbacks
+                               if not isinstance(cb, IrcCallback) or
+                                  _overrides(cb, IrcCallback, 'inFilter')]
+        return self._inFilters
+
+    def _getOutFilters(self):
+        if self._outFilters is None:
+            self._outFilters = [cb for cb in reversed(self.callbacks)
+                                if not isinstance(cb, IrcCallback) or
+                                   _overrides(cb, IrcCallback, 'outFilter')]
+        return self._outFilters
+
+    def _getHandlers(self, command):
+        try:
+            return self._handlers[command]
+        except KeyError:
+            L = [cb for cb in self.callbacks
+                 if cb is not None and
+                    (not isinstance(cb, IrcCallback) or
+                     cb.handlesCommand(command))]
+            self._handlers[command] = L
+            return L
 
     def getCallback(self, name):
         """Gets a given callback by name."""
@@ -694,12 +929,18 @@ class Irc(IrcCommandDispatcher):
             return cb.name().lower() == name
         (bad, good) = utils.iter.partition(nameMatches, self.callbacks)
         self.callbacks[:] = good
+        for cb in bad:
+            self.invalidateCommands(cb)
+        self.invalidateDispatch()
         return bad
 
     def queueMsg(self, msg):
         """Queues a message to be sent to the server."""
         if not self.zombie:
-            return self.queue.enqueue(msg)
+            ret = self.queue.enqueue(msg)
+            if not world.isMainThread():
+                drivers.wakeup()
+            return ret
         else:
             log.warning('Refusing to queue %r; %s is a zombie.', msg, self)
             return False
@@ -708,9 +949,39 @@ class Irc(IrcCommandDispatcher):
         """Queues a message to be sent to the server *immediately*"""
         if not self.zombie:
             self.fastqueue.enqueue(msg)
+            if not world.isMainThread():
+                drivers.wakeup()
         else:
             log.warning('Refusing to send %r; %s is a zombie.', msg, self)
 
+    def _penalty(self, msg):
+        throttle = conf.supybot.networks.get(self.network).throttle
+        return throttle.messageCost() + \
+               len(str(msg)) / float(throttle.bytesPerSecond())
+
+    def _addPenalty(self, msg, now):
+        if conf.supybot.networks.get(self.network).throttle() > 0:
+            self.penaltyTime = max(self.penaltyTime, now) + self._penalty(msg)
+
+    def _queueTakeTime(self):
+        burst = conf.supybot.networks.get(self.network).throttle()
+        if burst > 0:
+            t = self.penaltyTime + self._penalty(self.queue.peek()) - burst
+        else:
+            t = self.lastTake + conf.supybot.protocols.irc.throttleTime()
+        return max(t, self.queue.readyTime())
+
+    def nextTakeTime(self):
+        """Returns the time at which takeMsg will be able to return a queued
+        message (which may be in the past), or None if there are no queued
+        messages.  Drivers can use this to sleep until then."""
+        if self.fastqueue:
+            return 0
+        elif self.queue:
+            return self._queueTakeTime()
+        else:
+            return None
+
     def takeMsg(self):
         """Called by the IrcDriver; takes a message to be sent."""
         if not self.callbacks:
@@ -720,7 +991,7 @@ class Irc(IrcCommandDispatcher):
         if self.fastqueue:
             msg = self.fastqueue.dequeue()
         elif self.queue:
-            if now-self.lastTake <= conf.supybot.protocols.irc.throttleTime():
+            if now < self._queueTakeTime():
                 log.debug('Irc.takeMsg throttling.')
             else:
                 self.lastTake = now
@@ -740,7 +1011,7 @@ class Irc(IrcCommandDispatcher):
                 self.outstandingPing = True
                 self.queueMsg(ircmsgs.ping(now))
         if msg:
-            for callback in reversed(self.callbacks):
+            for callback in self._getOutFilters():
                 msg = callback.outFilter(self, msg)
                 if msg is None:
                     log.debug('%s.outFilter returned None.', callback.name())
@@ -757,6 +1028,8 @@ class Irc(IrcCommandDispatcher):
                 log.debug('Truncating %r, message is too long.', msg)
                 msg._str = msg._str[:500] + '\r\n'
                 msg._len = len(str(msg))
+            # Only now do we know what we're really sending.
+            self._addPenalty(msg, now)
             # I don't think we should do this.  Why should it matter?  If it's
             # something important, then the server will send it back to us,
             # and if it's just a privmsg/notice/etc., we don't care.
@@ -783,8 +1056,10 @@ class Irc(IrcCommandDispatcher):
             channel = msg.args[0]
         else:
             channel = None
-        preInFilter = str(msg).rstrip('\r\n')
-        log.debug('Incoming message (%s): %s', self.network, preInFilter)
+        debugging = log.isDebugging()
+        if debugging:
+            preInFilter = str(msg).rstrip('\r\n')
+            log.debug('Incoming message (%s): %s', self.network, preInFilter)
 
         # Yeah, so this is odd.  Some networks (oftc) seem to give us certain
         # messages with our nick instead of our prefix.  We'll fix that here.
@@ -813,6 +1088,12 @@ class Irc(IrcCommandDispatcher):
         elif self._numericErrorCommandRe.search(msg.command):
             log.error('Unhandled error message from server: %r' % msg)
 
+        # Once the IrcState object is updated, we won't know which channels
+        # someone quitting or changing nicks was in, so we tag the message
+        # with them for the callbacks.
+        if msg.command in self._channelsTaggers:
+            msg.tag('channels', self.state.channelsOf(msg.nick))
+
         # Now update the IrcState object.
         try:
             self.state.addMsg(self, msg)
@@ -821,7 +1102,7 @@ class Irc(IrcCommandDispatcher):
 
         # Now call the callbacks.
         world.debugFlush()
-        for callback in self.callbacks:
+        for callback in self._getInFilters():
             try:
                 m = callback.inFilter(self, msg)
                 if not m:
@@ -831,13 +1112,14 @@ class Irc(IrcCommandDispatcher):
             except:
                 log.exception('Uncaught exception in inFilter:')
             world.debugFlush()
-        postInFilter = str(msg).rstrip('\r\n')
-        if postInFilter != preInFilter:
-            log.debug('Incoming message (post-inFilter): %s', postInFilter)
-        for callback in self.callbacks:
+        if debugging:
+            postInFilter = str(msg).rstrip('\r\n')
+            if postInFilter != preInFilter:
+                log.debug('Incoming message (post-inFilter): %s',
+                          postInFilter)
+        for callback in self._getHandlers(msg.command):
             try:
-                if callback is not None:
-                    callback(self, msg)
+                callback(self, msg)
             except:
                 log.exception('Uncaught exception in callback:')
             world.debugFlush()
@@ -875,6 +1157,7 @@ class Irc(IrcCommandDispatcher):
         self.prefix = '%s!%s@%s' % (self.nick, self.ident, 'unset.domain')
         # The rest.
         self.lastTake = 0
+        self.penaltyTime = 0
         self.server = 'unset'
         self.afterConnect = False
         self.lastping = time.time()
@@ -1024,6 +1307,8 @@ class Irc(IrcCommandDispatcher):
                 # hurt anybody.
                 log.debug('Last Irc, clearing callbacks.')
                 self.callbacks[:] = []
+                self.invalidateCommands()
+                self.invalidateDispatch()
         else:
             log.warning('Irc object killed twice: %s', utils.stackTrace())
 
@@ -80,8 +80,10 @@ class IrcMsg(object):
     # It's too useful to be able to tag IrcMsg objects with extra, unforeseen
     # data.  Goodbye, __slots__.
     # On second thought, let's use methods for tagging.
-    __slots__ = ('args', 'command', 'host', 'nick', 'prefix', 'user',
-                 '_hash', '_str', '_repr', '_len', 'tags')
+    # The hostmask isn't split and the tags dict isn't created until they're
+    # first needed; most messages never need one or the other.
+    __slots__ = ('args', 'command', 'prefix', '_hostmask',
+                 '_hash', '_str', '_repr', '_len', '_tags')
     def __init__(self, s='', command='', args=(), prefix='', msg=None):
         assert not (msg and s), 'IrcMsg.__init__ cannot accept both s and msg'
         if not s and not command and not msg:
@@ -90,7 +92,8 @@ class IrcMsg(object):
         self._repr = None
         self._hash = None
         self._len = None
-        self.tags = {}
+        self._tags = None
+        self._hostmask = None
         if s:
             originalString = s
             try:
@@ -103,11 +106,12 @@ class IrcMsg(object):
                     self.prefix = ''
                 if ' :' in s: # Note the space: IPV6 addresses are bad w/o it.
                     s, last = s.split(' :', 1)
-                    self.args = s.split()
-                    self.args.append(last.rstrip('\r\n'))
+                    args = s.split()
+                    args.append(last.rstrip('\r\n'))
                 else:
-                    self.args = s.split()
-                self.command = self.args.pop(0)
+                    args = s.split()
+                self.command = args.pop(0)
+                self.args = tuple(args)
             except (IndexError, ValueError):
                 raise MalformedIrcMsg, repr(originalString)
         else:
@@ -116,25 +120,40 @@ class IrcMsg(object):
                     self.prefix = prefix
                 else:
                     self.prefix = msg.prefix
+                    self._hostmask = msg._hostmask
                 if command:
                     self.command = command
                 else:
                     self.command = msg.command
                 if args:
-                    self.args = args
+                    self.args = tuple(args)
                 else:
                     self.args = msg.args
-                self.tags = msg.tags.copy()
+                if msg._tags:
+                    self._tags = msg._tags.copy()
             else:
                 self.prefix = prefix
                 self.command = command
                 assert all(ircutils.isValidArgument, args)
-                self.args = args
-        self.args = tuple(self.args)
-        if isUserHostmask(self.prefix):
-            (self.nick,self.user,self.host)=ircutils.splitHostmask(self.prefix)
-        else:
-            (self.nick, self.user, self.host) = (self.prefix,)*3
+                self.args = tuple(args)
+
+    def _splitHostmask(self):
+        if self._hostmask is None:
+            if isUserHostmask(self.prefix):
+                self._hostmask = ircutils.splitHostmask(self.prefix)
+            else:
+                self._hostmask = (self.prefix,)*3
+        return self._hostmask
+
+    nick = property(lambda self: self._splitHostmask()[0])
+    user = property(lambda self: self._splitHostmask()[1])
+    host = property(lambda self: self._splitHostmask()[2])
+
+    def _getTags(self):
+        if self._tags is None:
+            self._tags = {}
+        return self._tags
+    tags = property(_getTags)
 
     def __str__(self):
         if self._str is not None:
@@ -196,10 +215,14 @@ class IrcMsg(object):
         return (self.__class__, (str(self),))
 
     def tag(self, tag, value=True):
-        self.tags[tag] = value
+        if self._tags is None:
+            self._tags = {}
+        self._tags[tag] = value
 
     def tagged(self, tag):
-        return self.tags.get(tag) # Returns None if it's not there.
+        if self._tags is None:
+            return None
+        return self._tags.get(tag) # Returns None if it's not there.
 
     def __getattr__(self, attr):
         return self.tagged(attr)
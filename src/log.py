@@ -309,6 +309,22 @@ registry.exception = exception
 
 setLevel = _logger.setLevel
 
+def isDebugging(logger=None):
+    """Returns whether debug messages given to logger (the main supybot
+    logger, by default) are logged anywhere, so callers can avoid building
+    debug messages that would only be thrown away.  Plugin loggers have
+    handlers of their own, as well as their parents'."""
+    if logger is None:
+        logger = _logger
+    while logger is not None:
+        for handler in logger.handlers:
+            if handler.level <= logging.DEBUG:
+                return True
+        if not logger.propagate:
+            break
+        logger = logger.parent
+    return False
+
 atexit.register(logging.shutdown)
 
 # ircutils will work without this, but it's useful.
@@ -61,6 +61,9 @@ class NonExistentRegistryEntry(RegistryException):
 
 _cache = utils.InsensitivePreservingDict()
 _lastModified = 0
+# This changes whenever a node is registered or unregistered anywhere, so
+# those keeping references to nodes know when to look them up again.
+generation = 0
 def open(filename, clear=False):
     """Initializes the module by loading the registry file into memory."""
     global _lastModified
@@ -246,6 +249,8 @@ class Group(object):
         # For the longest time, we had an "Is this right?" comment here, but
         # from experience, we now know that it most definitely *is* right.
         if name not in self._children:
+            global generation
+            generation += 1
             self._children[name] = node
             self._added.append(name)
             names = split(self._name)
@@ -263,6 +268,8 @@ class Group(object):
         try:
             node = self._children[name]
             del self._children[name]
+            global generation
+            generation += 1
             # We do this because we need to remove case-insensitively.
             name = name.lower()
             for elt in reversed(self._added):
@@ -117,8 +117,20 @@ class Schedule(drivers.IrcDriver):
 
     removePeriodicEvent = removeEvent
 
+    def nextEventTime(self):
+        """Returns the time at which the next event is due, or None if there
+        are no events scheduled."""
+        if self.schedule:
+            return self.schedule[0][0]
+        else:
+            return None
+
     def run(self):
-        if len(drivers._drivers) == 1 and not world.testing:
+        # Some drivers (the Select driver's Reactor, for instance) don't have
+        # an irc of their own; they're of no use without those that do.
+        ircDrivers = [driver for driver in drivers._drivers.values()
+                      if getattr(driver, 'irc', None) is not None]
+        if not ircDrivers and not world.testing:
             log.error('Schedule is the only remaining driver, '
                       'why do we continue to live?')
             time.sleep(1) # We're the only driver; let's pause to think.
@@ -141,6 +153,7 @@ removeEvent = schedule.removeEvent
 rescheduleEvent = schedule.rescheduleEvent
 addPeriodicEvent = schedule.addPeriodicEvent
 removePeriodicEvent = removeEvent
+nextEventTime = schedule.nextEventTime
 run = schedule.run
 
 
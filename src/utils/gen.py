@@ -276,6 +276,12 @@ class InsensitivePreservingDict(UserDict.DictMixin, object):
     def __reduce__(self):
         return (self.__class__, (dict(self.data.values()),))
 
+    def copy(self):
+        ret = self.__class__.__new__(self.__class__)
+        ret.__dict__.update(self.__dict__)
+        ret.data = self.data.copy()
+        return ret
+
 
 class NormalizingSet(set):
     def __init__(self, iterable=()):
@@ -34,6 +34,7 @@ Data structures for Python.
 import time
 import types
 import UserDict
+import threading
 from itertools import imap
 
 class RingBuffer(object):
@@ -444,4 +445,100 @@ class CacheDict(UserDict.DictMixin):
         return iter(self.d)
 
 
+class LRUCache(UserDict.DictMixin):
+    """A dictionary holding at most max items, which evicts the least recently
+    used item to make room for a new one (rather than clearing itself, as
+    CacheDict does).  It counts its hits, misses, and evictions."""
+    def __init__(self, max):
+        self.max = max
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.clear()
+
+    def clear(self):
+        # Values are [prev, next, key, value] links of a circular list, from
+        # least to most recently used, with self.root as its sentinel.
+        self.d = {}
+        self.root = []
+        self.root[:] = [self.root, self.root, None, None]
+
+    def _unlink(self, link):
+        (prev, next) = link[:2]
+        prev[1] = next
+        next[0] = prev
+
+    def _append(self, link):
+        last = self.root[0]
+        link[0] = last
+        link[1] = self.root
+        last[1] = link
+        self.root[0] = link
+
+    def __getitem__(self, key):
+        self.lock.acquire()
+        try:
+            try:
+                link = self.d[key]
+            except KeyError:
+                self.misses += 1
+                raise
+            self.hits += 1
+            self._unlink(link)
+            self._append(link)
+            return link[3]
+        finally:
+            self.lock.release()
+
+    def __setitem__(self, key, value):
+        self.lock.acquire()
+        try:
+            if key in self.d:
+                link = self.d[key]
+                link[3] = value
+                self._unlink(link)
+            else:
+                while self.d and len(self.d) >= self.max:
+                    oldest = self.root[1]
+                    self._unlink(oldest)
+                    del self.d[oldest[2]]
+                    self.evictions += 1
+                link = [None, None, key, value]
+                self.d[key] = link
+            self._append(link)
+        finally:
+            self.lock.release()
+
+    def __delitem__(self, key):
+        self.lock.acquire()
+        try:
+            self._unlink(self.d.pop(key))
+        finally:
+            self.lock.release()
+
+    def __contains__(self, key):
+        return key in self.d
+
+    has_key = __contains__
+
+    def __len__(self):
+        return len(self.d)
+
+    def keys(self):
+        return self.d.keys()
+
+    def __iter__(self):
+        return iter(self.d.keys())
+
+    def iteritems(self):
+        for (key, link) in self.d.items():
+            yield (key, link[3])
+
+    def stats(self):
+        """Returns a string describing how well the cache is doing."""
+        return '%s/%s items, %s hits, %s misses, %s evictions' % \
+               (len(self.d), self.max, self.hits, self.misses, self.evictions)
+
+
 # vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
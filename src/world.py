@@ -154,9 +154,15 @@ def upkeep():
         #    registry.open(registryFilename)
     if not dying:
         log.debug('Regexp cache size: %s', len(sre._cache))
-        log.debug('Pattern cache size: %s', len(ircutils._patternCache))
-        log.debug('HostmaskPatternEqual cache size: %s',
-                  len(ircutils._hostmaskPatternEqualCache))
+        log.debug('Pattern cache: %s', ircutils._patternCache.stats())
+        log.debug('HostmaskPatternEqual cache: %s',
+                  ircutils._hostmaskPatternEqualCache.stats())
+        if 'supybot.ircdb' in sys.modules:
+            # We can't import ircdb at the top; it imports us.
+            import supybot.ircdb as ircdb
+            log.debug('User name cache: %s', ircdb.users._nameCache.stats())
+            log.debug('User hostmask cache: %s',
+                      ircdb.users._hostmaskCache.stats())
         #timestamp = log.timestamp()
         if doFlush:
             log.info('Flushers flushed and garbage collected.')
@@ -29,9 +29,13 @@
 
 from supybot.test import *
 
+import time
+import threading
+
 import supybot.conf as conf
 import supybot.utils as utils
 import supybot.ircmsgs as ircmsgs
+import supybot.registry as registry
 import supybot.callbacks as callbacks
 
 tokenize = callbacks.tokenize
@@ -93,6 +97,12 @@ class TokenizerTestCase(SupyTestCase):
         self.assertRaises(SyntaxError, tokenize, '[foo') #]
         self.assertRaises(SyntaxError, tokenize, '"foo') #"
 
+    def testCachedTokensAreCopies(self):
+        tokens = tokenize('foo [bar baz]')
+        tokens[1].append('quux')
+        tokens.append('qux')
+        self.assertEqual(tokenize('foo [bar baz]'), ['foo', ['bar', 'baz']])
+
     def testPipe(self):
         try:
             conf.supybot.commands.nested.pipeSyntax.setValue(True)
@@ -328,6 +338,16 @@ class PrivmsgTestCase(ChannelPluginTestCase):
         finally:
             conf.supybot.commands.nested.maximum.setValue(original)
 
+    def testNestedCommandsDontChangeTheirTokens(self):
+        tokens = callbacks.tokenize('echo [echo foo] [echo [echo bar]]')
+        for args in (tokens, callbacks.freezeTokens(tokens), tokens):
+            msg = ircmsgs.privmsg(self.channel, 'x', prefix=self.prefix)
+            callbacks.NestedCommandsIrcProxy(self.irc, msg, args)
+            m = self.irc.takeMsg()
+            self.failUnless(m.args[1].endswith('foo bar'), m)
+        self.assertEqual(tokens,
+                         ['echo', ['echo', 'foo'], ['echo', ['echo', 'bar']]])
+
     def testSimpleReply(self):
         self.assertResponse("eval irc.reply('foo')", 'foo')
 
@@ -600,6 +620,52 @@ class SourceNestedPluginTestCase(PluginTestCase):
         self.assertEqual(cb.getCommand(['e', 'same']), ['e', 'same'])
         self.assertResponse('e same', 'same')
 
+    def testCommandTable(self):
+        cb = self.E(self.irc)
+        self.irc.addCallback(cb)
+        table = callbacks.getCommandTable(self.irc)
+        for args in [['f'], ['same'], ['e', 'f', 'x'], ['e', 'g'],
+                     ['e', 'g', 'h'], ['e', 'g', 'i', 'j'], ['e', 'same'],
+                     ['nosuchcommand']]:
+            (command, cbs) = table.find(args)
+            self.assertEqual(command, cb.getCommand(args))
+            if command:
+                self.assertEqual(cbs, [cb])
+        cb._disabled.add('f', cb.name())
+        try:
+            self.assertEqual(table.find(['f']), ([], []))
+        finally:
+            cb._disabled.remove('f', cb.name())
+        self.assertEqual(table.find(['f']), (['f'], [cb]))
+        self.irc.removeCallback(cb.name())
+        self.assertEqual(table.find(['e', 'f']), ([], []))
+
+
+class RegistryValueTestCase(PluginTestCase):
+    plugins = ('Utilities',)
+    class RegistryValueTest(callbacks.Plugin):
+        pass
+
+    def testRegistryValueFollowsRegistryChanges(self):
+        group = conf.registerPlugin('RegistryValueTest')
+        conf.registerChannelValue(group, 'foo', registry.Integer(1, ''))
+        try:
+            cb = self.RegistryValueTest(self.irc)
+            self.assertEqual(cb.registryValue('foo'), 1)
+            self.assertEqual(cb.registryValue('foo', '#test'), 1)
+            cb.setRegistryValue('foo', 2, '#test')
+            self.assertEqual(cb.registryValue('foo', '#test'), 2)
+            self.assertEqual(cb.registryValue('foo'), 1)
+            self.assertEqual(cb.registryValue('foo', 'notachannel'), 1)
+            group.unregister('foo')
+            conf.registerChannelValue(group, 'foo', registry.Integer(3, ''))
+            self.assertEqual(cb.registryValue('foo'), 3)
+            self.assertEqual(cb.registryValue('foo', '#test'), 3)
+            self.assertRaises(registry.NonExistentRegistryEntry,
+                              cb.registryValue, 'bar')
+        finally:
+            conf.supybot.plugins.unregister('RegistryValueTest')
+
 
 class WithPrivateNoticeTestCase(ChannelPluginTestCase):
     plugins = ('Utilities',)
@@ -690,6 +756,108 @@ class ProxyTestCase(SupyTestCase):
         self.failUnless(d[proxy] == 'foo')
 
 
+class CommandPoolTestCase(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.pool = callbacks.CommandPool()
+        self.event = threading.Event()
+        self.cond = threading.Condition()
+        self.started = []
+        self.ran = []
+        self.shed = []
+
+    def tearDown(self):
+        self.event.set()
+        SupyTestCase.tearDown(self)
+
+    def _append(self, L, name):
+        self.cond.acquire()
+        try:
+            L.append(name)
+            self.cond.notifyAll()
+        finally:
+            self.cond.release()
+
+    def block(self, name):
+        self._append(self.started, name)
+        self.event.wait()
+        self._append(self.ran, name)
+
+    def submit(self, name):
+        self.pool.submit(name, self.block, (name,),
+                         onShed=lambda : self.shed.append(name))
+
+    def waitFor(self, L, n):
+        """Waits until n commands are in L (started or ran); the timeout is
+        only there so a broken pool fails the test rather than hanging it."""
+        deadline = time.time() + 5
+        self.cond.acquire()
+        try:
+            while len(L) < n and time.time() < deadline:
+                self.cond.wait(deadline - time.time())
+            self.assertEqual(len(L), n)
+        finally:
+            self.cond.release()
+
+    def testPerPluginLimit(self):
+        original = conf.supybot.commands.threads.perPlugin()
+        try:
+            conf.supybot.commands.threads.perPlugin.setValue(1)
+            self.submit('Foo')
+            self.submit('Foo')
+            self.submit('Bar')
+            self.waitFor(self.started, 2)
+            self.assertEqual(sorted(self.started), ['Bar', 'Foo'])
+            self.assertEqual(self.pool.stats()['queued'], 1)
+            self.event.set()
+            self.waitFor(self.ran, 3)
+            self.assertEqual(sorted(self.ran), ['Bar', 'Foo', 'Foo'])
+        finally:
+            conf.supybot.commands.threads.perPlugin.setValue(original)
+
+    def testWhenFull(self):
+        queue = conf.supybot.commands.threads.queue()
+        workers = conf.supybot.commands.threads.workers()
+        whenFull = conf.supybot.commands.threads.whenFull()
+        try:
+            conf.supybot.commands.threads.queue.setValue(1)
+            conf.supybot.commands.threads.workers.setValue(1)
+            conf.supybot.commands.threads.whenFull.setValue('refuse')
+            self.submit('running')
+            self.waitFor(self.started, 1)
+            self.submit('waiting')
+            self.submit('refused')
+            self.assertEqual(self.shed, ['refused'])
+            conf.supybot.commands.threads.whenFull.setValue('dropOldest')
+            self.submit('newest')
+            self.assertEqual(self.shed, ['refused', 'waiting'])
+            self.event.set()
+            self.waitFor(self.ran, 2)
+            self.assertEqual(self.ran, ['running', 'newest'])
+            self.assertEqual(self.pool.stats()['shed'], 2)
+        finally:
+            conf.supybot.commands.threads.queue.setValue(queue)
+            conf.supybot.commands.threads.workers.setValue(workers)
+            conf.supybot.commands.threads.whenFull.setValue(whenFull)
+
+
+class CommandThreadTestCase(SupyTestCase):
+    def testStillRuns(self):
+        class Plugin(object):
+            threaded = False
+            def name(self):
+                return 'Plugin'
+            def command(self, name, event):
+                self.threadedWhileRunning = self.threaded
+                event.set()
+        cb = Plugin()
+        event = threading.Event()
+        t = callbacks.CommandThread(target=cb.command, args=('foo', event))
+        t.start()
+        t.join(5)
+        self.failUnless(event.isSet())
+        self.failUnless(cb.threadedWhileRunning)
+        self.failIf(cb.threaded)
 
 
 # vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -29,8 +29,14 @@
 
 from supybot.test import *
 
+import re
+import socket
+import logging
+
 from supybot.commands import *
+import supybot.log as log
 import supybot.irclib as irclib
+import supybot.commands as commands
 import supybot.ircmsgs as ircmsgs
 import supybot.callbacks as callbacks
 
@@ -148,6 +154,16 @@ class GeneralContextTestCase(CommandsTestCase):
         self.assertState(spec, ['baz'], ['baz'])
         self.assertError(spec, ['ba'])
 
+    def testSpecIsReusable(self):
+        msg = ircmsgs.privmsg('test', 'foo')
+        irc = callbacks.SimpleProxy(getTestIrc(), msg)
+        spec = Spec(['int', 'something', additional('text', 'x')])
+        self.assertEqual(spec(irc, msg, ['1', 'a', 'b', 'c']).args,
+                         [1, 'a', 'b c'])
+        self.assertEqual(spec(irc, msg, ['2', 'a']).args, [2, 'a', 'x'])
+        self.assertRaises(callbacks.Error, spec, irc, msg, ['3', ''])
+        self.assertRaises(callbacks.ArgumentError, spec, irc, msg, ['4'])
+
 class ConverterTestCase(CommandsTestCase):
     def testUrlAllowsHttps(self):
         url = 'https://foo.bar/baz'
@@ -169,5 +185,79 @@ class FirstTestCase(CommandsTestCase):
         self.assertStateErrored([first('int', 'something')], ['words'],
                                 errored=False)
 
+class IsDebuggingTestCase(SupyTestCase):
+    def testPluginLogger(self):
+        logger = logging.getLogger('supybot.plugins.IsDebuggingTest')
+        logger.propagate = False
+        handler = logging.StreamHandler()
+        handler.setLevel(logging.INFO)
+        logger.addHandler(handler)
+        try:
+            self.failIf(log.isDebugging(logger))
+            handler.setLevel(-1)
+            self.failUnless(log.isDebugging(logger))
+        finally:
+            logger.removeHandler(handler)
+
+class RegexpPoolTestCase(SupyTestCase):
+    def testSearch(self):
+        pool = commands.RegexpPool(size=1)
+        r = re.compile('foo')
+        self.assertEqual(pool.search(r, ['foo', 'bar', 'afoob'], 1),
+                         [True, False, True])
+        self.assertEqual(pool.search(r, [], 1), [])
+
+    def testTimeoutRespawns(self):
+        pool = commands.RegexpPool(size=1)
+        evil = re.compile('(a+)+b')
+        r = pool.search(evil, ['ab', 'a'*40, 'aab'], 0.1)
+        self.assertEqual(r, [True, False, True])
+        self.assertEqual(pool.search(re.compile('b'), ['ab'], 1), [True])
+
+    def testWorkersDontKeepOurFilesOpen(self):
+        (a, b) = socket.socketpair()
+        try:
+            pool = commands.RegexpPool(size=1)
+            self.assertEqual(pool.search(re.compile('a'), ['a'], 1), [True])
+            a.close()
+            b.settimeout(5)
+            self.assertEqual(b.recv(1), '')
+        finally:
+            b.close()
+
+    def testFailedRespawn(self):
+        pool = commands.RegexpPool(size=1)
+        evil = re.compile('(a+)+b')
+        RegexpWorker = commands.RegexpWorker
+        def fail():
+            raise OSError, 'Resource temporarily unavailable'
+        pool.search(evil, ['ab'], 1)
+        commands.RegexpWorker = fail
+        try:
+            self.assertRaises(OSError, pool.search, evil, ['a'*40], 0.1)
+        finally:
+            commands.RegexpWorker = RegexpWorker
+        self.assertEqual(pool.started, 0)
+        self.assertEqual(pool.search(evil, ['ab'], 1), [True])
+
+    def testRegexpWrapper(self):
+        r = re.compile('bar')
+        self.failUnless(commands.regexp_wrapper('foobar', reobj=r, timeout=1,
+                                                plugin_name='Test',
+                                                fcn_name='test'))
+        self.failIf(commands.regexp_wrapper('foo', reobj=r, timeout=1,
+                                            plugin_name='Test',
+                                            fcn_name='test'))
+
+    def testRegexpFilter(self):
+        r = re.compile('bar')
+        L = ['foobar', 'foo', 'bar']
+        self.assertEqual(commands.regexp_filter(L, r, 1, 'Test', 'test'),
+                         ['foobar', 'bar'])
+        L = [(1, 'foo'), (2, 'bar')]
+        self.assertEqual(commands.regexp_filter(L, r, 1, 'Test', 'test',
+                                                key=lambda t: t[1]),
+                         [(2, 'bar')])
+
 # vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
 
@@ -0,0 +1,260 @@
+###
+# Copyright (c) 2002-2005, Jeremiah Fincher
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+
+from supybot.test import *
+
+import os
+import csv
+
+import supybot.dbi as dbi
+
+class IndexedFlatfileMappingTestCase(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.filename = os.path.join(conf.supybot.directories.data(),
+                                     'IndexedFlatfileMapping.db')
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+
+    def testBasics(self):
+        m = dbi.IndexedFlatfileMapping(self.filename)
+        ids = [m.add('record %s' % i) for i in range(10)]
+        self.assertEqual(ids, range(1, 11))
+        self.assertEqual(m.get(3), 'record 2')
+        self.assertEqual(m.size(), 10)
+        m.set(3, 'changed')
+        self.assertEqual(m.get(3), 'changed')
+        m.remove(4)
+        self.assertRaises(dbi.NoRecordError, m.get, 4)
+        self.assertEqual(m.size(), 9)
+        self.assertEqual(sorted(m)[:4],
+                         [(1, 'record 0'), (2, 'record 1'), (3, 'changed'),
+                          (5, 'record 4')])
+        self.failUnless(m.random()[0] in ids)
+        m.close()
+
+    def testFileIsCompatibleWithFlatfileMapping(self):
+        m = dbi.IndexedFlatfileMapping(self.filename)
+        for i in range(5):
+            m.add('record %s' % i)
+        m.set(2, 'changed')
+        m.remove(3)
+        m.flush()
+        flat = dbi.FlatfileMapping(self.filename)
+        self.assertEqual(sorted(flat), sorted(m))
+        m.close()
+        m = dbi.IndexedFlatfileMapping(self.filename)
+        self.assertEqual(m.get(2), 'changed')
+        self.assertEqual(m.add('another'), 6)
+        m.close()
+
+    def testVacuum(self):
+        m = dbi.IndexedFlatfileMapping(self.filename)
+        for i in range(100):
+            m.add('record %s' % i)
+        for i in range(1, 91):
+            m.remove(i)
+        m.flush()
+        size = os.path.getsize(self.filename)
+        m.vacuum()
+        m.vacuumThread.join()
+        self.failUnless(os.path.getsize(self.filename) < size)
+        self.assertEqual(m.size(), 10)
+        self.assertEqual(m.get(95), 'record 94')
+        m.set(95, 'changed')
+        self.assertEqual(m.get(95), 'changed')
+        m.close()
+
+    def testEmpty(self):
+        m = dbi.IndexedFlatfileMapping(self.filename)
+        self.assertEqual(m.size(), 0)
+        self.assertRaises(IndexError, m.random)
+        self.assertRaises(dbi.NoRecordError, m.get, 1)
+        m.close()
+
+    def testChangesAreWrittenImmediately(self):
+        m = dbi.IndexedFlatfileMapping(self.filename)
+        m.add('first')
+        m.add('second')
+        # Not closed or flushed, as if we'd died here.
+        m = dbi.IndexedFlatfileMapping(self.filename)
+        self.assertEqual(m.add('third'), 3)
+        self.assertEqual(sorted(m), [(1, 'first'), (2, 'second'),
+                                     (3, 'third')])
+        m.close()
+
+    def testLostNextIdIsRecovered(self):
+        m = dbi.IndexedFlatfileMapping(self.filename)
+        m.add('first')
+        m.add('second')
+        m.close()
+        fd = file(self.filename, 'r+b')
+        fd.write(m._canonicalId(2)) # As if we died before writing it.
+        fd.close()
+        m = dbi.IndexedFlatfileMapping(self.filename)
+        self.assertEqual(m.add('third'), 3)
+        m.close()
+
+    def testStringIds(self):
+        m = dbi.IndexedFlatfileMapping(self.filename)
+        m.add('first')
+        m.add('second')
+        m.set('1', 'changed')
+        m.remove('2')
+        self.assertEqual(sorted(m), [(1, 'changed')])
+        m.close()
+
+    def testNoFileIsHeldOpen(self):
+        m = dbi.IndexedFlatfileMapping(self.filename)
+        m.add('first')
+        m.get(1)
+        self.failIf([v for v in m.__dict__.values() if isinstance(v, file)])
+        m.close()
+
+    def testChangesDuringVacuumAreKept(self):
+        m = dbi.IndexedFlatfileMapping(self.filename)
+        for i in range(10):
+            m.add('record %s' % i)
+        m.remove(1)
+        lock = m.lock
+        class Lock(object):
+            # Changes the database the second time _vacuum takes the lock,
+            # i.e., after it has copied the records but before it replays.
+            acquired = 0
+            def acquire(self):
+                self.acquired += 1
+                if self.acquired == 2:
+                    m.lock = lock
+                    m.set(2, 'changed')
+                    m.remove(3)
+                    m.add('added')
+                lock.acquire()
+            def release(self):
+                lock.release()
+        m.lock = Lock()
+        m._vacuum()
+        m.lock = lock
+        expected = [(2, 'changed'), (11, 'added')] + \
+                   [(i, 'record %s' % (i-1)) for i in range(4, 11)]
+        self.assertEqual(sorted(m), sorted(expected))
+        self.assertEqual(m.get(2), 'changed')
+        self.assertEqual(m.get(11), 'added')
+        self.assertRaises(dbi.NoRecordError, m.get, 3)
+        m = dbi.IndexedFlatfileMapping(self.filename)
+        self.assertEqual(sorted(m), sorted(expected))
+        self.assertEqual(m.add('another'), 12)
+        m.close()
+
+
+class DBTestCase(SupyTestCase):
+    def testOpenDBsAreFlushed(self):
+        filename = os.path.join(conf.supybot.directories.data(), 'DB.db')
+        if os.path.exists(filename):
+            os.remove(filename)
+        db = dbi.DB(filename, Mapping='cdb')
+        self.failUnless(db.flush in world.flushers)
+        db.close()
+        self.failIf(db.flush in world.flushers)
+
+    def testFlatfileDBsAreNotKeptAlive(self):
+        filename = os.path.join(conf.supybot.directories.data(), 'DB.db')
+        if os.path.exists(filename):
+            os.remove(filename)
+        for Mapping in ('flat', 'indexed'):
+            db = dbi.DB(filename, Mapping=Mapping)
+            self.failIf(db.flush in world.flushers)
+            db.close()
+
+class RecordTestCase(SupyTestCase):
+    class Record(dbi.Record):
+        __fields__ = [
+            'text',
+            ('priority', int),
+            'at',
+            'tags',
+            'active',
+            'by',
+            'name',
+            ]
+
+    def testRoundTrip(self):
+        r = self.Record(text='foo\tbar\n\\baz\'', priority=3, at=1.5,
+                        tags=('a', ['b', 1]), active=False, by=None,
+                        name=u'\xe9t\xe9')
+        s = r.serialize()
+        self.failIf('\n' in s)
+        r2 = self.Record(id=1)
+        r2.deserialize(s)
+        for name in r.fields:
+            self.assertEqual(getattr(r2, name), getattr(r, name))
+            self.assertEqual(type(getattr(r2, name)), type(getattr(r, name)))
+        self.assertEqual(r2.serialize(), s)
+
+    def testOldFormat(self):
+        r = self.Record(id=1)
+        r.deserialize(csv.join(map(repr, ['foo, bar', 2, 3.0, ('x',), True,
+                                         None, 'baz'])))
+        self.assertEqual(r.text, 'foo, bar')
+        self.assertEqual(r.priority, 2)
+        self.assertEqual(r.tags, ('x',))
+        self.assertEqual(r.active, True)
+        self.assertEqual(r.by, None)
+        r2 = self.Record(id=1)
+        r2.deserialize(r.serialize())
+        self.assertEqual(r2.text, 'foo, bar')
+        self.assertEqual(r2.name, 'baz')
+
+    def testOldFormatFastPath(self):
+        for x in ['foo', 'it\'s', '"quoted"', 'both \' and "', '\\\t\x01',
+                  0, -12, 1.5, -2e10, 1e-5, 10**30, u'foo', ['a', 1], None]:
+            r = self.Record(id=1)
+            r.deserialize(csv.join([repr(x)]))
+            self.assertEqual(r.text, x)
+            self.assertEqual(type(r.text), type(x))
+
+    def testLazyDecoding(self):
+        r = self.Record(text='foo', tags=['bar'])
+        r2 = self.Record(id=1)
+        r2.deserialize(r.serialize())
+        self.failIf('tags' in r2.__dict__)
+        self.assertEqual(r2.text, 'foo')
+        self.failIf('tags' in r2.__dict__)
+        self.assertEqual(r2.tags, ['bar'])
+        self.failUnless('tags' in r2.__dict__)
+        self.assertRaises(AttributeError, getattr, r2, 'nosuchfield')
+
+    def testMissingFieldsGetDefaults(self):
+        r = self.Record(id=1)
+        r.deserialize(repr('foo'))
+        self.assertEqual(r.text, 'foo')
+        self.assertEqual(r.priority, None)
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,331 @@
+###
+# Copyright (c) 2002-2005, Jeremiah Fincher
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+from supybot.test import *
+
+import time
+import errno
+import socket
+import select
+
+import supybot.drivers as drivers
+import supybot.schedule as schedule
+import supybot.drivers.Select as Select
+from supybot.drivers.Socket import OutputBuffer
+
+def unregister(driver):
+    # Reactors register themselves as drivers, but we don't want them waiting
+    # on their sockets in the driver loop the other tests run.
+    name = driver.name()
+    if (name, driver) in drivers._newDrivers:
+        drivers._newDrivers.remove((name, driver))
+    if drivers._drivers.get(name) is driver:
+        del drivers._drivers[name]
+
+unregister(Select.reactor)
+
+class FakeSocket(object):
+    def __init__(self, limit):
+        self.limit = limit
+        self.sent = []
+    def send(self, data):
+        if isinstance(data, buffer):
+            data = str(data)
+        data = data[:self.limit]
+        self.sent.append(data)
+        return len(data)
+
+class OutputBufferTestCase(SupyTestCase):
+    def testPartialSends(self):
+        b = OutputBuffer()
+        self.failIf(b)
+        for s in ('foo\r\n', 'bar\r\n', 'baz\r\n'):
+            b.append(s)
+        self.assertEqual(len(b), 15)
+        sock = FakeSocket(4)
+        L = []
+        while b:
+            L.append(b.send(sock))
+        self.assertEqual(''.join(sock.sent), 'foo\r\nbar\r\nbaz\r\n')
+        self.assertEqual(sum(L), 15)
+        self.assertEqual(len(b), 0)
+
+    def testSendsAreBatched(self):
+        b = OutputBuffer()
+        b.chunkSize = 10
+        for s in ('aaaa', 'bbbb', 'cccc'):
+            b.append(s)
+        sock = FakeSocket(100)
+        b.send(sock)
+        self.assertEqual(sock.sent, ['aaaabbbb'])
+        self.assertEqual(str(b), 'cccc')
+        b.send(sock)
+        self.assertEqual(sock.sent[-1], 'cccc')
+        self.failIf(b)
+
+    def testCoalescingAfterPartialSend(self):
+        b = OutputBuffer()
+        b.append('abcdef')
+        b.append('ghi')
+        sock = FakeSocket(2)
+        b.send(sock)
+        self.assertEqual(str(b), 'cdefghi')
+        sock.limit = 100
+        b.send(sock)
+        self.assertEqual(sock.sent[-1], 'cdefghi')
+        self.failIf(b)
+
+
+class PollerTestCase(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.socks = []
+
+    def tearDown(self):
+        for sock in self.socks:
+            sock.close()
+        SupyTestCase.tearDown(self)
+
+    def socketpair(self):
+        (a, b) = socket.socketpair()
+        self.socks.extend((a, b))
+        return (a, b)
+
+    def _testPoller(self, poller):
+        (a, b) = self.socketpair()
+        start = time.time()
+        self.assertEqual(poller.poll([a], [], 0.1), ([], []))
+        self.failUnless(time.time() - start >= 0.05)
+        self.assertEqual(poller.poll([a], [b], 0), ([], [b]))
+        b.send('foo')
+        self.assertEqual(poller.poll([a], [], 1), ([a], []))
+        a.recv(1024)
+        self.assertEqual(poller.poll([a, b], [], 0), ([], []))
+        (r, w) = poller.poll([a], [a], 0)
+        self.assertEqual((r, w), ([], [a]))
+
+    def testSelectPoller(self):
+        self._testPoller(Select.SelectPoller())
+
+    if hasattr(select, 'epoll'):
+        def testEpollPoller(self):
+            self._testPoller(Select.EpollPoller())
+
+        def testEpollPollerUnregisters(self):
+            poller = Select.EpollPoller()
+            (a, b) = self.socketpair()
+            b.send('foo')
+            self.assertEqual(poller.poll([a], [], 0), ([a], []))
+            self.assertEqual(poller.poll([b], [], 0), ([], []))
+            self.failIf(a.fileno() in poller.registered)
+
+        def testEpollPollerReusedDescriptor(self):
+            poller = Select.EpollPoller()
+            (a, b) = socket.socketpair()
+            self.assertEqual(poller.poll([a], [], 0), ([], []))
+            fd = a.fileno()
+            a.close()
+            b.close()
+            (c, d) = self.socketpair()
+            if fd not in (c.fileno(), d.fileno()):
+                return # The descriptor wasn't reused, nothing to test.
+            if c.fileno() != fd:
+                (c, d) = (d, c)
+            d.send('foo')
+            self.assertEqual(poller.poll([c], [], 1), ([c], []))
+            self.failUnless(poller.registered[fd][1] is c)
+
+
+class FakeIrc(object):
+    def nextTakeTime(self):
+        return None
+
+class FakeDriver(object):
+    def __init__(self, conn):
+        self.conn = conn
+        self.irc = FakeIrc()
+        self.connected = True
+        self.outbuffer = ''
+        self.nextReconnectTime = None
+        self.writeCheckTime = None
+        self.reads = 0
+        self.sends = 0
+
+    def name(self):
+        return 'FakeDriver'
+
+    def _read(self):
+        self.reads += 1
+        self.conn.recv(1024)
+        return True
+
+    def _sendIfMsgs(self):
+        self.sends += 1
+
+class BrokenDriver(FakeDriver):
+    def _read(self):
+        raise Exception, 'Broken.'
+
+class BrokenPoller(object):
+    def poll(self, readers, writers, timeout):
+        raise Exception, 'Broken.'
+
+class ReactorTestCase(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.reactor = Select.Reactor()
+        unregister(self.reactor)
+        (self.a, self.b) = socket.socketpair()
+        self.events = []
+
+    def tearDown(self):
+        self.a.close()
+        self.b.close()
+        for name in self.events:
+            schedule.removeEvent(name)
+        SupyTestCase.tearDown(self)
+
+    def testGetTimeout(self):
+        now = time.time()
+        poll = conf.supybot.drivers.poll()
+        def expected(t):
+            # Other tests may have left events in the schedule.
+            next = schedule.nextEventTime()
+            if next is not None:
+                t = min(t, next - now)
+            return max(0, t)
+        self.assertEqual(self.reactor.getTimeout(now), expected(poll))
+        driver = FakeDriver(self.a)
+        driver.writeCheckTime = now + poll/2
+        self.reactor.add(driver)
+        self.assertEqual(self.reactor.getTimeout(now), expected(poll/2))
+        driver.writeCheckTime = now - 10
+        self.assertEqual(self.reactor.getTimeout(now), 0)
+        self.reactor.remove(driver)
+        self.events.append(schedule.addEvent(lambda: None, now + poll/4))
+        self.assertEqual(self.reactor.getTimeout(now), expected(poll/4))
+
+    def testWakeup(self):
+        self.reactor.add(FakeDriver(self.a))
+        self.reactor.wakeup()
+        self.reactor.wakeup()
+        start = time.time()
+        self.reactor.run()
+        self.failUnless(time.time() - start < conf.supybot.drivers.poll())
+        self.failIf(self.reactor.waker.pending)
+        self.assertEqual(self.reactor.poller.poll([self.reactor.waker], [], 0),
+                         ([], []))
+
+    def testReadsReadySockets(self):
+        driver = FakeDriver(self.a)
+        self.reactor.add(driver)
+        self.b.send('foo')
+        self.reactor.run()
+        self.assertEqual(driver.reads, 1)
+        self.assertEqual(driver.sends, 1)
+
+    def testOnlyWritesWhenWritable(self):
+        driver = FakeDriver(self.a)
+        self.reactor.add(driver)
+        self.a.setblocking(0)
+        try:
+            while True:
+                self.a.send('x'*65536)
+        except socket.error, e:
+            self.assertEqual(e.args[0], errno.EAGAIN)
+        driver.outbuffer = 'waiting'
+        self.reactor.wakeup() # So we don't wait for the poll timeout.
+        self.reactor.run()
+        self.assertEqual(driver.sends, 0)
+        driver.outbuffer = ''
+        self.reactor.wakeup()
+        self.reactor.run()
+        self.assertEqual(driver.sends, 1)
+
+    def testRemovesDriverRaising(self):
+        driver = BrokenDriver(self.a)
+        self.reactor.add(driver)
+        self.b.send('foo')
+        try:
+            self.reactor.run()
+            self.failIf(driver in self.reactor.drivers)
+            self.failUnless(driver.name() in drivers._deadDrivers)
+        finally:
+            while driver.name() in drivers._deadDrivers:
+                drivers._deadDrivers.remove(driver.name())
+
+    def testNeverDies(self):
+        self.reactor.add(FakeDriver(self.a))
+        self.reactor.poller = BrokenPoller()
+        self.reactor.run()
+        self.failIf(isinstance(self.reactor.poller, BrokenPoller))
+        self.b.send('foo')
+        self.reactor.run()
+        self.assertEqual(list(self.reactor.drivers)[0].reads, 1)
+
+
+class FakeNetworkIrc(object):
+    network = 'test'
+
+class SelectDriverTestCase(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        (self.a, self.b) = socket.socketpair()
+        # We don't want it connecting anywhere, so we skip __init__.
+        driver = Select.SelectDriver.__new__(Select.SelectDriver)
+        driver.irc = FakeNetworkIrc()
+        driver.conn = self.a
+        driver.connected = True
+        driver.currentServer = 'test:6667'
+        driver.inbuffer = ''
+        driver.eagains = 0
+        driver.nextReconnectTime = None
+        driver.resetDelay()
+        self.driver = driver
+
+    def tearDown(self):
+        self.a.close()
+        self.b.close()
+        SupyTestCase.tearDown(self)
+
+    def testWouldBlockIsNotAnError(self):
+        self.driver._handleSocketError(socket.error(errno.EAGAIN, 'EAGAIN'))
+        self.failUnless(self.driver.connected)
+        self.a.setblocking(0)
+        self.failUnless(self.driver._read())
+        self.failUnless(self.driver.connected)
+
+    def testEOFIsDisconnect(self):
+        self.b.close()
+        self.failIf(self.driver._read())
+        self.failIf(self.driver.connected)
+        self.failIf(self.driver.nextReconnectTime is None)
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
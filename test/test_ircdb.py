@@ -398,6 +398,83 @@ class UsersDictionaryTestCase(IrcdbTestCase):
         self.assertRaises(ValueError, self.users.setUser, u2)
 
 
+    def testGetUserIdWithManyUsers(self):
+        for i in range(50):
+            u = self.users.newUser()
+            u.name = 'user%s' % i
+            u.addHostmask('*!*@*.host%s.example.com' % i)
+            u.addHostmask('nick%s!ident@exact.example.org' % i)
+            self.users.setUser(u, flush=False)
+        u = self.users.getUser('someone!else@a.host17.example.com')
+        self.assertEqual(u.name, 'user17')
+        u = self.users.getUser('NICK3!ident@EXACT.example.org')
+        self.assertEqual(u.name, 'user3')
+        self.assertRaises(KeyError, self.users.getUser,
+                          'someone!else@a.host17.example.net')
+        u = self.users.getUser('user5')
+        u.removeHostmask('*!*@*.host5.example.com')
+        self.users.setUser(u, flush=False)
+        self.assertRaises(KeyError, self.users.getUser,
+                          'someone!else@a.host5.example.com')
+        u.addAuth('auth!auth@authenticated.example.net')
+        self.users.setUser(u, flush=False)
+        self.assertEqual(self.users.getUser('auth!auth@authenticated.'
+                                            'example.net').name, 'user5')
+        self.users.delUser(u.id)
+        self.assertRaises(KeyError, self.users.getUser,
+                          'nick5!ident@exact.example.org')
+
+    def testCacheEvictionKeepsInvalidationWorking(self):
+        self.users._nameCache.max = 2
+        self.users._hostmaskCache.max = 2
+        ids = []
+        for i in range(3):
+            u = self.users.newUser()
+            u.name = 'user%s' % i
+            u.addHostmask('nick%s!ident@host.example.org' % i)
+            self.users.setUser(u, flush=False)
+            ids.append(u.id)
+        for i in range(3):
+            self.assertEqual(self.users.getUserId('user%s' % i), ids[i])
+            self.assertEqual(self.users.getUserId('nick%s!ident@'
+                                                  'host.example.org' % i),
+                             ids[i])
+        self.users.delUser(ids[2])
+        self.assertRaises(KeyError, self.users.getUserId, 'user2')
+        self.assertRaises(KeyError, self.users.getUserId,
+                          'nick2!ident@host.example.org')
+        self.assertEqual(self.users.getUserId('user0'), ids[0])
+
+
+class HostmaskIndexTestCase(SupyTestCase):
+    def testMatching(self):
+        index = ircdb.HostmaskIndex()
+        index.add(1, 'foo!bar@baz.example.com')
+        index.add(2, '*!*@*.example.com')
+        index.add(3, 'nick!*@*')
+        index.add(4, '*!*@*')
+        self.assertEqual(index.matching('FOO!bar@baz.example.com'),
+                         set([1, 2, 4]))
+        self.assertEqual(index.matching('nick!x@y.example.net'), set([3, 4]))
+        index.remove(4, '*!*@*')
+        self.assertEqual(index.matching('other!x@y.example.net'), set())
+        index.setUser(2, ['*!*@*.example.net'])
+        self.assertEqual(index.matching('other!x@y.example.net'), set([2]))
+        index.removeUser(2)
+        self.assertEqual(index.matching('other!x@y.example.net'), set())
+
+    def testMatchedBy(self):
+        index = ircdb.HostmaskIndex()
+        index.add(1, 'foo!bar@baz.example.com')
+        index.add(2, '*!*@*.example.net')
+        index.add(3, 'nick!bar@baz.example.org')
+        self.assertEqual(index.matchedBy('*!*@*.EXAMPLE.com'),
+                         [(1, 'foo!bar@baz.example.com')])
+        self.assertEqual(index.matchedBy('nick!*'),
+                         [(3, 'nick!bar@baz.example.org')])
+        self.assertEqual(len(index.matchedBy('*!*@*')), 3)
+
+
 class CheckCapabilityTestCase(IrcdbTestCase):
     filename = os.path.join(conf.supybot.directories.conf(),
                             'CheckCapabilityTestCase.conf')
@@ -181,6 +181,48 @@ class IrcMsgQueueTestCase(SupyTestCase):
         self.assertEqual(self.mode, q.dequeue())
         self.assertEqual(self.msg, q.dequeue())
 
+    def testTargetsAreServedFairly(self):
+        q = irclib.IrcMsgQueue()
+        flood = [ircmsgs.privmsg('#flood', str(i)) for i in range(5)]
+        quiet = ircmsgs.privmsg('#quiet', 'hi')
+        for msg in flood:
+            q.enqueue(msg)
+        q.enqueue(quiet)
+        self.assertEqual(q.dequeue(), flood[0])
+        self.assertEqual(q.dequeue(), quiet)
+        for msg in flood[1:]:
+            self.assertEqual(q.dequeue(), msg)
+        self.failIf(q)
+
+    def testLongerMessagesCostMore(self):
+        q = irclib.IrcMsgQueue()
+        long = [ircmsgs.privmsg('#long', 'x'*400 + str(i))
+                for i in range(3)]
+        short = [ircmsgs.privmsg('#short', str(i)) for i in range(5)]
+        for msgs in zip(long, short):
+            for msg in msgs:
+                q.enqueue(msg)
+        for msg in short[3:]:
+            q.enqueue(msg)
+        L = [q.dequeue() for _ in range(len(q))]
+        self.failUnless(L.index(short[3]) < L.index(long[2]))
+
+    def testRateLimitedJoinDoesntBlock(self):
+        rateLimit = conf.supybot.protocols.irc.queuing.rateLimit.join
+        original = rateLimit()
+        try:
+            rateLimit.setValue(1000)
+            q = irclib.IrcMsgQueue()
+            q.enqueue(ircmsgs.join('#foo'))
+            q.enqueue(ircmsgs.join('#bar'))
+            q.enqueue(self.msg)
+            self.assertEqual(q.dequeue(), ircmsgs.join('#foo'))
+            self.assertEqual(q.dequeue(), None)
+            self.assertEqual(q.dequeue(), self.msg)
+            self.failUnless(ircmsgs.join('#bar') in q)
+        finally:
+            rateLimit.setValue(original)
+
 
 class ChannelStateTestCase(SupyTestCase):
     def testPickleCopy(self):
@@ -224,6 +266,45 @@ class ChannelStateTestCase(SupyTestCase):
         self.failIf('quuz' in c.halfops)
         self.failIf('quuz' in c.voices)
 
+    def testMembersAreCaseInsensitive(self):
+        c = irclib.ChannelState()
+        c.addUser('@FooBar')
+        self.failUnless('foobar' in c.users)
+        self.failUnless(c.isOp('FOOBAR'))
+        self.assertEqual(list(c.users), ['FooBar'])
+        self.assertEqual(c.users, ['foobar'])
+        c.removeUser('fOObAR')
+        self.failIf(c.users)
+        self.failIf(c.ops)
+
+    def testModesWithoutUsers(self):
+        c = irclib.ChannelState()
+        c.ops.add('foo')
+        self.failUnless('foo' in c.ops)
+        self.failIf('foo' in c.users)
+        self.assertEqual(len(c.users), 0)
+        c.addUser('+foo')
+        self.assertEqual(len(c.users), 1)
+        self.failUnless(c.isOp('foo') and c.isVoice('foo'))
+        c.replaceUser('foo', 'bar')
+        self.failUnless(c.isOp('bar') and c.isVoice('bar'))
+        self.failIf('foo' in c.users)
+        self.assertEqual(len(c.users), 1)
+
+    def testCopyOnWrite(self):
+        c = irclib.ChannelState()
+        for nick in ('foo', '@bar', '+baz'):
+            c.addUser(nick)
+        c1 = c.copy()
+        self.assertEqual(c, c1)
+        c1.removeUser('foo')
+        c.voices.discard('baz')
+        c.addUser('qux')
+        self.assertEqual(sorted(c.users), ['bar', 'baz', 'foo', 'qux'])
+        self.assertEqual(sorted(c1.users), ['bar', 'baz'])
+        self.failUnless(c1.isVoice('baz'))
+        self.failIf(c.isVoice('baz'))
+
 
 class IrcStateTestCase(SupyTestCase):
     class FakeIrc:
@@ -404,6 +485,22 @@ class IrcTestCase(SupyTestCase):
         msg = self.irc.takeMsg()
         self.failUnless(msg.command == 'NICK' and msg.args[0] != self.irc.nick)
 
+    def testQuitAndNickAreTaggedWithChannels(self):
+        for channel in ('#foo', '#bar', '#baz'):
+            self.irc.feedMsg(ircmsgs.join(channel, prefix=self.irc.prefix))
+        self.irc.feedMsg(ircmsgs.join('#foo', prefix='foo!bar@baz'))
+        self.irc.feedMsg(ircmsgs.join('#bar', prefix='foo!bar@baz'))
+        m = ircmsgs.nick('qux', prefix='foo!bar@baz')
+        self.irc.feedMsg(m)
+        self.assertEqual(sorted(m.channels), ['#bar', '#foo'])
+        m = ircmsgs.quit(prefix='qux!bar@baz')
+        self.irc.feedMsg(m)
+        self.assertEqual(sorted(m.channels), ['#bar', '#foo'])
+        self.failIf(self.irc.state.channelsOf('qux'))
+        m = ircmsgs.privmsg('#foo', 'bar', prefix=self.irc.prefix)
+        self.irc.feedMsg(m)
+        self.assertEqual(m.channels, None)
+
     def testSendBeforeQueue(self):
         while self.irc.takeMsg() is not None:
             self.irc.takeMsg()
@@ -414,6 +511,72 @@ class IrcTestCase(SupyTestCase):
         msg = self.irc.takeMsg()
         self.failUnless(msg.command == 'NOTICE')
 
+    def testThrottleAllowsBursts(self):
+        throttle = conf.supybot.networks.test.throttle
+        original = throttle()
+        try:
+            throttle.setValue(10)
+            for i in range(10):
+                self.irc.queueMsg(ircmsgs.privmsg('#foo', str(i)))
+            L = []
+            while True:
+                msg = self.irc.takeMsg()
+                if msg is None:
+                    break
+                L.append(msg)
+            # Each message costs a little more than 2 seconds.
+            self.assertEqual(len(L), 4)
+            now = time.time()
+            self.failUnless(now < self.irc.nextTakeTime() < now + 3)
+            self.irc.penaltyTime -= 3
+            self.failUnless(self.irc.takeMsg())
+        finally:
+            throttle.setValue(original)
+
+    def testPenaltyIsChargedForWhatIsSent(self):
+        class Dropper(irclib.IrcCallback):
+            def outFilter(self, irc, msg):
+                if msg.command == 'PRIVMSG':
+                    return None
+                return msg
+        throttle = conf.supybot.networks.test.throttle
+        original = throttle()
+        while self.irc.takeMsg() is not None:
+            pass
+        self.irc.addCallback(Dropper())
+        try:
+            throttle.setValue(100)
+            self.irc.penaltyTime = 0
+            self.irc.sendMsg(ircmsgs.privmsg('#foo', 'x'*400))
+            self.irc.sendMsg(ircmsgs.ping('foo'))
+            now = time.time()
+            msg = self.irc.takeMsg()
+            self.assertEqual(msg.command, 'PING')
+            self.failUnless(self.irc.penaltyTime <=
+                            time.time() + self.irc._penalty(msg))
+            self.failUnless(self.irc.penaltyTime >= now)
+        finally:
+            self.irc.removeCallback('Dropper')
+            throttle.setValue(original)
+
+    def testQueueUsesNetworkPenalty(self):
+        messageCost = conf.supybot.networks.test.throttle.messageCost
+        original = messageCost()
+        try:
+            messageCost.setValue(5)
+            msg = ircmsgs.privmsg('#foo', 'bar')
+            self.assertEqual(self.irc.queue.penalty(msg),
+                             5 + len(str(msg)) / 120.0)
+        finally:
+            messageCost.setValue(original)
+
+    def testNextTakeTime(self):
+        while self.irc.takeMsg() is not None:
+            pass
+        self.assertEqual(self.irc.nextTakeTime(), None)
+        self.irc.sendMsg(ircmsgs.ping('foo'))
+        self.assertEqual(self.irc.nextTakeTime(), 0)
+
     def testNoMsgLongerThan512(self):
         self.irc.queueMsg(ircmsgs.privmsg('whocares', 'x'*1000))
         msg = self.irc.takeMsg()
@@ -440,6 +603,40 @@ class IrcTestCase(SupyTestCase):
         self.irc.feedMsg(msg2)
         self.assertEqual(list(self.irc.state.history), [msg1, msg2])
 
+    def testOnlyInterestedCallbacksAreCalled(self):
+        class Joins(irclib.IrcCallback):
+            def __init__(self):
+                self.L = []
+            def doJoin(self, irc, msg):
+                self.L.append(msg)
+        class Everything(irclib.IrcCallback):
+            def __init__(self):
+                self.L = []
+            def __call__(self, irc, msg):
+                self.L.append(msg)
+            def inFilter(self, irc, msg):
+                if msg.command == 'NOTICE':
+                    return ircmsgs.IrcMsg(msg=msg, command='JOIN')
+                return msg
+        irc = irclib.Irc('test', callbacks=[])
+        try:
+            joins = Joins()
+            everything = Everything()
+            irc.addCallback(joins)
+            irc.addCallback(everything)
+            self.assertEqual(irc._getInFilters(), [everything])
+            self.assertEqual(irc._getOutFilters(), [])
+            self.assertEqual(irc._getHandlers('PRIVMSG'), [everything])
+            irc.feedMsg(ircmsgs.privmsg('#foo', 'bar', prefix='a!b@c'))
+            irc.feedMsg(ircmsgs.join('#foo', prefix='a!b@c'))
+            irc.feedMsg(ircmsgs.notice('#foo', 'bar', prefix='a!b@c'))
+            self.assertEqual(len(joins.L), 2)
+            self.assertEqual(len(everything.L), 3)
+            irc.removeCallback('Joins')
+            self.assertEqual(irc._getHandlers('JOIN'), [everything])
+        finally:
+            irc._reallyDie()
+
 
 class IrcCallbackTestCase(SupyTestCase):
     class FakeIrc:
@@ -127,6 +127,26 @@ class IrcMsgTestCase(SupyTestCase):
         m.tag('repliedTo', 12)
         self.assertEqual(m.repliedTo, 12)
 
+    def testTagsAreCopiedWithMsg(self):
+        m = ircmsgs.privmsg('foo', 'bar')
+        m2 = ircmsgs.IrcMsg(msg=m, command='NOTICE')
+        self.assertEqual(m2.tags, {})
+        m.tag('foo')
+        m3 = ircmsgs.IrcMsg(msg=m, command='NOTICE')
+        m3.tag('bar')
+        self.failUnless(m3.foo)
+        self.failIf(m.bar)
+        self.failIf(m2.foo)
+
+    def testHostmaskParts(self):
+        m = ircmsgs.IrcMsg(':foo!bar@baz PRIVMSG #qux :hi')
+        self.assertEqual((m.nick, m.user, m.host), ('foo', 'bar', 'baz'))
+        m = ircmsgs.IrcMsg(msg=m, prefix='a!b@c')
+        self.assertEqual((m.nick, m.user, m.host), ('a', 'b', 'c'))
+        m = ircmsgs.IrcMsg(':irc.example.net 001 foo :Welcome')
+        self.assertEqual(m.nick, 'irc.example.net')
+        self.assertEqual(m.host, 'irc.example.net')
+
 class FunctionsTestCase(SupyTestCase):
     def testIsAction(self):
         L = [':jemfinch!~jfincher@ts26-2.homenet.ohio-state.edu PRIVMSG'
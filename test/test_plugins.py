@@ -32,3 +32,87 @@ from supybot.test import *
 
 import supybot.irclib as irclib
 import supybot.plugins as plugins
+
+class TestJournaledDB(plugins.JournaledChannelUserDB):
+    def serialize(self, v):
+        return [v]
+
+    def deserialize(self, channel, id, L):
+        return L[0]
+
+class JournaledChannelUserDBTestCase(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.filename = conf.supybot.directories.data.dirize('Journaled.db')
+        for suffix in ('', '.journal', '.journal.old'):
+            if os.path.exists(self.filename + suffix):
+                os.remove(self.filename + suffix)
+
+    def testFlushOnlyAppendsToJournal(self):
+        db = TestJournaledDB(self.filename)
+        db['#foo', 1] = 'bar'
+        db['#foo', 'baz'] = 'qux'
+        db.flush()
+        self.failIf(os.path.exists(self.filename))
+        db['#foo', 1] = 'bar2'
+        del db['#foo', 'baz']
+        db.flush()
+        db = TestJournaledDB(self.filename)
+        self.assertEqual(db['#foo', 1], 'bar2')
+        self.failIf(('#foo', 'baz') in db)
+
+    def testSnapshot(self):
+        db = TestJournaledDB(self.filename)
+        db.minJournalSize = 10
+        for i in xrange(20):
+            db['#foo', i % 5] = str(i)
+            db.flush()
+        db.snapshotThread.join()
+        self.failUnless(os.path.exists(self.filename))
+        self.failIf(os.path.exists(self.filename + '.journal.old'))
+        self.failUnless(db.journaled < 10)
+        db.close()
+        self.failIf(os.path.exists(self.filename + '.journal'))
+        db = TestJournaledDB(self.filename)
+        self.assertEqual(len(db), 5)
+        self.assertEqual(db['#foo', 4], '19')
+
+    def testSnapshotOfEmptyDB(self):
+        db = TestJournaledDB(self.filename)
+        db['#foo', 1] = 'bar'
+        db.close()
+        db = TestJournaledDB(self.filename)
+        del db['#foo', 1]
+        db.close()
+        self.failIf(os.path.exists(self.filename + '.journal'))
+        self.failIf(os.path.exists(self.filename + '.journal.old'))
+        db = TestJournaledDB(self.filename)
+        self.failIf(('#foo', 1) in db)
+        self.assertEqual(len(db), 0)
+
+    def testReplaysOldJournal(self):
+        db = TestJournaledDB(self.filename)
+        db['#foo', 1] = 'bar'
+        db.flush()
+        # As if we'd died while writing a snapshot.
+        os.rename(self.filename + '.journal', self.filename + '.journal.old')
+        db['#foo', 2] = 'baz'
+        db.flush()
+        db = TestJournaledDB(self.filename)
+        self.assertEqual(db['#foo', 1], 'bar')
+        self.assertEqual(db['#foo', 2], 'baz')
+
+    def testMutable(self):
+        class MutableDB(TestJournaledDB):
+            mutable = True
+            def serialize(self, v):
+                return v
+            def deserialize(self, channel, id, L):
+                return L
+        db = MutableDB(self.filename)
+        db['#foo', 1] = ['a']
+        db.flush()
+        db['#foo', 1].append('b')
+        db.flush()
+        db = MutableDB(self.filename)
+        self.assertEqual(db['#foo', 1], ['a', 'b'])
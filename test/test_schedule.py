@@ -73,6 +73,16 @@ class TestSchedule(SupyTestCase):
         sched.run()
         self.assertEqual(i[0], 1)
 
+    def testNextEventTime(self):
+        sched = schedule.Schedule()
+        self.assertEqual(sched.nextEventTime(), None)
+        t = time.time()
+        sched.addEvent(lambda : None, t + 10)
+        sched.addEvent(lambda : None, t + 5, 'soon')
+        self.assertEqual(sched.nextEventTime(), t + 5)
+        sched.removeEvent('soon')
+        self.assertEqual(sched.nextEventTime(), t + 10)
+
 
 # vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
 
@@ -1121,7 +1121,59 @@ class TestCacheDict(SupyTestCase):
             self.failUnless(len(d) <= max)
             self.failUnless(i in d)
             self.failUnless(d[i] == i)
-            
+
+class TestLRUCache(SupyTestCase):
+    def testMaxNeverExceeded(self):
+        max = 10
+        d = LRUCache(max)
+        for i in xrange(max**2):
+            d[i] = i
+            self.failUnless(len(d) <= max)
+            self.failUnless(i in d)
+            self.failUnless(d[i] == i)
+        self.assertEqual(d.evictions, max**2 - max)
+
+    def testEvictsLeastRecentlyUsed(self):
+        d = LRUCache(3)
+        d['a'] = 1
+        d['b'] = 2
+        d['c'] = 3
+        self.assertEqual(d['a'], 1)
+        d['d'] = 4
+        self.failIf('b' in d)
+        self.assertEqual(sorted(d.keys()), ['a', 'c', 'd'])
+        d['c'] = 5
+        d['e'] = 6
+        self.failIf('a' in d)
+        self.assertEqual(sorted(d.keys()), ['c', 'd', 'e'])
+        self.assertEqual(d['c'], 5)
+
+    def testStats(self):
+        d = LRUCache(2)
+        d[1] = 1
+        self.assertEqual(d[1], 1)
+        self.assertRaises(KeyError, d.__getitem__, 2)
+        self.failIf(2 in d) # Membership tests aren't lookups.
+        self.assertEqual((d.hits, d.misses, d.evictions), (1, 1, 0))
+        self.failUnless(d.stats().startswith('1/2 items'))
+
+    def testDelAndPop(self):
+        d = LRUCache(3)
+        for i in range(3):
+            d[i] = i
+        del d[1]
+        self.assertEqual(d.pop(2), 2)
+        self.assertEqual(d.pop(2, None), None)
+        self.assertEqual(d.items(), [(0, 0)])
+        d[3] = 3
+        d[4] = 4
+        d[5] = 5
+        self.failIf(0 in d)
+        d.clear()
+        self.assertEqual(len(d), 0)
+        d[6] = 6
+        self.assertEqual(d.items(), [(6, 6)])
+
 
 # vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
 